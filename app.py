@@ -1,54 +1,158 @@
 import os
 import sys
+import time
 import numpy as np
 import pandas as pd
-from flask import Flask, render_template, request
-import pickle
+from flask import Flask, Response, g, jsonify, render_template, request
 
 
 
-from mushroom.pipeline.prediction_pipeline import CustomData, PredictionPipeline
+from mushroom.constants import CLASS_LABELS
+from mushroom.exception import MushroomException
+from mushroom.logger import logging, setup_logging
+from mushroom.pipeline.feature_schema import InvalidInputError, SchemaValidationError
+from mushroom.pipeline.model_registry import ModelRegistryConfig, get_model_registry
+from mushroom.pipeline.prediction_cache import PredictionCache, PredictionCacheConfig
+from mushroom.pipeline.prediction_pipeline import PredictionPipeline, PredictionPipelineConfig
+from mushroom.pipeline.serving_metrics import generate_metrics, record_request
 
 
+setup_logging()
+
 application = Flask(__name__)
 
 app = application
 
+# Load the preprocessor and model once per worker; requests share the cached copy.
+# MUSHROOM_RUNTIME=portable serves the numpy-only runtime exported by the compiler instead
+get_model_registry(ModelRegistryConfig(runtime=os.environ.get("MUSHROOM_RUNTIME", "full"))).warm_up()
+predict_pipeline = PredictionPipeline(
+    config=PredictionPipelineConfig(
+        micro_batch_max_size=int(os.environ.get("MUSHROOM_MICRO_BATCH_MAX_SIZE", 64)),
+        micro_batch_max_wait_ms=float(os.environ.get("MUSHROOM_MICRO_BATCH_MAX_WAIT_MS", 2.0)),
+        # "flag" answers batches with invalid rows, leaving those rows without a label
+        invalid_rows=os.environ.get("MUSHROOM_INVALID_ROWS", "reject")
+    ),
+    # "redis" shares warm entries between the gunicorn workers
+    prediction_cache=PredictionCache(PredictionCacheConfig(
+        backend=os.environ.get("MUSHROOM_PREDICTION_CACHE_BACKEND", "local"),
+        redis_url=os.environ.get("MUSHROOM_REDIS_URL", PredictionCacheConfig.redis_url)
+    ))
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Labelled by route pattern, not by path, so the number of series stays bounded
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    record_request(route, request.method, str(response.status_code), time.perf_counter() - g.request_start_time)
+    return response
+
+# Answer to a prediction that failed on the server side, the details only go to the log
+SERVER_ERROR_MESSAGE = "The prediction failed on the server, please try again later"
+
+def log_server_error(e):
+    logging.error(f"Prediction failed on {request.path}: {e}")
+
+def error_response(e):
+    # Invalid inputs are client errors, reported per field by the schema; anything else is a
+    # fault of the service, logged and answered without its internal details
+    if isinstance(e, InvalidInputError):
+        body = {"error": str(e)}
+        if isinstance(e, SchemaValidationError):
+            body["fields"] = e.errors
+        return jsonify(body), 400
+    log_server_error(e)
+    return jsonify({"error": SERVER_ERROR_MESSAGE}), 500
+
+def form_fields():
+    # The input columns of the served model and their levels, whichever feature selection picked
+    try:
+        schema = predict_pipeline.registry.get().schema
+    except MushroomException:
+        return []
+    return [(column, [level for level in levels if level is not None]) for column, levels in zip(schema.columns, schema.levels)]
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics of this worker, or of every gunicorn worker when
+    PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py).
+    """
+    data, content_type = generate_metrics()
+    return Response(data, content_type=content_type)
+
 # route for home page
 @app.route('/')
 def index():
-    return render_template('form.html')
+    return render_template('form.html', fields=form_fields())
 
 @app.route('/predict_datapoint', methods=['GET','POST'])
 def predict_datapoint():
     if request.method == 'GET':
-        return render_template('form.html')
+        return render_template('form.html', fields=form_fields())
     
-    else:
-        data = CustomData(
-            bruises = request.form.get("bruises"),
-            gill_spacing = request.form.get("gill-spacing"),
-            gill_size = request.form.get("gill-size"),
-            gill_color = request.form.get("gill-color"),
-            stalk_root = request.form.get("stalk-root"),
-            ring_type = request.form.get("ring-type"),
-            spore_print_color = request.form.get("spore-print-color")
-        )
+    elif request.is_json:
+        # A single record keyed by feature name, answered with JSON
+        record = request.get_json()
+        if not isinstance(record, dict):
+            return error_response(InvalidInputError("Expected a JSON object keyed by feature name"))
+        try:
+            result = predict_pipeline.predict_record(record)
+        except MushroomException as e:
+            return error_response(e)
         
-        preprocessor = pickle.load(open('/Mushroom_classification/artifacts/data_transformation/preprocessor.pkl','rb'))
-        model = pickle.load(open('/Mushroom_classification/artifacts/model_trainer/model.pkl', 'rb'))
-        
-        pred_df = data.get_data_as_data_frame()
-        
-        pred_df = preprocessor.transform(pred_df)
-        results = model.predict(pred_df)
+        return jsonify({"label": CLASS_LABELS[result]})
+    
+    else:
+        # Only the input columns of the model are read from the form
+        try:
+            results = predict_pipeline.predict_record(request.form.to_dict())
+        except InvalidInputError as e:
+            return render_template('form.html', fields=form_fields(), errors=getattr(e, "errors", None), message=str(e)), 400
+        except MushroomException as e:
+            log_server_error(e)
+            return render_template('form.html', fields=form_fields(), message=SERVER_ERROR_MESSAGE), 500
         
         if results == 0.0:
             answer = "edible"
         else:
             answer = "poisonous"
             
-        return render_template('form.html',results=answer)
+        return render_template('form.html', fields=form_fields(), results=answer)
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """
+    Predicts many mushrooms in one request. Accepts either a JSON list of records
+    (or {"records": [...]}) keyed by feature name, or CSV data with a header row sent
+    as the request body (Content-Type: text/csv) or as an uploaded "file".
+    """
+    chunk_size = request.args.get("chunk_size", type=int)
+    
+    if request.is_json:
+        records = request.get_json()
+        if isinstance(records, dict):
+            records = records.get("records", [])
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            return error_response(InvalidInputError("Expected a JSON list of objects keyed by feature name"))
+    elif "file" in request.files:
+        records = request.files["file"].stream
+    else:
+        records = request.stream
+        
+    try:
+        predictions = predict_pipeline.predict_batch(records, chunk_size=chunk_size)
+    except MushroomException as e:
+        return error_response(e)
+    
+    return jsonify({
+        "model_version": predictions.attrs["model_version"],
+        "predictions": predictions.to_dict(orient="records")
+    })
     
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8080)  
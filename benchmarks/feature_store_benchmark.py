@@ -0,0 +1,98 @@
+"""
+Compares the feature store formats on end-to-end ingestion: reading the source CSV, writing
+raw/train/test, and reading back the columns DataTransformation uses.
+
+Every format runs in a fresh process so that its peak RSS is measured on its own.
+
+    python benchmarks/feature_store_benchmark.py --scale 20 --output feature_store_benchmark.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mushroom.constants import FEATURE_COLUMNS, TARGET_COLUMN
+from mushroom.utils.feature_store import FEATURE_STORE_FORMATS
+
+SOURCE_DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "notebooks", "mushroom_data.csv")
+
+
+def run_format(file_format, source_data_path, work_dir, queue):
+    # Artifacts are written relative to the working directory
+    os.chdir(work_dir)
+
+    from mushroom.components.data_ingestion import DataIngestion
+    from mushroom.utils.feature_store import read_feature_store
+
+    start_time = time.perf_counter()
+
+    data_ingestion = DataIngestion()
+    data_ingestion.ingestion_config.source_data_path = source_data_path
+    data_ingestion.ingestion_config.feature_store_format = file_format
+    train_path, test_path = data_ingestion.initiate_data_ingestion()
+    ingestion_time = time.perf_counter() - start_time
+
+    read_start_time = time.perf_counter()
+    columns = list(FEATURE_COLUMNS) + [TARGET_COLUMN]
+    train_df = read_feature_store(train_path, columns=columns)
+    test_df = read_feature_store(test_path, columns=columns)
+    read_time = time.perf_counter() - read_start_time
+
+    queue.put({
+        "format": file_format,
+        "rows": len(train_df) + len(test_df),
+        "ingestion_seconds": ingestion_time,
+        "read_seconds": read_time,
+        "total_seconds": ingestion_time + read_time,
+        "feature_store_bytes": os.path.getsize(train_path) + os.path.getsize(test_path),
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1, help="Repeat the dataset this many times")
+    parser.add_argument("--formats", nargs="+", default=list(FEATURE_STORE_FORMATS))
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_data_path = SOURCE_DATA_PATH
+        if args.scale > 1:
+            source_data_path = os.path.join(work_dir, "source.csv")
+            pd.concat([pd.read_csv(SOURCE_DATA_PATH)] * args.scale).to_csv(source_data_path, index=False)
+
+        for file_format in args.formats:
+            format_dir = os.path.join(work_dir, file_format)
+            os.makedirs(format_dir)
+
+            queue = context.Queue()
+            process = context.Process(target=run_format, args=(file_format, source_data_path, format_dir, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+
+    for result in results:
+        print(f"{result['format']:<8} {result['rows']:>9} rows  total {result['total_seconds']:>7.3f}s  "
+              f"(ingest {result['ingestion_seconds']:.3f}s, read {result['read_seconds']:.3f}s)  "
+              f"{result['feature_store_bytes'] / 1e6:>7.2f} MB on disk  peak RSS {result['peak_rss_mb']:.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as file_obj:
+            json.dump(results, file_obj, indent=2)
+
+
+if __name__ == "__main__":
+    main()
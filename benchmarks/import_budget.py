@@ -0,0 +1,104 @@
+"""
+Checks the import cost of the package entry points against budgets. Every entry point is
+imported in a fresh interpreter under `python -X importtime`; the check fails when its
+cumulative import time exceeds the budget or when it imports a library it must only load on
+first use (serving code must not pull in the training libraries, the training pipeline must
+not import MLflow, XGBoost or CatBoost before training starts).
+
+The fastest of --repeat runs is compared, budgets can be scaled for slower machines. The app
+is imported with the portable runtime and loads the artifacts of --workdir when there are any.
+Exits with status 1 when a budget is exceeded. CI runs the same checks as the tests of
+tests/test_import_budget.py.
+
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --scale 2 --output import_budget.json
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TRAINING_LIBRARIES = ("sklearn", "scipy", "xgboost", "catboost", "mlflow", "joblib", "dill")
+DEFERRED_TRAINING_LIBRARIES = ("xgboost", "catboost", "mlflow")
+
+# (entry point, module, environment, budget in milliseconds, libraries it must not import)
+ENTRY_POINTS = (
+    ("logger", "mushroom.logger", {}, 50, TRAINING_LIBRARIES + ("pandas",)),
+    ("prediction_pipeline", "mushroom.pipeline.prediction_pipeline", {}, 900, TRAINING_LIBRARIES),
+    ("app_portable", "app", {"MUSHROOM_RUNTIME": "portable"}, 1500, TRAINING_LIBRARIES),
+    ("training_pipeline", "mushroom.pipeline.training_pipeline", {}, 3000, DEFERRED_TRAINING_LIBRARIES),
+)
+
+
+def measure_import(module, env, forbidden, workdir):
+    """
+    Imports module in a fresh interpreter and returns its cumulative import time in
+    milliseconds and the forbidden libraries it loaded.
+    """
+    script = f"import sys, json; import {module}; print(json.dumps([name for name in {list(forbidden)!r} if name in sys.modules]))"
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=workdir,
+        env={**os.environ, "PYTHONPATH": ROOT_DIR, **env},
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    cumulative_us = None
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented, the entry point itself is not (the header is not a number)
+        if name.rstrip() == f" {module}" and cumulative.strip().isdigit():
+            cumulative_us = int(cumulative)
+
+    loaded = json.loads(process.stdout.strip().splitlines()[-1])
+    return cumulative_us / 1000, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workdir", default=os.getcwd(), help="Directory holding the artifacts directory")
+    parser.add_argument("--repeat", type=int, default=3, help="Imports per entry point, the fastest one counts")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget by this factor")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for entry_point, module, env, budget_ms, forbidden in ENTRY_POINTS:
+        runs = [measure_import(module, env, forbidden, args.workdir) for _ in range(args.repeat)]
+        import_ms = min(import_ms for import_ms, _ in runs)
+        loaded = sorted(set().union(*(loaded for _, loaded in runs)))
+        budget_ms = budget_ms * args.scale
+
+        results.append({
+            "entry_point": entry_point,
+            "module": module,
+            "import_ms": import_ms,
+            "budget_ms": budget_ms,
+            "forbidden_imports": loaded,
+            "ok": import_ms <= budget_ms and not loaded
+        })
+
+    for result in results:
+        status = "ok" if result["ok"] else "OVER BUDGET"
+        line = f"{result['entry_point']:<20} {result['import_ms']:>8.1f}ms  budget {result['budget_ms']:>7.0f}ms  {status}"
+        if result["forbidden_imports"]:
+            line += f"  imports {', '.join(result['forbidden_imports'])}"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as file_obj:
+            json.dump(results, file_obj, indent=2)
+
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
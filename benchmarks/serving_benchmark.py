@@ -0,0 +1,208 @@
+"""
+Measures the serving path on the trained artifacts: PredictionPipeline called in-process and
+app.py driven through the Flask test client, for single records and batches of records drawn
+from notebooks/mushroom_data.csv. Every scenario reports p50/p95/p99 latency per call and rows
+per second; every serving mode runs in a fresh process that also reports its startup time
+(imports and model warm-up) and peak RSS.
+
+Run it from the directory holding the artifacts, or point --workdir at it. With --compare the
+results are checked against an earlier JSON output and the script exits with status 1 when a
+scenario got slower than --tolerance allows.
+
+    python benchmarks/serving_benchmark.py --output serving_benchmark.json
+    python benchmarks/serving_benchmark.py --compare serving_benchmark.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+SOURCE_DATA_PATH = os.path.join(ROOT_DIR, "notebooks", "mushroom_data.csv")
+SERVING_MODES = ("pipeline", "flask")
+
+
+def load_records(columns, n_rows, seed):
+    """
+    Samples complete records of the model's input columns, the form only offers known levels.
+    """
+    df = pd.read_csv(SOURCE_DATA_PATH, usecols=columns).dropna()
+    return df.sample(n=n_rows, replace=n_rows > len(df), random_state=seed).reset_index(drop=True)
+
+
+def get_profile(preprocessor):
+    encoder = preprocessor.transformers_[0][1]
+    output = getattr(encoder, "output", None)
+    return {"codes": "ordinal", "categorical": "native"}.get(output, "onehot")
+
+
+def time_calls(call, inputs, warmup):
+    for value in inputs[:warmup]:
+        call(value)
+
+    latencies = []
+    for value in inputs:
+        start_time = time.perf_counter()
+        call(value)
+        latencies.append(time.perf_counter() - start_time)
+    return np.asarray(latencies)
+
+
+def run_mode(mode, use_lookup_table, workdir, batch_sizes, iterations, warmup, seed, queue):
+    # The artifacts are loaded relative to the working directory
+    os.chdir(workdir)
+    start_time = time.perf_counter()
+
+    if mode == "flask":
+        import app as flask_app
+        pipeline = flask_app.predict_pipeline
+        client = flask_app.app.test_client()
+    else:
+        from mushroom.pipeline.prediction_pipeline import PredictionPipeline
+        pipeline = PredictionPipeline()
+        pipeline.registry.warm_up()
+    pipeline.prediction_config.use_lookup_table = use_lookup_table
+    # Sampled records repeat, cached labels would hide the model path being measured
+    pipeline.prediction_cache = None
+
+    startup_time = time.perf_counter() - start_time
+    bundle = pipeline.registry.get()
+
+    records = load_records(pipeline.feature_columns(bundle), max(batch_sizes) * iterations, seed)
+    scenarios = []
+
+    # Single records
+    rows = records.head(iterations).to_dict(orient="records")
+    if mode == "flask":
+        latencies = time_calls(lambda row: client.post("/predict_datapoint", data=row), rows, warmup)
+    else:
+        latencies = time_calls(pipeline.predict_record, rows, warmup)
+    scenarios.append(("record", 1, latencies))
+
+    # Batches
+    for batch_size in batch_sizes:
+        batches = [records.iloc[start:start + batch_size] for start in range(0, batch_size * iterations, batch_size)]
+        if mode == "flask":
+            batches = [batch.to_dict(orient="records") for batch in batches]
+            latencies = time_calls(lambda batch: client.post("/predict_batch", json=batch), batches, warmup)
+        else:
+            latencies = time_calls(pipeline.predict_batch, batches, warmup)
+        scenarios.append((f"batch_{batch_size}", batch_size, latencies))
+
+    results = []
+    for scenario, batch_size, latencies in scenarios:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e3
+        results.append({
+            "mode": mode,
+            "lookup_table": use_lookup_table and bundle.lookup_table is not None,
+            "scenario": scenario,
+            "batch_size": batch_size,
+            "iterations": len(latencies),
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "p99_ms": p99,
+            "mean_ms": latencies.mean() * 1e3,
+            "rows_per_second": batch_size * len(latencies) / latencies.sum(),
+            "startup_seconds": startup_time,
+            # ru_maxrss is reported in kilobytes on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        })
+
+    queue.put({
+        "model_version": bundle.version,
+        "model": type(bundle.model).__name__,
+        "preprocessing_profile": get_profile(bundle.preprocessor),
+        "results": results
+    })
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a line per scenario that is slower than the baseline by more than tolerance.
+    """
+    key = lambda result: (result["mode"], result["lookup_table"], result["scenario"])
+    baseline_results = {key(result): result for result in baseline["results"]}
+
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(key(result))
+        if previous is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{'/'.join(map(str, key(result)))} {metric} {previous[metric]:.3f} -> {result[metric]:.3f}")
+        if result["rows_per_second"] < previous["rows_per_second"] / (1 + tolerance):
+            regressions.append(f"{'/'.join(map(str, key(result)))} rows_per_second "
+                               f"{previous['rows_per_second']:.0f} -> {result['rows_per_second']:.0f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workdir", default=os.getcwd(), help="Directory holding the artifacts directory")
+    parser.add_argument("--modes", nargs="+", default=list(SERVING_MODES), choices=SERVING_MODES)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[10, 100, 1000])
+    parser.add_argument("--iterations", type=int, default=100, help="Timed calls per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed calls before each scenario")
+    parser.add_argument("--no-lookup-table", action="store_true", help="Also measure every mode without the lookup table")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Earlier JSON output to check the results against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown for --compare")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": []
+    }
+
+    lookup_table_settings = (True, False) if args.no_lookup_table else (True,)
+    for mode in args.modes:
+        for use_lookup_table in lookup_table_settings:
+            queue = context.Queue()
+            process = context.Process(
+                target=run_mode,
+                args=(mode, use_lookup_table, os.path.abspath(args.workdir), args.batch_sizes,
+                      args.iterations, args.warmup, args.seed, queue)
+            )
+            process.start()
+            mode_report = queue.get()
+            process.join()
+
+            report.update({name: mode_report[name] for name in ("model_version", "model", "preprocessing_profile")})
+            report["results"].extend(mode_report["results"])
+
+    print(f"Model {report['model']} ({report['preprocessing_profile']} preprocessing), version {report['model_version']}")
+    for result in report["results"]:
+        print(f"{result['mode']:<8} {'lookup' if result['lookup_table'] else 'model':<6} {result['scenario']:<10} "
+              f"p50 {result['p50_ms']:>8.3f}ms  p95 {result['p95_ms']:>8.3f}ms  p99 {result['p99_ms']:>8.3f}ms  "
+              f"{result['rows_per_second']:>10.0f} rows/s  startup {result['startup_seconds']:.2f}s  "
+              f"peak RSS {result['peak_rss_mb']:.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as file_obj:
+            json.dump(report, file_obj, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file_obj:
+            regressions = compare(report["results"], json.load(file_obj), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,36 @@
-from mushroom.pipeline.training_pipeline import TrainPipeline
-obj = TrainPipeline()
+import argparse
 
+from mushroom.logger import setup_logging
+from mushroom.components.feature_selection import FEATURE_RANKINGS
+from mushroom.utils.experiment_tracker import EXPERIMENT_TRACKING_MODES
+from mushroom.pipeline.training_pipeline import FEATURE_SELECTION_MODES, TrainPipeline, TrainPipelineConfig
 
-obj.run_pipeline()
+parser = argparse.ArgumentParser(description="Train the mushroom classifier")
+parser.add_argument("--force", action="store_true", help="recompute every stage, ignoring cached results")
+parser.add_argument("--profile-stage", help="run this stage under a profiler, e.g. model_search")
+parser.add_argument("--profiler", default="cprofile", choices=["cprofile", "pyinstrument"])
+parser.add_argument("--incremental", metavar="CSV", help="update the trained model with the labelled rows of this file")
+parser.add_argument("--drift-threshold", type=float, default=0.3, help="drift of the new rows that triggers full retraining")
+parser.add_argument("--feature-selection", default="off", choices=FEATURE_SELECTION_MODES,
+                    help="off keeps the EDA columns, run selects the model's columns from all of them, reuse takes the last selection")
+parser.add_argument("--feature-ranking", default="model_importance", choices=FEATURE_RANKINGS, help="score the columns are ranked by")
+parser.add_argument("--tracking", default="async", choices=EXPERIMENT_TRACKING_MODES,
+                    help="log the MLflow runs in the background, in line or not at all")
+args = parser.parse_args()
+setup_logging()
+
+obj = TrainPipeline(TrainPipelineConfig(
+    force=args.force,
+    profile_stage=args.profile_stage,
+    profiler=args.profiler,
+    drift_threshold=args.drift_threshold,
+    feature_selection=args.feature_selection,
+    feature_ranking=args.feature_ranking,
+    experiment_tracking=args.tracking
+))
+
+
+if args.incremental:
+    obj.run_incremental(args.incremental)
+else:
+    obj.run_pipeline()
@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+
+bind = "0.0.0.0:8080"
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+# Threads per worker: concurrent requests of a worker are coalesced by the micro-batcher
+# (MUSHROOM_MICRO_BATCH_MAX_SIZE / MUSHROOM_MICRO_BATCH_MAX_WAIT_MS) into one model call
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+# app.py is imported once in the master, which loads the model artifacts from the registry;
+# forked workers start serving right away and share those pages until they write to them
+preload_app = True
+
+# Metrics aggregation across workers: "shared" sums every worker's values through memory-mapped
+# files, "per_worker" leaves each worker reporting only its own values
+metrics_mode = os.environ.get("MUSHROOM_METRICS_MODE", "shared")
+if metrics_mode == "shared" and not os.environ.get("MUSHROOM_METRICS_DIR_READY"):
+    # Set in the master, so every forked worker writes to the same directory
+    multiprocess_dir = os.environ.setdefault(
+        "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "mushroom-metrics")
+    )
+    # Values of a previous run of the service would otherwise be added to the new ones. Cleared
+    # here rather than in on_starting, the preloaded app has written its values by then; the
+    # marker keeps a configuration reload (SIGHUP) from clearing the values of running workers
+    shutil.rmtree(multiprocess_dir, ignore_errors=True)
+    os.makedirs(multiprocess_dir)
+    os.environ["MUSHROOM_METRICS_DIR_READY"] = "1"
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
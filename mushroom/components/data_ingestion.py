@@ -4,22 +4,67 @@ import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from dataclasses import dataclass
+from mushroom import constants
+from mushroom.constants import FEATURE_COLUMNS, TARGET_COLUMN
 from mushroom.exception import MushroomException
 from mushroom.logger import logging
+from mushroom.utils.artifact_writer import ArtifactWriter
+from mushroom.utils.instrumentation import StageTimer
+from mushroom.utils import feature_store
+from mushroom.utils.feature_store import get_feature_store_path, write_feature_store, read_feature_store
+
+# Column of the appended data store holding the split every row was appended to
+APPENDED_SPLIT_COLUMN = "_split"
 
 
 @dataclass
 class DataIngestionConfig:
     raw_data_path: str = os.path.join('artifacts', 'data_ingestion', 'raw')
     train_data_path: str = os.path.join('artifacts', 'data_ingestion', 'feature_store')
+    shard_data_path: str = os.path.join('artifacts', 'data_ingestion', 'shards')
+    # Rows added by append_data, kept with every column they came with and merged with the
+    # source by every full ingestion
+    appended_data_path: str = os.path.join('artifacts', 'data_ingestion', 'appended')
+    source_data_path: str = "/Mushroom_classification/notebooks/mushroom_data.csv"
+    # File format of the raw, train and test data: "parquet", "feather" or "csv"
+    feature_store_format: str = "parquet"
+    test_size: float = 0.25
+    # Feature columns read from the source with the target, None reads every column (for
+    # feature selection). The other columns are never parsed
+    feature_columns: tuple = tuple(FEATURE_COLUMNS)
+    # Rows read at a time by the streaming ingestion, bounds its memory use
+    chunk_size: int = 100_000
+    
+    def get_usecols(self):
+        if self.feature_columns is None:
+            return None
+        return list(self.feature_columns) + [TARGET_COLUMN]
     
     def __post_init__(self):
         # Create directories for raw data and train/test data
         os.makedirs(self.raw_data_path, exist_ok=True)
         os.makedirs(self.train_data_path, exist_ok=True)
+        os.makedirs(self.shard_data_path, exist_ok=True)
+        os.makedirs(self.appended_data_path, exist_ok=True)
         logging.info('Created data ingestion configuration and directories')
 
 
+def get_test_split_mask(df, test_size, index=False):
+    """
+    Description: This function assigns rows to the test set by hashing their values, so a row
+    ends up in the same split no matter which chunk it is read in or how large the file is
+
+    df: The rows to split
+    test_size: The fraction of rows assigned to the test set
+    index: Whether the row index is hashed too. Without it identical rows share a split, which
+    leaves whole levels out of the train set when few columns are read
+
+    returns: A boolean array, True for the rows of the test set
+    """
+    hashes = pd.util.hash_pandas_object(df, index=index).to_numpy()
+    return hashes % 10_000 < int(round(test_size * 10_000))
+
+
 class DataIngestion:
     def __init__(self):
         """
@@ -28,44 +73,265 @@ class DataIngestion:
         """
         self.ingestion_config = DataIngestionConfig()
 
-    def initiate_data_ingestion(self):
+    def get_appended_file_path(self):
+        config = self.ingestion_config
+        return get_feature_store_path(config.appended_data_path, 'appended', config.feature_store_format)
+
+    def read_appended_data(self, columns):
         """
-        This method initiates the data ingestion and loads the mushroom dataset from notebooks directory
-        and saves it in raw_data.csv in the raw directory. Further it splits the dataset into
-        train and test sets and saves them in the train_test directory.
+        This method loads the rows added by append_data, as strings, in the split they were
+        appended to. Columns the appended rows were sent without are left missing.
 
-        Args: None
+        Args:
+            columns (list): The columns to load, those of the source data.
 
-        Returns: Tuple of two strings. The first string is the path of the train data and the second string
-        is the path of the test data
+        Returns: Tuple of the appended train rows and test rows, None when no rows were appended
+        """
+        appended_file_path = self.get_appended_file_path()
+        if not os.path.exists(appended_file_path):
+            return None
+
+        appended = read_feature_store(appended_file_path).astype(object)
+        test_mask = (appended[APPENDED_SPLIT_COLUMN] == "test").to_numpy()
+        missing_columns = [column for column in columns if column not in appended.columns]
+        if missing_columns:
+            logging.warning(f"Appended rows have no {missing_columns} columns, they are left missing")
+        appended = appended.reindex(columns=columns)
+
+        return appended[~test_mask], appended[test_mask]
+
+    @StageTimer("data_ingestion", rows=lambda result: len(result[0]) + len(result[1]))
+    def ingest_data(self, artifact_writer=None, stage_cache=None):
+        """
+        This method loads the feature columns and the target of the mushroom dataset (see
+        DataIngestionConfig.feature_columns), splits them into train and test sets, adds the rows
+        of append_data to the split they were appended to and hands the raw, train and test data
+        to the artifact writer, which saves them in the raw and feature_store directories in the
+        configured feature store format.
+
+        Args:
+            artifact_writer (ArtifactWriter): Decides whether the data is saved right away, in the
+                background or not at all. Saves synchronously when None.
+            stage_cache (StageCache): Reuses the split of an unchanged source file, config and code.
+
+        Returns: Tuple of the train DataFrame, the test DataFrame, and the paths the train and test
+        data are saved to
         """
         logging.info("Entered the data ingestion method or component")
 
         try:
-            df = pd.read_csv("/Mushroom_classification/notebooks/mushroom_data.csv")
-            logging.info("Read the dataset as dataframe")
+            artifact_writer = artifact_writer or ArtifactWriter()
+            file_format = self.ingestion_config.feature_store_format
 
-            # Save raw data
-            raw_file_path = os.path.join(self.ingestion_config.raw_data_path, 'raw_data.csv')
-            df.to_csv(raw_file_path, index=False, header=True)
-            logging.info('Raw data saved successfully')
+            appended_file_path = self.get_appended_file_path()
+
+            cached = None
+            if stage_cache is not None:
+                fingerprint = stage_cache.fingerprint(
+                    "data_ingestion",
+                    # The code of the split and of the reader of the appended rows
+                    sys.modules[__name__],
+                    feature_store,
+                    constants,
+                    self.ingestion_config,
+                    stage_cache.file_fingerprint(self.ingestion_config.source_data_path),
+                    stage_cache.file_fingerprint(appended_file_path) if os.path.exists(appended_file_path) else None
+                )
+                cached = stage_cache.load("data_ingestion", fingerprint)
+
+            if cached is not None:
+                df, train_set, test_set = cached
+            else:
+                # Every column is categorical, parsing them as such keeps one copy of each level
+                df = pd.read_csv(self.ingestion_config.source_data_path, dtype="category", usecols=self.ingestion_config.get_usecols())
+                logging.info("Read the dataset as dataframe")
 
-            # Split the dataset
-            logging.info('Train test split initiated')
-            train_set, test_set = train_test_split(df, test_size=0.25, random_state=42)
-            logging.info("Train test split completed")
+                # Split the dataset
+                logging.info('Train test split initiated')
+                train_set, test_set = train_test_split(df, test_size=self.ingestion_config.test_size, random_state=42)
+                logging.info("Train test split completed")
+
+                appended = self.read_appended_data(list(df.columns))
+                if appended is not None:
+                    # Numbered after the source rows
+                    appended_df = pd.concat(appended)
+                    appended_df.index = pd.RangeIndex(len(df), len(df) + len(appended_df))
+                    appended_train_set, appended_test_set = appended_df.iloc[:len(appended[0])], appended_df.iloc[len(appended[0]):]
+
+                    df = pd.concat([df, appended_df]).astype("category")
+                    # The levels of the merged data, the split categories must match them
+                    train_set = pd.concat([train_set, appended_train_set]).astype(df.dtypes.to_dict())
+                    test_set = pd.concat([test_set, appended_test_set]).astype(df.dtypes.to_dict())
+                    logging.info(f"Merged {len(appended_df)} appended rows with the source data")
+
+                if stage_cache is not None:
+                    stage_cache.store("data_ingestion", fingerprint, (df, train_set, test_set))
+
+            # Save raw data
+            raw_file_path = get_feature_store_path(self.ingestion_config.raw_data_path, 'raw_data', file_format)
+            artifact_writer.submit(write_feature_store, df, raw_file_path)
+            logging.info('Raw data handed to the artifact writer')
 
             # Save train and test sets
-            train_file_path = os.path.join(self.ingestion_config.train_data_path, 'train.csv')
-            test_file_path = os.path.join(self.ingestion_config.train_data_path, 'test.csv')
-            train_set.to_csv(train_file_path, index=False, header=True)
-            test_set.to_csv(test_file_path, index=False, header=True)
-            logging.info('Train and test sets saved successfully')
+            train_file_path = get_feature_store_path(self.ingestion_config.train_data_path, 'train', file_format)
+            test_file_path = get_feature_store_path(self.ingestion_config.train_data_path, 'test', file_format)
+            artifact_writer.submit(write_feature_store, train_set, train_file_path)
+            artifact_writer.submit(write_feature_store, test_set, test_file_path)
+            logging.info('Train and test sets handed to the artifact writer')
 
             return (
+                train_set,
+                test_set,
                 train_file_path,
                 test_file_path
             )
         
         except Exception as e:
             raise MushroomException(e, sys)
+
+    def initiate_data_ingestion(self, stage_cache=None):
+        """
+        This method initiates the data ingestion and loads the mushroom dataset from notebooks directory
+        and saves it as raw_data in the raw directory. Further it splits the dataset into
+        train and test sets and saves them in the feature_store directory, in the configured
+        feature store format.
+
+        Args:
+            stage_cache (StageCache): Reuses the split of an unchanged source file, config and code.
+
+        Returns: Tuple of two strings. The first string is the path of the train data and the second string
+        is the path of the test data
+        """
+        try:
+            _, _, train_file_path, test_file_path = self.ingest_data(stage_cache=stage_cache)
+
+            return (
+                train_file_path,
+                test_file_path
+            )
+        
+        except Exception as e:
+            raise MushroomException(e, sys)
+
+    @StageTimer("data_ingestion", rows=lambda result: len(result[0]) + len(result[1]))
+    def append_data(self, new_data_path):
+        """
+        This method adds newly labelled rows to the feature store for incremental training. The
+        rows are split with the deterministic hash of get_test_split_mask, so a row sent again
+        later lands in the same split, and are appended to the raw, train and test data. They
+        are also kept, with every column of the file, in the appended data store, which full
+        ingestion merges with the source dataset; the source file itself is not modified.
+
+        Args:
+            new_data_path (str): CSV file of the new rows, with at least the feature and target columns.
+
+        Returns: Tuple of the new train rows, the new test rows, and the paths of the train and
+        test data they were appended to
+        """
+        logging.info("Entered the data append method")
+
+        try:
+            config = self.ingestion_config
+            file_format = config.feature_store_format
+            raw_file_path = get_feature_store_path(config.raw_data_path, 'raw_data', file_format)
+            train_file_path = get_feature_store_path(config.train_data_path, 'train', file_format)
+            test_file_path = get_feature_store_path(config.train_data_path, 'test', file_format)
+
+            new_df = pd.read_csv(new_data_path, dtype=str)
+            required_columns = config.get_usecols() or list(FEATURE_COLUMNS) + [TARGET_COLUMN]
+            missing_columns = [column for column in required_columns if column not in new_df.columns]
+            if missing_columns:
+                raise ValueError(f"New data has no {missing_columns} columns")
+
+            # Strings, so a row hashes the same whatever the other rows of the file are
+            test_mask = get_test_split_mask(new_df, config.test_size)
+            new_train_set, new_test_set = new_df[~test_mask], new_df[test_mask]
+
+            # Written first, so the rows survive a failure below and the next full run
+            appended_file_path = self.get_appended_file_path()
+            appended = new_df.assign(**{APPENDED_SPLIT_COLUMN: np.where(test_mask, "test", "train")})
+            if os.path.exists(appended_file_path):
+                appended = pd.concat([read_feature_store(appended_file_path).astype(object), appended], ignore_index=True)
+            tmp_file_path = get_feature_store_path(config.appended_data_path, 'appended.tmp', file_format)
+            write_feature_store(appended, tmp_file_path)
+            os.replace(tmp_file_path, appended_file_path)
+
+            for file_path, rows in ((raw_file_path, new_df), (train_file_path, new_train_set), (test_file_path, new_test_set)):
+                existing = read_feature_store(file_path)
+                # Columns the feature store has and the new rows lack are left missing
+                combined = pd.concat([existing.astype(object), rows.reindex(columns=existing.columns)], ignore_index=True)
+                write_feature_store(combined, file_path)
+
+            logging.info(f"Appended {len(new_train_set)} train and {len(new_test_set)} test rows to the feature store")
+
+            return (
+                new_train_set,
+                new_test_set,
+                train_file_path,
+                test_file_path
+            )
+
+        except Exception as e:
+            raise MushroomException(e, sys)
+
+    @StageTimer("data_ingestion")
+    def stream_data(self):
+        """
+        This method is the out-of-core version of ingest_data for datasets that do not fit in
+        memory. The source file is read chunk_size rows at a time, every chunk is split with a
+        deterministic hash of its rows and written as a train and a test shard to the shards
+        directory, so at most one chunk is held in memory. The rows added by append_data follow
+        as a last chunk, in the split they were appended to.
+
+        Args: None
+
+        Returns: Tuple of two lists, the paths of the train shards and the paths of the test shards.
+        Raises a ValueError when either split is empty
+        """
+        logging.info("Entered the streaming data ingestion method")
+
+        try:
+            config = self.ingestion_config
+
+            # Shards of an earlier, larger dataset must not be picked up with the new ones
+            for file_name in os.listdir(config.shard_data_path):
+                os.remove(os.path.join(config.shard_data_path, file_name))
+
+            train_shards, test_shards = [], []
+            # Strings rather than categories, their hashes do not depend on the levels of the chunk
+            reader = pd.read_csv(config.source_data_path, dtype=str, usecols=config.get_usecols(), chunksize=config.chunk_size)
+            index, columns = -1, config.get_usecols()
+            for index, chunk in enumerate(reader):
+                columns = list(chunk.columns)
+                # The index of a chunk holds the positions of its rows in the file
+                test_mask = get_test_split_mask(chunk, config.test_size, index=True)
+                self._write_shards(index, chunk[~test_mask], chunk[test_mask], train_shards, test_shards)
+
+            appended = self.read_appended_data(columns)
+            if appended is not None:
+                self._write_shards(index + 1, *appended, train_shards, test_shards)
+
+            # Every later stage needs both splits, the compiler checks on their first shards
+            if not train_shards or not test_shards:
+                raise ValueError(
+                    f"Streaming produced {len(train_shards)} train and {len(test_shards)} test shards, "
+                    f"the source has too few rows for a test_size of {config.test_size}"
+                )
+
+            logging.info(f"Streamed the dataset into {len(train_shards)} train and {len(test_shards)} test shards")
+
+            return (
+                train_shards,
+                test_shards
+            )
+
+        except Exception as e:
+            raise MushroomException(e, sys)
+
+    def _write_shards(self, index, train_chunk, test_chunk, train_shards, test_shards):
+        config = self.ingestion_config
+        for name, shard, shards in (("train", train_chunk, train_shards), ("test", test_chunk, test_shards)):
+            if len(shard):
+                shard_path = get_feature_store_path(config.shard_data_path, f"{name}-{index:05d}", config.feature_store_format)
+                write_feature_store(shard, shard_path)
+                shards.append(shard_path)
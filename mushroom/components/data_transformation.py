@@ -3,18 +3,200 @@ import sys
 import numpy as np
 import pandas as pd
 from dataclasses import dataclass
+from scipy import sparse
 
 from sklearn.compose import ColumnTransformer
 from sklearn.preprocessing import LabelEncoder, OneHotEncoder, StandardScaler
 from sklearn.pipeline import Pipeline
 
+from mushroom import constants
+from mushroom.constants import FEATURE_COLUMNS, TARGET_COLUMN, CLASS_LABELS
 from mushroom.exception import MushroomException
 from mushroom.logger import logging
-from mushroom.utils.main_utils import save_object
+from mushroom.utils.main_utils import save_object, log_memory_report
+from mushroom.utils.artifact_writer import ArtifactWriter
+from mushroom.utils.instrumentation import StageTimer
+from mushroom.utils.feature_store import read_feature_store
+from mushroom.utils import category_encoder
+from mushroom.utils.category_encoder import CategoryCodeEncoder
+
+# Feature representations the preprocessor can produce:
+# "onehot": scaled one-hot columns in a float32 CSR matrix, for linear models and SVC
+# "ordinal": one unsigned integer level code per column, for tree models
+# "native": a DataFrame of categorical level codes, for the native categorical
+#           support of CatBoost and XGBoost
+PREPROCESSING_PROFILES = ("onehot", "ordinal", "native")
 
 @dataclass
 class DataTransformationConfig:
     preprocessor_obj_file_path: str = os.path.join('artifacts', 'data_transformation', "preprocessor.pkl")
+    transformed_shard_path: str = os.path.join('artifacts', 'data_transformation', 'shards')
+    # Profiles fitted by transform_data, the model trainer picks one per model family
+    profiles: tuple = PREPROCESSING_PROFILES
+    # Input columns of the preprocessors, the columns picked by feature selection when it ran
+    feature_columns: tuple = tuple(FEATURE_COLUMNS)
+
+    def get_preprocessor_file_path(self, profile):
+        # The one-hot preprocessor keeps the plain file name, the others get their profile appended
+        if profile == "onehot":
+            return self.preprocessor_obj_file_path
+        root, extension = os.path.splitext(self.preprocessor_obj_file_path)
+        return f"{root}_{profile}{extension}"
+
+
+def save_transformed_shard(file_path, features, target):
+    """
+    Description: This function saves a transformed shard, sparse features are stored in CSR form
+
+    file_path: The path of the .npz file
+    features: The transformed input features, a sparse matrix or an array
+    target: The encoded target values
+
+    returns: None
+    """
+    try:
+        if sparse.issparse(features):
+            features = features.tocsr()
+            np.savez(file_path, data=features.data, indices=features.indices, indptr=features.indptr,
+                     shape=np.asarray(features.shape), target=target)
+        else:
+            np.savez(file_path, features=features, target=target)
+
+    except Exception as e:
+        raise MushroomException(e, sys)
+
+def load_transformed_shards(file_paths):
+    """
+    Description: This function loads transformed shards and stacks them into one data set
+
+    file_paths: The paths of the .npz shard files, stacked in the given order
+
+    returns: Tuple of the input features and the target values
+    """
+    try:
+        features, targets = [], []
+        for file_path in file_paths:
+            with np.load(file_path) as shard:
+                if "features" in shard:
+                    features.append(shard["features"])
+                else:
+                    features.append(sparse.csr_matrix((shard["data"], shard["indices"], shard["indptr"]), shape=tuple(shard["shape"])))
+                targets.append(shard["target"])
+
+        if features and sparse.issparse(features[0]):
+            return sparse.vstack(features, format="csr"), np.concatenate(targets)
+        return np.vstack(features), np.concatenate(targets)
+
+    except Exception as e:
+        raise MushroomException(e, sys)
+
+
+def get_preprocessing_profile(preprocessor):
+    """
+    Description: This function tells which of the PREPROCESSING_PROFILES a fitted preprocessor
+    was built for
+
+    preprocessor: A fitted preprocessor made by get_data_transformer_object
+
+    returns: The profile name
+    """
+    encoder = preprocessor.transformers_[0][1]
+    if isinstance(encoder, CategoryCodeEncoder):
+        return "ordinal" if encoder.output == "codes" else "native"
+    return "onehot"
+
+def get_feature_columns(preprocessor):
+    """
+    Description: This function returns the input columns of a fitted preprocessor
+
+    preprocessor: A fitted preprocessor made by get_data_transformer_object
+
+    returns: The list of columns, in the order of the encoder
+    """
+    return list(preprocessor.transformers_[0][2])
+
+def _get_category_encoder(preprocessor):
+    encoder = preprocessor.transformers_[0][1]
+    return encoder.named_steps["one_hot_encoder"] if hasattr(encoder, "named_steps") else encoder
+
+def get_new_levels(preprocessor, df):
+    """
+    Description: This function finds the feature levels of df the fitted preprocessor has not seen
+
+    preprocessor: A fitted preprocessor made by get_data_transformer_object
+    df: The rows to check, with the input columns of the preprocessor
+
+    returns: A dictionary of the sorted unseen levels per column, only the columns that have any.
+    A missing value counts as a level when the encoder learnt no missing level
+    """
+    encoder = _get_category_encoder(preprocessor)
+    new_levels = {}
+    for column, levels in zip(get_feature_columns(preprocessor), encoder.categories_):
+        known = pd.Index(levels)
+        values = pd.Series(df[column].unique())
+        unseen = sorted(str(value) for value in values.dropna() if value not in known)
+        if values.isna().any() and not known.hasnans:
+            unseen.append(np.nan)
+        if unseen:
+            new_levels[column] = unseen
+    return new_levels
+
+def extend_preprocessor_levels(preprocessor, new_levels):
+    """
+    Description: This function adds levels to the encoder of a fitted preprocessor of the
+    "ordinal" or "native" profile. The levels are appended after the known ones, so every code
+    the model was trained on keeps its meaning; the one-hot profile cannot be extended this
+    way, a new level would add a column the model does not have
+
+    preprocessor: A fitted preprocessor, modified in place
+    new_levels: The levels per column, as returned by get_new_levels
+
+    returns: The preprocessor, raises a ValueError for the one-hot profile
+    """
+    if not new_levels:
+        return preprocessor
+    if get_preprocessing_profile(preprocessor) == "onehot":
+        raise ValueError("New levels change the columns of the one-hot profile, the model has to be retrained")
+
+    encoder = _get_category_encoder(preprocessor)
+    for index, column in enumerate(get_feature_columns(preprocessor)):
+        if column in new_levels:
+            encoder.categories_[index] = np.asarray(list(encoder.categories_[index]) + new_levels[column], dtype=object)
+    return preprocessor
+
+def get_category_drift(reference_df, df, columns=FEATURE_COLUMNS):
+    """
+    Description: This function measures how far the level frequencies of df have moved away
+    from those of reference_df, per column, as the total variation distance of the two
+    distributions (missing values are a level of their own)
+
+    reference_df: The rows the model was trained on
+    df: The new rows
+    columns: The columns compared
+
+    returns: A dictionary of the distance per column, from 0 (same frequencies) to 1 (no level in common)
+    """
+    drift = {}
+    for column in columns:
+        reference = reference_df[column].astype(object).value_counts(normalize=True, dropna=False)
+        current = df[column].astype(object).value_counts(normalize=True, dropna=False)
+        drift[column] = float(reference.sub(current, fill_value=0).abs().sum() / 2)
+    return drift
+
+def encode_target(target):
+    """
+    Description: This function encodes target labels as the label encoder of transform_data
+    does, as their index in the sorted CLASS_LABELS
+
+    target: The target labels
+
+    returns: The encoded labels, raises a ValueError for unknown labels
+    """
+    codes = pd.Index(CLASS_LABELS).get_indexer(np.asarray(target, dtype=object))
+    if (codes < 0).any():
+        raise ValueError(f"Unknown target labels {sorted(set(np.asarray(target, dtype=object)[codes < 0]))}")
+    return codes.astype(np.min_scalar_type(len(CLASS_LABELS) - 1))
+
 
 class DataTransformation:
     def __init__(self):
@@ -31,16 +213,42 @@ class DataTransformation:
         # Create the artifacts directory if it doesn't exist
         os.makedirs(os.path.dirname(self.data_transformation_config.preprocessor_obj_file_path), exist_ok=True)
         
-    def get_data_transformer_object(self):
+    def get_data_transformer_object(self, profile="onehot"):
         """
         This function is responsible for data transformation.
+        
+        The "onehot" output is always a CSR matrix of float32 values: the encoder emits float32
+        one-hot columns, which the scaler keeps in place without centering, and the sparse
+        threshold of 1 stops the column transformer from densifying the result. The "ordinal"
+        and "native" profiles encode every column as a single level code instead.
+        
+        Args:
+            profile (str): One of PREPROCESSING_PROFILES.
         """
         try:
-            columns = ['bruises', 'gill-spacing', 'gill-size', 'gill-color', 'stalk-root', 'ring-type', 'spore-print-color']
+            columns = list(self.data_transformation_config.feature_columns)
+            
+            if profile == "ordinal":
+                return ColumnTransformer(
+                    [
+                        ("encoder", CategoryCodeEncoder(output="codes"), columns)
+                    ]
+                )
+            
+            if profile == "native":
+                return ColumnTransformer(
+                    [
+                        ("encoder", CategoryCodeEncoder(output="categorical"), columns)
+                    ],
+                    verbose_feature_names_out=False
+                ).set_output(transform="pandas")
+            
+            if profile != "onehot":
+                raise ValueError(f"Unknown preprocessing profile {profile}, expected one of {PREPROCESSING_PROFILES}")
             
             pipeline = Pipeline(
                 steps=[
-                    ("one_hot_encoder", OneHotEncoder()),
+                    ("one_hot_encoder", OneHotEncoder(dtype=np.float32)),
                     ("scaler", StandardScaler(with_mean=False))
                 ]
             )
@@ -50,7 +258,8 @@ class DataTransformation:
             preprocessor = ColumnTransformer(
                 [
                     ("pipeline", pipeline, columns)
-                ]
+                ],
+                sparse_threshold=1.0
             )
             
             return preprocessor
@@ -58,63 +267,244 @@ class DataTransformation:
         except Exception as e:
             raise MushroomException(e, sys)
         
-    def initiate_data_transformation(self, train_path, test_path):
+    @StageTimer("data_transformation", rows=lambda result: len(result[1]) + len(result[3]))
+    def transform_data(self, train_df, test_df, artifact_writer=None, stage_cache=None):
+        """
+        This function fits a preprocessor per configured profile on the train DataFrame and
+        applies it to the input features of the train and test DataFrames. It also applies a
+        label encoder to the target data. The preprocessor objects are handed to the artifact
+        writer to be saved.
+        
+        Args:
+            train_df (DataFrame): The train data.
+            test_df (DataFrame): The test data.
+            artifact_writer (ArtifactWriter): Decides whether the preprocessors are saved right
+                away, in the background or not at all. Saves synchronously when None.
+            stage_cache (StageCache): Reuses the fitted preprocessors and transformed features of
+                unchanged data, preprocessors and code.
+        
+        Returns:
+            The same tuple as initiate_data_transformation.
+        """
+        try:
+            artifact_writer = artifact_writer or ArtifactWriter()
+            
+            profiles = self.data_transformation_config.profiles
+            logging.info(f"Obtaining preprocessor objects for the profiles {profiles}")
+            
+            preprocessors = {profile: self.get_data_transformer_object(profile) for profile in profiles}
+            
+            target_column_name = TARGET_COLUMN
+            feature_columns = list(self.data_transformation_config.feature_columns)
+            
+            # In-memory handoff passes every column, the preprocessors are fit on the used ones only
+            columns = feature_columns + [target_column_name]
+            train_df = train_df[columns]
+            test_df = test_df[columns]
+            
+            cached = None
+            if stage_cache is not None:
+                fingerprint = stage_cache.fingerprint(
+                    "data_transformation",
+                    # The code of the preprocessors and of the target labels
+                    sys.modules[__name__],
+                    category_encoder,
+                    constants,
+                    preprocessors,
+                    train_df,
+                    test_df
+                )
+                cached = stage_cache.load("data_transformation", fingerprint)
+            
+            if cached is not None:
+                (
+                    preprocessors,
+                    train_features,
+                    target_train_arr,
+                    test_features,
+                    target_test_arr
+                ) = cached
+            else:
+                input_feature_train_df = train_df[feature_columns]
+                target_feature_train_df = train_df[target_column_name]
+                
+                input_feature_test_df = test_df[feature_columns]
+                target_feature_test_df = test_df[target_column_name]
+                
+                logging.info("Applying preprocessor objects to train and test input features")
+                
+                train_features, test_features = {}, {}
+                for profile, preprocessor_obj in preprocessors.items():
+                    train_features[profile] = preprocessor_obj.fit_transform(input_feature_train_df)
+                    test_features[profile] = preprocessor_obj.transform(input_feature_test_df)
+                
+                logging.info("Applying label encoder to target data")
+                
+                le = LabelEncoder()
+                
+                target_dtype = np.min_scalar_type(len(le.fit(target_feature_train_df).classes_) - 1)
+                target_train_arr = le.transform(target_feature_train_df).astype(target_dtype)
+                target_test_arr = le.transform(target_feature_test_df).astype(target_dtype)
+                
+                if stage_cache is not None:
+                    stage_cache.store("data_transformation", fingerprint, (
+                        preprocessors,
+                        train_features,
+                        target_train_arr,
+                        test_features,
+                        target_test_arr
+                    ))
+            
+            log_memory_report(
+                "Data transformation",
+                **{f"train_{profile}": features for profile, features in train_features.items()},
+                **{f"test_{profile}": features for profile, features in test_features.items()},
+                train_target=target_train_arr,
+                test_target=target_test_arr
+            )
+            
+            # Save the preprocessor objects
+            preprocessor_paths = {}
+            for profile, preprocessor_obj in preprocessors.items():
+                preprocessor_paths[profile] = self.data_transformation_config.get_preprocessor_file_path(profile)
+                artifact_writer.submit(
+                    save_object,
+                    file_path=preprocessor_paths[profile],
+                    obj=preprocessor_obj
+                )
+            
+            return (
+                train_features,
+                target_train_arr,
+                test_features,
+                target_test_arr,
+                preprocessor_paths
+            )
+                       
+        except Exception as e:
+            raise MushroomException(e, sys)
+        
+    def initiate_data_transformation(self, train_path, test_path, stage_cache=None):
         """
         This function is responsible for data transformation and feature engineering.
-        It reads the train and test data from the given paths, creates a preprocessor object, and
+        It reads the feature and target columns of the train and test data from the given
+        feature store paths, creates a preprocessor object, and
         applies it to the input features of the train and test data. It also applies a label encoder
         to the target data. The preprocessor object is saved to the specified file path.
         
         Args:
             train_path (str): The path to the train data.
             test_path (str): The path to the test data.
+            stage_cache (StageCache): Reuses the results of unchanged data, preprocessor and code.
         
         Returns:
             A tuple containing the transformed input features for the train data, the target data for the train data, 
-            the transformed input features for the test data, the target data for the test data, and the file path of the saved preprocessor object.
+            the transformed input features for the test data, the target data for the test data, and the file paths of the saved preprocessor objects.
+            Features and file paths are dictionaries keyed by preprocessing profile.
         """
         try:
             logging.info("Reading train and test data")
             
-            train_df = pd.read_csv(train_path)
-            test_df = pd.read_csv(test_path)
+            # Only the columns the preprocessor uses are read from the feature store
+            columns = list(self.data_transformation_config.feature_columns) + [TARGET_COLUMN]
+            train_df = read_feature_store(train_path, columns=columns)
+            test_df = read_feature_store(test_path, columns=columns)
             
-            logging.info("Obtaining preprocessor object")
+            return self.transform_data(train_df, test_df, stage_cache=stage_cache)
+                       
+        except Exception as e:
+            raise MushroomException(e, sys)
+
+    @StageTimer("data_transformation")
+    def transform_shards(self, train_shards, test_shards):
+        """
+        This function is the out-of-core version of transform_data for data streamed into
+        shards. Only one shard is held in memory at a time:
+        
+        1. The one-hot encoder levels and the target classes are collected from the train shards.
+        2. The scaler statistics are accumulated over the encoded train shards.
+        3. Every train and test shard is transformed and written to the transformed shards directory.
+        
+        The fitted preprocessor is the same as transform_data would fit on the concatenated
+        train shards, and is saved to the preprocessor file path.
+        
+        Args:
+            train_shards (list): The paths of the train shards.
+            test_shards (list): The paths of the test shards.
+        
+        Returns:
+            A tuple containing the paths of the transformed train shards, the paths of the
+            transformed test shards, and the file path of the saved preprocessor object keyed
+            by its profile, "onehot".
+        """
+        try:
+            shard_dir = self.data_transformation_config.transformed_shard_path
+            os.makedirs(shard_dir, exist_ok=True)
+            for file_name in os.listdir(shard_dir):
+                os.remove(os.path.join(shard_dir, file_name))
             
-            preprocessor_obj = self.get_data_transformer_object()
+            feature_columns = list(self.data_transformation_config.feature_columns)
+            columns = feature_columns + [TARGET_COLUMN]
+            
+            logging.info("Collecting feature levels and target classes from the train shards")
             
-            target_column_name = "class"
+            levels = {column: set() for column in feature_columns}
+            has_missing = {column: False for column in feature_columns}
+            classes = set()
+            for shard_path in train_shards:
+                shard = read_feature_store(shard_path, columns=columns)
+                for column in feature_columns:
+                    has_missing[column] |= bool(shard[column].isna().any())
+                    levels[column].update(shard[column].dropna().unique())
+                classes.update(shard[TARGET_COLUMN].unique())
             
-            input_feature_train_df = train_df.drop([target_column_name], axis=1)
-            target_feature_train_df = train_df[target_column_name]
+            # Sorted with missing values last, the order the encoder gives them when fit in one go
+            categories = [sorted(levels[column]) + ([np.nan] if has_missing[column] else []) for column in feature_columns]
             
-            input_feature_test_df = test_df.drop([target_column_name], axis=1)
-            target_feature_test_df = test_df[target_column_name]
+            preprocessor_obj = self.get_data_transformer_object()
+            preprocessor_obj.set_params(pipeline__one_hot_encoder__categories=categories)
             
-            logging.info("Applying preprocessor object to train and test input features")
+            le = LabelEncoder()
+            le.fit(sorted(classes))
+            target_dtype = np.min_scalar_type(len(le.classes_) - 1)
             
-            input_feature_train_arr = preprocessor_obj.fit_transform(input_feature_train_df)
-            input_feature_test_arr = preprocessor_obj.transform(input_feature_test_df)
+            logging.info("Accumulating scaler statistics over the train shards")
             
-            logging.info("Applying label encoder to target data")
+            scaler = StandardScaler(with_mean=False)
+            for shard_path in train_shards:
+                features = read_feature_store(shard_path, columns=feature_columns)
+                if not hasattr(preprocessor_obj, "transformers_"):
+                    # Fixes the fitted structure, the scaler fit here is replaced below
+                    preprocessor_obj.fit(features)
+                    pipeline = preprocessor_obj.named_transformers_["pipeline"]
+                scaler.partial_fit(pipeline.named_steps["one_hot_encoder"].transform(features))
+            pipeline.steps[-1] = ("scaler", scaler)
             
-            le = LabelEncoder()
+            logging.info("Writing transformed train and test shards")
             
-            target_train_arr = le.fit_transform(target_feature_train_df)
-            target_test_arr = le.transform(target_feature_test_df)
+            transformed_shards = {"train": [], "test": []}
+            for name, shard_paths in (("train", train_shards), ("test", test_shards)):
+                for shard_path in shard_paths:
+                    shard = read_feature_store(shard_path, columns=columns)
+                    shard_name = os.path.splitext(os.path.basename(shard_path))[0]
+                    transformed_path = os.path.join(shard_dir, f"{shard_name}.npz")
+                    save_transformed_shard(
+                        transformed_path,
+                        preprocessor_obj.transform(shard[feature_columns]),
+                        le.transform(shard[TARGET_COLUMN]).astype(target_dtype)
+                    )
+                    transformed_shards[name].append(transformed_path)
             
-            # Save the preprocessor object
+            preprocessor_paths = {"onehot": self.data_transformation_config.get_preprocessor_file_path("onehot")}
             save_object(
-                file_path=self.data_transformation_config.preprocessor_obj_file_path,
+                file_path=preprocessor_paths["onehot"],
                 obj=preprocessor_obj
             )
             
             return (
-                input_feature_train_arr,
-                target_train_arr,
-                input_feature_test_arr,
-                target_test_arr,
-                self.data_transformation_config.preprocessor_obj_file_path
+                transformed_shards["train"],
+                transformed_shards["test"],
+                preprocessor_paths
             )
                        
         except Exception as e:
@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_selection import chi2, mutual_info_classif
+from sklearn.model_selection import StratifiedKFold, cross_val_score
+from sklearn.preprocessing import OneHotEncoder
+from sklearn.tree import DecisionTreeClassifier
+
+from mushroom import constants
+from mushroom.constants import TARGET_COLUMN
+from mushroom.exception import MushroomException
+from mushroom.logger import logging
+from mushroom.utils.instrumentation import StageTimer
+from mushroom.components import data_transformation
+from mushroom.components.data_transformation import encode_target
+
+# Scores the columns are ranked by:
+# "mutual_info": mutual information of the column levels and the target
+# "chi2": chi-square statistic of the column's one-hot features, summed per column
+# "model_importance": impurity importance of a random forest over the one-hot features, summed per column
+FEATURE_RANKINGS = ("mutual_info", "chi2", "model_importance")
+
+@dataclass
+class FeatureSelectionConfig:
+    feature_selection_file_path: str = os.path.join('artifacts', 'feature_selection', 'feature_selection.json')
+    # One of FEATURE_RANKINGS. Model importance credits columns for what they add next to the
+    # others, the univariate scores rank columns carrying the same information side by side
+    ranking: str = "model_importance"
+    # Columns ranked, None ranks every column of the data but the target
+    candidate_columns: tuple = None
+    # The selected set is the smallest top ranked one whose CV accuracy is within this of the best
+    tolerance: float = 0.0
+    # Largest column set evaluated, None evaluates them all
+    max_columns: int = None
+    cv: int = 3
+    random_state: int = 42
+
+
+def load_selected_columns(file_path):
+    """
+    Description: This function reads the columns picked by the last feature selection run
+
+    file_path: The path of the feature selection report
+
+    returns: The list of selected columns, None when no selection was saved
+    """
+    try:
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path) as file_obj:
+            return json.load(file_obj)["columns"]
+
+    except Exception as e:
+        raise MushroomException(e, sys)
+
+
+class FeatureSelection:
+    def __init__(self, config: FeatureSelectionConfig = None):
+        """
+        Method Name: __init__
+        Description: This method initializes the instance of FeatureSelection class.
+        """
+        self.feature_selection_config = config or FeatureSelectionConfig()
+
+    def rank_columns(self, encoder, train_features, train_df, columns, target):
+        """
+        This function scores every column and returns them from the most to the least useful.
+        The one-hot scores are summed over the features of each column, for chi-square the sum
+        is the statistic of the column's contingency table.
+
+        Args:
+            encoder (OneHotEncoder): The encoder fitted on the columns.
+            train_features: The one-hot train features.
+            train_df (DataFrame): The train data, for the level codes of mutual information.
+            columns (list): The ranked columns, in encoder order.
+            target: The encoded train target.
+
+        Returns:
+            A tuple of the ranked columns and a dictionary of the score per column.
+        """
+        config = self.feature_selection_config
+        if config.ranking not in FEATURE_RANKINGS:
+            raise ValueError(f"Unknown feature ranking {config.ranking}, expected one of {FEATURE_RANKINGS}")
+
+        if config.ranking == "mutual_info":
+            # On the level codes, the mutual information of a column rather than of its levels
+            codes = np.column_stack([pd.factorize(train_df[column])[0] for column in columns])
+            column_scores = mutual_info_classif(codes, target, discrete_features=True, random_state=config.random_state)
+        else:
+            if config.ranking == "chi2":
+                feature_scores, _ = chi2(train_features, target)
+            else:
+                forest = RandomForestClassifier(n_estimators=100, random_state=config.random_state, n_jobs=-1)
+                feature_scores = forest.fit(train_features, target).feature_importances_
+            # The one-hot features of a column are contiguous, in encoder order
+            offsets = np.cumsum([0] + [len(levels) for levels in encoder.categories_[:-1]])
+            column_scores = np.add.reduceat(np.nan_to_num(feature_scores), offsets)
+
+        scores = {column: float(score) for column, score in zip(columns, column_scores)}
+        # Stable, ties keep the order of the data
+        ranked_columns = sorted(columns, key=lambda column: -scores[column])
+        return ranked_columns, scores
+
+    @StageTimer("feature_selection")
+    def initiate_feature_selection(self, train_df, test_df, stage_cache=None):
+        """
+        This function ranks the columns of the train data (see FEATURE_RANKINGS) and evaluates
+        the top 1, 2, ... ranked columns with a decision tree over their one-hot features, by
+        cross-validation on the train data and by accuracy on the test data. The smallest set
+        whose CV accuracy is within the tolerance of the best one is selected; the test data
+        is only reported, so it takes no part in the choice. The accuracy per number of
+        columns and the selected columns are logged and saved to the feature selection report.
+
+        Args:
+            train_df (DataFrame): The train data, with every candidate column and the target.
+            test_df (DataFrame): The test data.
+            stage_cache (StageCache): Reuses the selection of unchanged data, config and code.
+
+        Returns:
+            The list of selected columns, from the highest ranked one.
+        """
+        logging.info("Entered the feature selection method")
+
+        try:
+            config = self.feature_selection_config
+            columns = list(config.candidate_columns or [column for column in train_df.columns if column != TARGET_COLUMN])
+
+            report = None
+            if stage_cache is not None:
+                fingerprint = stage_cache.fingerprint(
+                    "feature_selection",
+                    # The code of the selection and of the target encoding it scores with
+                    sys.modules[__name__],
+                    data_transformation,
+                    constants,
+                    config,
+                    train_df[columns + [TARGET_COLUMN]],
+                    test_df[columns + [TARGET_COLUMN]]
+                )
+                report = stage_cache.load("feature_selection", fingerprint)
+
+            if report is None:
+                # Objects, so missing values are one more level of the encoder
+                train_inputs = train_df[columns].astype(object)
+                test_inputs = test_df[columns].astype(object)
+                train_target = encode_target(train_df[TARGET_COLUMN])
+                test_target = encode_target(test_df[TARGET_COLUMN])
+
+                encoder = OneHotEncoder(handle_unknown="ignore", dtype=np.float32)
+                # Column slices of the top ranked features are cheap on CSC matrices
+                train_features = encoder.fit_transform(train_inputs).tocsc()
+                test_features = encoder.transform(test_inputs).tocsc()
+
+                ranked_columns, scores = self.rank_columns(encoder, train_features, train_inputs, columns, train_target)
+                logging.info(f"Columns ranked by {config.ranking}: {ranked_columns}")
+
+                feature_indices = {}
+                offset = 0
+                for column, levels in zip(columns, encoder.categories_):
+                    feature_indices[column] = np.arange(offset, offset + len(levels))
+                    offset += len(levels)
+
+                cv = StratifiedKFold(n_splits=config.cv, shuffle=True, random_state=config.random_state)
+                curve = []
+                for n_columns in range(1, min(config.max_columns or len(ranked_columns), len(ranked_columns)) + 1):
+                    indices = np.concatenate([feature_indices[column] for column in ranked_columns[:n_columns]])
+                    estimator = DecisionTreeClassifier(random_state=config.random_state)
+                    cv_accuracy = float(cross_val_score(estimator, train_features[:, indices], train_target, cv=cv).mean())
+                    test_accuracy = float(estimator.fit(train_features[:, indices], train_target).score(test_features[:, indices], test_target))
+                    curve.append({
+                        "n_columns": n_columns,
+                        "added_column": ranked_columns[n_columns - 1],
+                        "n_features": len(indices),
+                        "cv_accuracy": cv_accuracy,
+                        "test_accuracy": test_accuracy
+                    })
+
+                best_accuracy = max(point["cv_accuracy"] for point in curve)
+                n_selected = next(point["n_columns"] for point in curve if point["cv_accuracy"] >= best_accuracy - config.tolerance)
+
+                report = {
+                    "ranking": config.ranking,
+                    "columns": ranked_columns[:n_selected],
+                    "ranked_columns": ranked_columns,
+                    "scores": scores,
+                    "curve": curve
+                }
+
+                if stage_cache is not None:
+                    stage_cache.store("feature_selection", fingerprint, report)
+
+            for point in report["curve"]:
+                logging.info(
+                    f"{point['n_columns']:>2} columns (+{point['added_column']}): "
+                    f"CV accuracy {point['cv_accuracy']:.4f}, test accuracy {point['test_accuracy']:.4f}"
+                )
+            logging.info(f"Selected {len(report['columns'])} of {len(report['ranked_columns'])} columns: {report['columns']}")
+
+            os.makedirs(os.path.dirname(config.feature_selection_file_path), exist_ok=True)
+            with open(config.feature_selection_file_path, "w") as file_obj:
+                json.dump(report, file_obj, indent=2)
+
+            return report["columns"]
+
+        except Exception as e:
+            raise MushroomException(e, sys)
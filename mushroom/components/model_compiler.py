@@ -0,0 +1,239 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import OneHotEncoder
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.ensemble import RandomForestClassifier
+
+from mushroom.exception import MushroomException
+from mushroom.logger import logging
+from mushroom.pipeline.lookup_table import LookupTableModel
+from mushroom.pipeline.feature_schema import FeatureSchema, get_feature_levels
+from mushroom.pipeline.portable_runtime import (
+    PortableRuntime, PortableEncoder, PortableLinearModel, PortableTreeEnsemble, PortableTableModel
+)
+from mushroom.utils.category_encoder import CategoryCodeEncoder
+from mushroom.utils.main_utils import save_object, load_object, get_file_checksum
+from mushroom.utils.feature_store import read_feature_store
+from mushroom.utils.model_bundle import save_model_bundle
+from mushroom.utils.instrumentation import StageTimer
+
+@dataclass
+class ModelCompilerConfig:
+    lookup_table_file_path: str = os.path.join('artifacts', 'model_trainer', 'lookup_table.pkl')
+    # Largest number of level combinations that is compiled up front; bigger input spaces
+    # only get the combinations seen in the training data and memoize the rest when served
+    max_enumerated_combinations: int = 1_000_000
+    # No table is built above this many combinations (9 bytes per entry), serving then uses the model
+    max_table_size: int = 20_000_000
+    # Rows per preprocessor.transform / model.predict call while compiling
+    compile_chunk_size: int = 50_000
+    # The preprocessor, model and lookup table in the memory-mappable format served by the registry
+    model_bundle_dir: str = os.path.join('artifacts', 'model_bundle')
+    # Also export the model as a numpy-only predictor, served with ModelRegistryConfig(runtime="portable")
+    export_portable_runtime: bool = True
+    portable_runtime_file_path: str = os.path.join('artifacts', 'model_trainer', 'portable_runtime.npz')
+
+
+class ModelCompiler:
+    def __init__(self):
+        """
+        This is the constructor method for ModelCompiler class.
+        """
+        self.model_compiler_config = ModelCompilerConfig()
+
+    def compile_lookup_table(self, preprocessor, model, source_version, train_df=None):
+        """
+        Builds a LookupTableModel for the given preprocessor and model. The full Cartesian
+        product of levels is compiled when it has at most max_enumerated_combinations entries,
+        otherwise only the level combinations present in train_df. Returns None when the input
+        space is larger than max_table_size.
+        """
+        columns, levels = get_feature_levels(preprocessor)
+        size = int(np.prod([len(column_levels) for column_levels in levels], dtype=np.float64))
+        if size > self.model_compiler_config.max_table_size:
+            logging.warning(f"{size} feature level combinations exceed the lookup table limit, skipping compilation")
+            return None
+
+        n_classes = len(getattr(model, "classes_", [0, 1]))
+        table = LookupTableModel(columns, levels, source_version, n_classes)
+
+        if table.size <= self.model_compiler_config.max_enumerated_combinations:
+            keys = np.arange(table.size, dtype=np.int64)
+            logging.info(f"Enumerating all {table.size} feature level combinations")
+        elif train_df is not None:
+            keys = table.encode_frame(train_df)
+            keys = np.unique(keys[keys >= 0])
+            logging.info(f"Compiling {len(keys)} level combinations observed in the training data")
+        else:
+            keys = np.empty(0, dtype=np.int64)
+
+        chunk_size = self.model_compiler_config.compile_chunk_size
+        for start in range(0, len(keys), chunk_size):
+            table.fill(keys[start:start + chunk_size], preprocessor, model)
+
+        return table
+
+    def check_consistency(self, table, preprocessor, model, features):
+        """
+        Raises a MushroomException when the table does not reproduce the model's
+        predictions on the given features.
+        """
+        data_scaled = preprocessor.transform(features)
+        expected = np.asarray(model.predict(data_scaled)).astype(np.int8)
+
+        keys = table.encode_frame(features)
+        known = keys >= 0
+        labels, probabilities = table.lookup(keys[known], preprocessor, model)
+
+        mismatches = int(np.count_nonzero(labels != expected[known]))
+        if mismatches:
+            raise MushroomException(f"Lookup table disagrees with the model on {mismatches} of {int(known.sum())} rows", sys)
+
+        if hasattr(model, "predict_proba"):
+            expected_probabilities = model.predict_proba(data_scaled)[known]
+            if not np.allclose(probabilities, expected_probabilities, atol=1e-5):
+                raise MushroomException("Lookup table probabilities disagree with the model", sys)
+
+        logging.info(f"Lookup table matches the model on all {int(known.sum())} checked rows")
+
+    def export_portable_runtime(self, preprocessor, model, table, source_version):
+        """
+        Converts the preprocessor and model into a PortableRuntime. Logistic regression on the
+        one-hot profile becomes a weight per level and decision trees and random forests on
+        ordinal codes become flat node arrays; any other model is exported as its lookup table
+        when every level combination has been compiled. Returns None when neither applies.
+        """
+        columns, levels = get_feature_levels(preprocessor)
+        encoder = PortableEncoder(columns, [[None if pd.isna(level) else str(level) for level in column_levels] for column_levels in levels])
+        classes = getattr(model, "classes_", np.arange(2))
+
+        transformer = preprocessor.transformers_[0][1]
+        steps = dict(transformer.steps) if hasattr(transformer, "steps") else {}
+        one_hot_encoder = steps.get("one_hot_encoder")
+
+        if isinstance(model, LogisticRegression) and isinstance(one_hot_encoder, OneHotEncoder) and one_hot_encoder.drop is None:
+            # Every level is a one-hot column scaled by 1 / scale_, so its weight is coef / scale_
+            coef = model.coef_ / steps["scaler"].scale_
+            offsets = np.cumsum([0] + [len(column_levels) for column_levels in levels])
+            weights = [coef[:, start:end].T for start, end in zip(offsets[:-1], offsets[1:])]
+            return PortableRuntime("linear", source_version, encoder, PortableLinearModel(weights, model.intercept_, classes))
+
+        if isinstance(model, (DecisionTreeClassifier, RandomForestClassifier)) and isinstance(transformer, CategoryCodeEncoder) and transformer.output == "codes":
+            trees = [model.tree_] if isinstance(model, DecisionTreeClassifier) else [estimator.tree_ for estimator in model.estimators_]
+            offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+            arrays = {"feature": [], "threshold": [], "left": [], "right": [], "value": []}
+            for tree, offset in zip(trees, offsets):
+                is_leaf = tree.children_left < 0
+                arrays["feature"].append(np.where(is_leaf, 0, tree.feature))
+                arrays["threshold"].append(tree.threshold)
+                arrays["left"].append(np.where(is_leaf, -1, tree.children_left + offset))
+                arrays["right"].append(np.where(is_leaf, -1, tree.children_right + offset))
+                value = tree.value[:, 0, :]
+                arrays["value"].append(value / value.sum(axis=1, keepdims=True))
+            arrays = {name: np.concatenate(parts) for name, parts in arrays.items()}
+            ensemble = PortableTreeEnsemble(roots=offsets[:-1], classes=classes, **arrays)
+            return PortableRuntime("trees", source_version, encoder, ensemble)
+
+        if table is not None and table.n_compiled == table.size:
+            probabilities = table.probabilities if hasattr(model, "predict_proba") else None
+            return PortableRuntime("table", source_version, encoder, PortableTableModel(table.strides, table.labels, probabilities, classes))
+
+        return None
+
+    def check_portable_runtime(self, runtime, preprocessor, model, features):
+        """
+        Raises a ValueError when the portable runtime does not reproduce the predictions (and
+        probabilities) of the original preprocessor and model on the given features.
+        """
+        data_scaled = preprocessor.transform(features)
+        codes = runtime.encoder.transform(features)
+
+        mismatches = int(np.count_nonzero(np.asarray(runtime.model.predict(codes)) != np.asarray(model.predict(data_scaled))))
+        if mismatches:
+            raise ValueError(f"Portable {runtime.kind} runtime disagrees with the model on {mismatches} of {len(features)} rows")
+
+        if hasattr(model, "predict_proba"):
+            if not np.allclose(runtime.model.predict_proba(codes), model.predict_proba(data_scaled), atol=1e-5):
+                raise ValueError(f"Portable {runtime.kind} runtime probabilities disagree with the model")
+
+        logging.info(f"Portable {runtime.kind} runtime matches the model on all {len(features)} test rows")
+
+    def get_feature_schema(self, preprocessor):
+        """
+        Compiled FeatureSchema of the preprocessor for the bundle manifest, validated by the
+        prediction pipeline before transform.
+        """
+        return FeatureSchema.from_preprocessor(preprocessor).to_dict()
+
+    @StageTimer("model_compilation")
+    def initiate_model_compilation(self, preprocessor_path, model_path, train_path, test_path, train_df=None, test_df=None):
+        """
+        This function compiles the trained preprocessor and model into a lookup table,
+        checks it against the model on the test data and saves it next to the model.
+        The preprocessor, model and table are also saved as a model bundle for serving, and
+        exported as a portable runtime checked against the model on the test data.
+
+        Args:
+            preprocessor_path (str): The path of the saved preprocessor object.
+            model_path (str): The path of the saved model object.
+            train_path (str): The path to the train data.
+            test_path (str): The path to the test data.
+            train_df (DataFrame): The train data when already in memory, read from train_path otherwise.
+            test_df (DataFrame): The test data when already in memory, read from test_path otherwise.
+
+        Returns:
+            The file path of the saved lookup table, or None when no table was built.
+        """
+        try:
+            logging.info("Compiling the lookup table inference model")
+
+            preprocessor = load_object(preprocessor_path)
+            model = load_object(model_path)
+            source_version = get_file_checksum(preprocessor_path, model_path)
+
+            # Only the input columns of the preprocessor are read
+            columns, _ = get_feature_levels(preprocessor)
+            if train_df is None:
+                train_df = read_feature_store(train_path, columns=columns)
+            if test_df is None:
+                test_df = read_feature_store(test_path, columns=columns)
+
+            lookup_table_file_path = None
+            table = self.compile_lookup_table(preprocessor, model, source_version, train_df)
+            if table is not None:
+                self.check_consistency(table, preprocessor, model, test_df)
+
+                save_object(
+                    file_path=self.model_compiler_config.lookup_table_file_path,
+                    obj=table
+                )
+                logging.info(f"Lookup table with {table.n_compiled} entries saved")
+                lookup_table_file_path = self.model_compiler_config.lookup_table_file_path
+
+            save_model_bundle(
+                self.model_compiler_config.model_bundle_dir,
+                source_version,
+                preprocessor,
+                model,
+                lookup_table=table,
+                feature_schema=self.get_feature_schema(preprocessor)
+            )
+            logging.info(f"Model bundle version {source_version} saved to {self.model_compiler_config.model_bundle_dir}")
+
+            if self.model_compiler_config.export_portable_runtime:
+                runtime = self.export_portable_runtime(preprocessor, model, table, source_version)
+                if runtime is None:
+                    logging.warning(f"No portable runtime for {type(model).__name__}, its input space is not fully compiled")
+                else:
+                    self.check_portable_runtime(runtime, preprocessor, model, test_df)
+                    runtime.save(self.model_compiler_config.portable_runtime_file_path)
+                    logging.info(f"Portable {runtime.kind} runtime saved to {self.model_compiler_config.portable_runtime_file_path}")
+
+            return lookup_table_file_path
+
+        except Exception as e:
+            raise MushroomException(e, sys)
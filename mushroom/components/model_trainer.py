@@ -4,28 +4,116 @@ from dataclasses import dataclass
 
 from mushroom.exception import MushroomException
 from mushroom.logger import logging
-from mushroom.utils.main_utils import save_object, evaluate_model
+from mushroom.utils.main_utils import save_object, copy_object, evaluate_model
+from mushroom.utils.model_search import SearchConfig
+from mushroom.utils.artifact_writer import ArtifactWriter
+from mushroom.utils.instrumentation import StageTimer
+from mushroom.utils.experiment_tracker import ExperimentTracker, ExperimentTrackerConfig
 
 from sklearn.linear_model import LogisticRegression
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, AdaBoostClassifier
 from sklearn.svm import SVC
-from catboost import CatBoostClassifier
-from xgboost import XGBClassifier
 from sklearn.metrics import accuracy_score
-import mlflow
-import mlflow.sklearn  # Import this to log sklearn models
 
 @dataclass
 class ModelTrainerConfig:
     trained_model_file_path = os.path.join("artifacts", 'model_trainer', "model.pkl")
+    # The preprocessor of the winning model's profile, saved next to it for serving
+    preprocessor_file_path = os.path.join("artifacts", 'model_trainer', "preprocessor.pkl")
+    # Total CPUs used by the hyperparameter search, -1 uses every core
+    n_jobs: int = -1
+    # Model families searched at the same time, None lets the CPU budget decide
+    max_parallel_models: int = None
+    cv: int = 3
+    # "exhaustive", "halving" or "randomized" for every model family, None keeps the per-family choice
+    search_strategy: str = None
+    # Boosting rounds or trees added to the model by an incremental training run
+    additional_estimators: int = 32
+
+
+def can_absorb_new_levels(model, profile):
+    """
+    Tells whether continue_fit can train a model on levels its preprocessor was extended with.
+    New one-hot levels are new columns, and XGBoost fixes the categories of a native
+    categorical booster when it is first trained; level codes are just new values otherwise.
+    """
+    if profile == "onehot":
+        return False
+    return not (type(model).__name__ == "XGBClassifier" and profile == "native")
+
+
+def continue_fit(model, features, target, new_features, new_target, additional_estimators):
+    """
+    Continues training a fitted model on grown training data instead of searching it again.
+    Boosting models get additional_estimators more rounds fit on all rows, forests more trees,
+    other warm_start models start from their fitted coefficients and partial_fit models only
+    see the new rows. Models with none of these are refit with their tuned parameters.
+
+    Args:
+        model: The fitted model.
+        features, target: All training rows, the new ones included.
+        new_features, new_target: The new training rows.
+        additional_estimators (int): Rounds or trees added to ensembles.
+
+    Returns:
+        Tuple of the updated model and the way it was updated.
+    """
+    from sklearn.base import clone
+
+    model_class = type(model).__name__
+    params = model.get_params()
+
+    if model_class == "XGBClassifier":
+        continued = clone(model).set_params(n_estimators=additional_estimators)
+        continued.fit(features, target, xgb_model=model.get_booster())
+        # Counts every round of the booster again, for the next continuation and the manifest
+        return continued.set_params(n_estimators=(params["n_estimators"] or 100) + additional_estimators), "boosting rounds"
+
+    if model_class == "CatBoostClassifier":
+        # tree_count_ of the continued model counts the trees of init_model too
+        continued = clone(model).set_params(iterations=additional_estimators)
+        return continued.fit(features, target, init_model=model), "boosting rounds"
+
+    if "warm_start" in params:
+        grown = {"n_estimators": params["n_estimators"] + additional_estimators} if "n_estimators" in params else {}
+        model.set_params(warm_start=True, **grown).fit(features, target)
+        model.set_params(warm_start=params["warm_start"])
+        return model, "added estimators" if grown else "warm start"
+
+    if hasattr(model, "partial_fit"):
+        return model.partial_fit(new_features, new_target), "partial fit"
+
+    return clone(model).fit(features, target), "refit"
+
 
 class ModelTrainer:
-    def __init__(self) -> None:
+    def __init__(self, experiment_tracker_config: ExperimentTrackerConfig = None) -> None:
         self.model_trainer_config = ModelTrainerConfig()
+        # Logs the training runs to MLflow in the background, see ExperimentTrackerConfig
+        self.experiment_tracker = ExperimentTracker(experiment_tracker_config)
+    
+    def log_run(self, model_name, accuracy, profile, model, model_report=None, preprocessing_profiles=None, **params):
+        """
+        Queues the parameters, stage timings and model of a training run, and the candidates of
+        its model search, to be logged as an MLflow run without waiting for it.
+        """
+        self.experiment_tracker.log_training_run(
+            model_name, accuracy, profile, model,
+            model_report=model_report,
+            preprocessing_profiles=preprocessing_profiles,
+            **params
+        )
+        
+    @StageTimer("model_training")
+    def initiate_model_trainer(self, train_features_array, train_target_array, test_features_array, test_target_array, artifact_writer=None, stage_cache=None, preprocessor_paths=None):
+        # Imported on first use, together they take seconds to import and only training needs them
+        from catboost import CatBoostClassifier
+        from xgboost import XGBClassifier
         
-    def initiate_model_trainer(self, train_features_array, train_target_array, test_features_array, test_target_array):
         try:
+            artifact_writer = artifact_writer or ArtifactWriter()
+            
             logging.info("Splitting train and test data")
             X_train, y_train, X_test, y_test = (
                 train_features_array,
@@ -33,17 +121,43 @@ class ModelTrainer:
                 test_features_array,
                 test_target_array
             )
+            # Features are keyed by preprocessing profile, a single matrix is the one-hot profile
+            if not isinstance(X_train, dict):
+                X_train, X_test = {"onehot": X_train}, {"onehot": X_test}
+            
+            # Preprocessing profile per model family, the cheapest representation each can use:
+            # level codes for trees, native categoricals for CatBoost and XGBoost and one-hot
+            # columns for the linear models. Profiles that were not produced fall back to one-hot
+            preprocessing_profiles = {
+                "Logistic Regression": "onehot",
+                "XGBoost Classifier": "native",
+                "Decision Tree": "ordinal",
+                "Random Forest Classifier": "ordinal",
+                "Gradient Boosting Classifier": "ordinal",
+                "Ada Boost Classifier": "ordinal",
+                "Support Vector Classifier": "onehot",
+                "CatBoost Classifier": "native"
+            }
+            preprocessing_profiles = {
+                name: profile if profile in X_train else "onehot"
+                for name, profile in preprocessing_profiles.items()
+            }
+            native_catboost = preprocessing_profiles["CatBoost Classifier"] == "native"
             
             # Define models and their hyperparameters
             models = {
                 "Logistic Regression": LogisticRegression(max_iter=1000),
-                "XGBoost Classifier": XGBClassifier(),
+                "XGBoost Classifier": XGBClassifier(enable_categorical=preprocessing_profiles["XGBoost Classifier"] == "native"),
                 "Decision Tree": DecisionTreeClassifier(),
                 "Random Forest Classifier": RandomForestClassifier(),
                 "Gradient Boosting Classifier": GradientBoostingClassifier(),
                 "Ada Boost Classifier": AdaBoostClassifier(),
                 "Support Vector Classifier": SVC(),
-                "CatBoost Classifier": CatBoostClassifier(verbose=False)                
+                "CatBoost Classifier": CatBoostClassifier(
+                    verbose=False,
+                    # A tuple, CatBoost copies lists, which sklearn's clone rejects
+                    cat_features=tuple(range(X_train["native"].shape[1])) if native_catboost else None
+                )
             }
             
             params = {
@@ -87,40 +201,114 @@ class ModelTrainer:
                 }                
             }
             
+            # Search strategy per model family; boosting and forests grow their number of
+            # estimators by successive halving, the remaining grids are searched exhaustively
+            search_configs = {
+                "XGBoost Classifier": SearchConfig(strategy="halving", resource="n_estimators"),
+                "Random Forest Classifier": SearchConfig(strategy="halving", resource="n_estimators"),
+                "Gradient Boosting Classifier": SearchConfig(strategy="halving", resource="n_estimators"),
+                "Ada Boost Classifier": SearchConfig(strategy="halving", resource="n_estimators"),
+                "CatBoost Classifier": SearchConfig(strategy="halving", resource="iterations"),
+                "Decision Tree": SearchConfig(strategy="randomized", n_iter=12)
+            }
+            if self.model_trainer_config.search_strategy:
+                search_configs = {
+                    name: SearchConfig(strategy=self.model_trainer_config.search_strategy)
+                    for name in models
+                }
+            
             # Evaluate models
-            model_report = evaluate_model(X_train, y_train, X_test, y_test, models, params)
+            model_report = evaluate_model(
+                {name: X_train[preprocessing_profiles[name]] for name in models},
+                y_train,
+                {name: X_test[preprocessing_profiles[name]] for name in models},
+                y_test,
+                models, params,
+                n_jobs=self.model_trainer_config.n_jobs,
+                max_parallel_models=self.model_trainer_config.max_parallel_models,
+                cv=self.model_trainer_config.cv,
+                search_configs=search_configs,
+                stage_cache=stage_cache
+            )
             logging.info("Model hyperparameter tuning done")
             logging.info("Model training complete")
             
             # Determine the best model
-            best_model_score = max(model_report.values())
-            best_model_name = [name for name, score in model_report.items() if score == best_model_score][0]
-            best_model = models[best_model_name]
+            best_model_score = max(evaluation.test_score for evaluation in model_report.values())
+            best_model_name = [name for name, evaluation in model_report.items() if evaluation.test_score == best_model_score][0]
+            best_evaluation = model_report[best_model_name]
+            best_model = best_evaluation.model
             
             if best_model_score < 0.6:
                 raise MushroomException("No Best Model Found", sys)
 
             logging.info(f"Best model found: {best_model_name} with accuracy score: {best_model_score}")
+            logging.info(f"Best model parameters: {best_evaluation.best_params}, CV score: {best_evaluation.cv_score}")
+            best_profile = preprocessing_profiles[best_model_name]
+            logging.info(f"Best model preprocessing profile: {best_profile}")
+
+            # Logged in the background, training does not wait for the tracking store
+            self.log_run(best_model_name, best_model_score, best_profile, best_model, model_report, preprocessing_profiles)
+
+            # Save the model locally
+            # Save the preprocessor the model was trained with next to it, ahead of the model
+            if preprocessor_paths is not None:
+                artifact_writer.submit(
+                    copy_object,
+                    preprocessor_paths[best_profile],
+                    self.model_trainer_config.preprocessor_file_path
+                )
+            artifact_writer.submit(save_object, file_path=self.model_trainer_config.trained_model_file_path, obj=best_model)
+            
+            # Evaluate the model on the test predictions cached during the model search
+            accuracy_score_result = accuracy_score(y_test, best_evaluation.test_predictions)
+            logging.info(f"Prediction result on test data: Accuracy Score -> {accuracy_score_result}")
 
-            # Start an MLflow run
-            with mlflow.start_run():
-                mlflow.log_param("best_model", best_model_name)
-                mlflow.log_param("accuracy_score", best_model_score)
-                
-                # Log the best model
-                mlflow.sklearn.log_model(best_model, "model")
-
-                # Save the model locally
-                save_object(file_path=self.model_trainer_config.trained_model_file_path, obj=best_model)
-                
-                logging.info("Using the best model to predict on test data")
-
-                # Predict and evaluate the model
-                predicted = best_model.predict(X_test)
-                accuracy_score_result = accuracy_score(y_test, predicted)
-                logging.info(f"Prediction result on test data: Accuracy Score -> {accuracy_score_result}")
-
-                return accuracy_score_result, best_model
+            return accuracy_score_result, best_model
             
         except Exception as e:
             raise MushroomException(e, sys)
+
+    @StageTimer("incremental_training")
+    def continue_training(self, model, preprocessor, profile, train_features, train_target, test_features, test_target, n_new_rows, artifact_writer=None):
+        """
+        Updates the saved best model with newly appended training rows through continue_fit,
+        without a hyperparameter search, and saves it and its preprocessor in place of the
+        previous ones.
+
+        Args:
+            model: The fitted best model.
+            preprocessor: The fitted preprocessor of the model, with the levels of the new rows.
+            profile (str): The preprocessing profile of the model.
+            train_features, train_target: All training rows, the new ones last.
+            test_features, test_target: All test rows.
+            n_new_rows (int): Number of new rows at the end of the training rows.
+            artifact_writer (ArtifactWriter): Saves the model, synchronously when None.
+
+        Returns:
+            Tuple of the test accuracy and the updated model.
+        """
+        try:
+            artifact_writer = artifact_writer or ArtifactWriter()
+            model_name = type(model).__name__
+
+            new_rows = slice(len(train_target) - n_new_rows, len(train_target))
+            new_features = train_features.iloc[new_rows] if hasattr(train_features, "iloc") else train_features[new_rows]
+            model, method = continue_fit(
+                model, train_features, train_target, new_features, train_target[new_rows],
+                self.model_trainer_config.additional_estimators
+            )
+
+            accuracy_score_result = accuracy_score(test_target, model.predict(test_features))
+            logging.info(f"{model_name} updated by {method} on {n_new_rows} new rows, accuracy score on test data -> {accuracy_score_result}")
+
+            self.log_run(model_name, accuracy_score_result, profile, model, training_mode="incremental", update_method=method)
+
+            # The preprocessor goes first, as the model is what readers watch for changes
+            artifact_writer.submit(save_object, file_path=self.model_trainer_config.preprocessor_file_path, obj=preprocessor)
+            artifact_writer.submit(save_object, file_path=self.model_trainer_config.trained_model_file_path, obj=model)
+
+            return accuracy_score_result, model
+
+        except Exception as e:
+            raise MushroomException(e, sys)
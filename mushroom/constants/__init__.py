@@ -0,0 +1,8 @@
+# Input columns picked in the EDA notebook, consumed by the preprocessor in this order unless the
+# feature selection stage of the training pipeline replaced them (see TrainPipelineConfig)
+FEATURE_COLUMNS = ['bruises', 'gill-spacing', 'gill-size', 'gill-color', 'stalk-root', 'ring-type', 'spore-print-color']
+
+TARGET_COLUMN = "class"
+
+# LabelEncoder sorts the target classes, so the encoded value is the index in this tuple
+CLASS_LABELS = ("edible", "poisonous")
@@ -7,17 +7,29 @@ logging_str = "[%(asctime)s: %(levelname)s: %(module)s: %(message)s]"
 log_dir = "logs"
 
 log_filepath = os.path.join(log_dir, "mushroom.log")
-os.makedirs(log_dir, exist_ok=True)
 
 
-logging.basicConfig(
-    level = logging.INFO,
-    format = logging_str,
+def setup_logging(level=logging.INFO):
+    """
+    Description: This function sends the log records to the log file and stdout. It is called
+    by the entry points (app.py, demo.py), importing the package configures no handler and
+    creates no directory. Later calls leave the configuration in place
 
-    handlers=[
-        logging.FileHandler(log_filepath),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+    level: The lowest level of the records logged
 
-logger = logging.getLogger("mlProjectLogger")
\ No newline at end of file
+    returns: None
+    """
+    os.makedirs(log_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level = level,
+        format = logging_str,
+
+        handlers=[
+            logging.FileHandler(log_filepath),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+
+logger = logging.getLogger("mlProjectLogger")
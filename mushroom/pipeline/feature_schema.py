@@ -0,0 +1,214 @@
+import sys
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from mushroom.exception import MushroomException
+
+# Code of a value that is not a level of its column in SchemaValidation.codes
+INVALID_CODE = -1
+
+
+def get_feature_levels(preprocessor):
+    """
+    Returns the input columns of a fitted ColumnTransformer and, for every column, the
+    category levels learnt by its encoder step.
+    """
+    for _, transformer, columns in preprocessor.transformers_:
+        steps = transformer.steps if hasattr(transformer, "steps") else [(None, transformer)]
+        for _, step in steps:
+            if hasattr(step, "categories_"):
+                return list(columns), [list(levels) for levels in step.categories_]
+
+    raise MushroomException("Preprocessor has no fitted categorical encoder", sys)
+
+
+def normalize_value(value):
+    """
+    Feature value as the encoder knows it: strings stripped and lower-cased, every kind of
+    missing value (None, "", NaN) as None.
+    """
+    if isinstance(value, str):
+        return value.strip().lower() or None
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return value
+
+
+class InvalidInputError(MushroomException):
+    def __init__(self, message):
+        """
+        Raised for prediction inputs the service cannot take, which are client errors. The
+        message is meant for the caller, so it carries no location of the error in the code.
+        """
+        Exception.__init__(self, message)
+        self.error_message = message
+
+
+class SchemaValidationError(InvalidInputError):
+    def __init__(self, errors):
+        """
+        Raised for inputs that do not match the feature schema, before any of them is transformed.
+
+        Args:
+            errors (dict): Per field report, see SchemaValidation.errors.
+        """
+        self.errors = errors
+        problems = []
+        for field, report in errors.items():
+            if report["missing_values"]:
+                problems.append(f"{field} is missing in {report['missing_values']} rows")
+            if report["unknown_values"]:
+                problems.append(f"{field} has unknown values {list(report['unknown_values'])}")
+        super().__init__(f"Invalid input in {len(errors)} fields: " + "; ".join(problems))
+
+
+@dataclass
+class SchemaValidation:
+    # Level code per row and column, INVALID_CODE for unknown and disallowed missing values
+    codes: np.ndarray
+    # True for the rows whose every value is valid
+    valid: np.ndarray
+    # Per field report of the invalid values: {field: {"invalid_rows", "missing_values", "unknown_values"}},
+    # unknown_values maps every unknown value to the number of rows holding it
+    errors: dict
+    schema: "FeatureSchema"
+    index: pd.Index
+
+    @cached_property
+    def features(self):
+        """
+        The features as the levels the encoder knows, missing values as NaN and NaN on the
+        invalid rows. Built on first use, serving from a lookup table only needs the codes.
+        """
+        return self.schema.decode_codes(self.codes, self.valid, self.index)
+
+    def select(self, mask):
+        """
+        Validation of the rows selected by a boolean mask.
+        """
+        if mask.all():
+            return self
+        return SchemaValidation(self.codes[mask], self.valid[mask], self.errors, self.schema, self.index[mask])
+
+    def row_errors(self):
+        """
+        One message per row naming its invalid fields, empty for the valid rows.
+        """
+        messages = np.full(len(self.valid), "", dtype=object)
+        invalid_codes = self.codes[~self.valid] == INVALID_CODE
+        columns = np.asarray(self.schema.columns, dtype=object)
+        for position, row in zip(np.flatnonzero(~self.valid), invalid_codes):
+            messages[position] = "invalid " + ", ".join(columns[row])
+        return messages
+
+
+class FeatureSchema:
+    def __init__(self, columns, levels):
+        """
+        Input columns and category levels of a fitted encoder, compiled at training time and
+        saved in the model bundle manifest. Checks and encodes inputs before the preprocessor
+        sees them: values are normalized and mapped to the level codes of the encoder, and
+        unknown levels or missing values of columns that learnt no missing level are reported
+        per field instead of failing inside transform.
+
+        Args:
+            columns (list): Feature column names, in the order of the encoder.
+            levels (list): For every column, its levels in encoder order, None or NaN for missing values.
+        """
+        self.columns = list(columns)
+        self.levels = [[None if pd.isna(level) else str(level) for level in column_levels] for column_levels in levels]
+        self.codes = [{level: code for code, level in enumerate(column_levels) if level is not None} for column_levels in self.levels]
+        self.missing_codes = [next((code for code, level in enumerate(column_levels) if level is None), None) for column_levels in self.levels]
+        # Level values per code as the preprocessor expects them, NaN for missing values
+        self._level_arrays = [np.asarray([np.nan if level is None else level for level in column_levels], dtype=object) for column_levels in self.levels]
+
+    @classmethod
+    def from_preprocessor(cls, preprocessor):
+        return cls(*get_feature_levels(preprocessor))
+
+    @classmethod
+    def from_dict(cls, schema):
+        """
+        Schema saved by to_dict, as found in the feature_schema entry of a bundle manifest.
+        """
+        return cls(schema["columns"], [schema["levels"][column] for column in schema["columns"]])
+
+    def to_dict(self):
+        return {
+            "columns": self.columns,
+            "levels": {column: column_levels for column, column_levels in zip(self.columns, self.levels)}
+        }
+
+    def validate(self, df):
+        """
+        Validates and encodes a DataFrame of features in one vectorized pass per column. Every
+        column is factorized, so only its distinct values are normalized and looked up,
+        whatever the number of rows. Columns of the schema df does not have count as missing.
+
+        Returns: A SchemaValidation
+        """
+        n_rows = len(df)
+        codes = np.empty((n_rows, len(self.columns)), dtype=np.int64)
+        errors = {}
+
+        for index, (column, column_codes, missing_code) in enumerate(zip(self.columns, self.codes, self.missing_codes)):
+            if column in df:
+                value_ids, uniques = pd.factorize(df[column], use_na_sentinel=True)
+            else:
+                value_ids, uniques = np.full(n_rows, -1, dtype=np.int64), []
+
+            # Code of every distinct value, the last entry is the one of missing values (id -1)
+            unique_values = [normalize_value(value) for value in uniques]
+            unique_codes = np.array(
+                [missing_code if value is None else column_codes.get(value) for value in unique_values] + [missing_code],
+                dtype=object
+            )
+            unique_codes[pd.isna(unique_codes)] = INVALID_CODE
+            column_result = unique_codes.astype(np.int64)[value_ids]
+            codes[:, index] = column_result
+
+            invalid = column_result == INVALID_CODE
+            if invalid.any():
+                counts = np.bincount(value_ids[invalid] + 1, minlength=len(unique_values) + 1)
+                missing = int(counts[0]) + sum(int(counts[i + 1]) for i, value in enumerate(unique_values) if value is None)
+                unknown = {str(uniques[i]): int(counts[i + 1]) for i, value in enumerate(unique_values) if value is not None and counts[i + 1]}
+                errors[column] = {
+                    "invalid_rows": int(invalid.sum()),
+                    "missing_values": missing,
+                    "unknown_values": unknown
+                }
+
+        valid = (codes != INVALID_CODE).all(axis=1)
+        return SchemaValidation(codes=codes, valid=valid, errors=errors, schema=self, index=df.index)
+
+    def decode_codes(self, codes, valid, index):
+        """
+        DataFrame of the levels of the given codes, NaN on the rows that are not valid.
+        """
+        return pd.DataFrame(
+            {
+                column: np.where(valid, level_array[np.maximum(codes[:, position], 0)], np.nan)
+                for position, (column, level_array) in enumerate(zip(self.columns, self._level_arrays))
+            },
+            columns=self.columns,
+            index=index
+        )
+
+    def validate_record(self, features):
+        """
+        Scalar version of validate() for a single record given as a tuple of normalized values
+        in column order (see prediction_cache.normalize_record). Plain dict lookups.
+
+        Returns: The per field report of the invalid values, empty when the record is valid
+        """
+        errors = {}
+        for column, value, column_codes, missing_code in zip(self.columns, features, self.codes, self.missing_codes):
+            if value is None:
+                if missing_code is None:
+                    errors[column] = {"invalid_rows": 1, "missing_values": 1, "unknown_values": {}}
+            elif value not in column_codes:
+                errors[column] = {"invalid_rows": 1, "missing_values": 0, "unknown_values": {str(value): 1}}
+        return errors
@@ -0,0 +1,127 @@
+import sys
+import numpy as np
+import pandas as pd
+
+from mushroom.exception import MushroomException
+
+
+class LookupTableModel:
+    def __init__(self, columns, levels, source_version, n_classes):
+        """
+        Precomputed predictions for combinations of categorical feature levels.
+
+        Every combination of levels is mapped to an integer key (a mixed radix number whose
+        digits are the per-column level codes), which indexes flat label and probability
+        arrays. Entries that have not been compiled hold -1 and are filled in from the real
+        model the first time they are requested.
+
+        Args:
+            columns (list): Feature column names, in the order the preprocessor expects them.
+            levels (list): For every column, the category levels known to the fitted encoder.
+            source_version (str): Checksum of the preprocessor and model the table was compiled from.
+            n_classes (int): Number of target classes.
+        """
+        self.columns = list(columns)
+        self.levels = [np.asarray(column_levels, dtype=object) for column_levels in levels]
+        self.indexes = [pd.Index(column_levels) for column_levels in self.levels]
+        self.codes = [{level: code for code, level in enumerate(column_levels) if not pd.isna(level)} for column_levels in self.levels]
+        # Missing values (NaN) are a level of their own for the encoder but cannot be dict keys
+        self.missing_codes = [next((code for code, level in enumerate(column_levels) if pd.isna(level)), None) for column_levels in self.levels]
+        self.source_version = source_version
+
+        sizes = np.array([len(column_levels) for column_levels in self.levels], dtype=np.int64)
+        self.strides = np.ones(len(sizes), dtype=np.int64)
+        self.strides[:-1] = np.cumprod(sizes[::-1])[::-1][1:]
+        self.size = int(np.prod(sizes))
+
+        self.labels = np.full(self.size, -1, dtype=np.int8)
+        self.probabilities = np.full((self.size, n_classes), np.nan, dtype=np.float32)
+
+    def decode_keys(self, keys):
+        """
+        Turns integer keys back into a DataFrame of feature values.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        data = {}
+        for column, column_levels, stride in zip(self.columns, self.levels, self.strides):
+            data[column] = column_levels[(keys // stride) % len(column_levels)]
+        return pd.DataFrame(data, columns=self.columns)
+
+    def encode_frame(self, features):
+        """
+        Vectorized key computation for a DataFrame. Rows holding a level the encoder has
+        never seen get the key -1.
+        """
+        keys = np.zeros(len(features), dtype=np.int64)
+        unknown = np.zeros(len(features), dtype=bool)
+        for column, column_index, stride in zip(self.columns, self.indexes, self.strides):
+            codes = column_index.get_indexer(features[column])
+            unknown |= codes < 0
+            keys += codes.astype(np.int64) * stride
+        keys[unknown] = -1
+        return keys
+
+    def encode_codes(self, codes):
+        """
+        Keys for rows already encoded as level codes in column order, e.g. by the FeatureSchema
+        of the preprocessor the table was compiled from.
+        """
+        return np.asarray(codes, dtype=np.int64) @ self.strides
+
+    def encode_record(self, record):
+        """
+        Key for a single record given as a dict of feature values, or None when a value
+        is not a known level. Plain dict lookups, no pandas involved.
+        """
+        key = 0
+        for column, column_codes, missing_code, stride in zip(self.columns, self.codes, self.missing_codes, self.strides):
+            value = record.get(column)
+            code = column_codes.get(value)
+            if code is None and isinstance(value, float) and value != value:
+                code = missing_code
+            if code is None:
+                return None
+            key += code * int(stride)
+        return key
+
+    def fill(self, keys, preprocessor, model):
+        """
+        Computes the entries for the given keys with the real preprocessor and model. The
+        labels mark an entry as filled and are written last, so a concurrent lookup that sees
+        a label also sees its probabilities.
+        """
+        keys = np.unique(np.asarray(keys, dtype=np.int64))
+        data_scaled = preprocessor.transform(self.decode_keys(keys))
+        labels = np.asarray(model.predict(data_scaled)).astype(np.int8)
+        if hasattr(model, "predict_proba"):
+            self.probabilities[keys] = model.predict_proba(data_scaled)
+        self.labels[keys] = labels
+
+    def lookup(self, keys, preprocessor=None, model=None):
+        """
+        Returns labels and probabilities for valid keys. Entries that were not compiled yet
+        are memoized from preprocessor and model, which must then be given.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        missing = keys[self.labels[keys] < 0]
+        if len(missing):
+            if model is None:
+                raise MushroomException("Lookup table has no entry for the requested features", sys)
+            self.fill(missing, preprocessor, model)
+        return self.labels[keys], self.probabilities[keys]
+
+    def lookup_one(self, key, preprocessor=None, model=None):
+        """
+        Scalar version of lookup() for the single record path, returns the encoded label.
+        """
+        label = self.labels[key]
+        if label < 0:
+            if model is None:
+                raise MushroomException("Lookup table has no entry for the requested features", sys)
+            self.fill([key], preprocessor, model)
+            label = self.labels[key]
+        return int(label)
+
+    @property
+    def n_compiled(self):
+        return int(np.count_nonzero(self.labels >= 0))
@@ -0,0 +1,101 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    def __init__(self, predict_batch, max_batch_size=64, max_wait=0.002):
+        """
+        Coalesces concurrent single-item calls into one call of predict_batch.
+
+        Callers block in submit() while a background thread collects the queued items into a
+        batch, runs predict_batch on it and hands every caller its own result. Items queued
+        while the previous batch was being predicted form the next batch right away. The thread
+        only waits for more items, up to max_wait seconds, while more callers are on their way;
+        a batch is never held back when nobody else is submitting.
+
+        Args:
+            predict_batch: Function mapping a list of items to a list of results in the same order.
+            max_batch_size (int): Largest number of items predicted in one call.
+            max_wait (float): Longest time in seconds a batch waits for more items.
+        """
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._pid = None
+
+    def _ensure_worker(self):
+        # Started lazily and restarted after a fork, gunicorn workers do not inherit threads
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.SimpleQueue()
+                    self._pending = 0
+                    threading.Thread(target=self._run, name="micro-batcher", daemon=True).start()
+                    self._pid = os.getpid()
+
+    def submit(self, item):
+        """
+        Predicts a single item as part of a batch and returns its result. When predict_batch
+        fails on a batch, its items are predicted one at a time, so an exception is only
+        re-raised in the caller whose item caused it.
+        """
+        self._ensure_worker()
+        future = Future()
+        with self._lock:
+            self._pending += 1
+        self._queue.put((item, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                on_their_way = self._pending - len(batch)
+            remaining = deadline - time.monotonic()
+            # Nobody else is coming, waiting would only delay the callers already in the batch
+            if remaining <= 0 or on_their_way <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        with self._lock:
+            self._pending -= len(batch)
+        return batch
+
+    def _predict(self, batch):
+        results = self.predict_batch([item for item, _ in batch])
+        if len(results) != len(batch):
+            raise ValueError(f"predict_batch returned {len(results)} results for {len(batch)} items")
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._predict(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # Isolates the failing items, the others still get their result
+                for item_future in batch:
+                    try:
+                        self._predict([item_future])
+                    except Exception as item_error:
+                        item_future[1].set_exception(item_error)
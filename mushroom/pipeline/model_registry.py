@@ -0,0 +1,272 @@
+import os
+import sys
+import time
+import threading
+from dataclasses import dataclass
+
+from mushroom.exception import MushroomException
+from mushroom.logger import logging
+from mushroom.utils.model_bundle import get_current_path, read_manifest, load_model_bundle
+from mushroom.pipeline.portable_runtime import load_portable_runtime
+from mushroom.pipeline.feature_schema import FeatureSchema
+from mushroom.pipeline.serving_metrics import record_model_load
+
+MODEL_RUNTIMES = ("full", "portable")
+
+
+@dataclass
+class ModelRegistryConfig:
+    preprocessor_file_path: str = os.path.join('artifacts', 'model_trainer', 'preprocessor.pkl')
+    model_file_path: str = os.path.join('artifacts', 'model_trainer', 'model.pkl')
+    # Optional compiled lookup table, only used when it was compiled from the loaded model
+    lookup_table_file_path: str = os.path.join('artifacts', 'model_trainer', 'lookup_table.pkl')
+    # Model bundle saved by the compiler, served instead of the files above when it is of their version
+    model_bundle_dir: str = os.path.join('artifacts', 'model_bundle')
+    # joblib mmap_mode of the bundle arrays: "c" shares the pages between workers, None reads them into memory
+    mmap_mode: str = "c"
+    # Hash the bundle files against the manifest checksums on every load
+    verify_checksums: bool = True
+    # "full" serves the preprocessor and model objects, "portable" the numpy-only runtime exported by
+    # the compiler, without importing scikit-learn, XGBoost or CatBoost
+    runtime: str = "full"
+    portable_runtime_file_path: str = os.path.join('artifacts', 'model_trainer', 'portable_runtime.npz')
+    # Minimum number of seconds between two checks of the artifact files for changes
+    reload_check_interval: float = 2.0
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    preprocessor: object
+    model: object
+    version: str
+    loaded_at: float
+    lookup_table: object = None
+    # Manifest of the model bundle the artifacts were loaded from, None for the pickle files
+    manifest: dict = None
+    # Compiled FeatureSchema of the preprocessor, inputs are validated against it
+    schema: FeatureSchema = None
+
+
+class ModelRegistry:
+    def __init__(self, config: ModelRegistryConfig = None):
+        """
+        Process-wide cache of the preprocessor and model artifacts.
+
+        The artifacts are loaded once, on the first call to get() or on an explicit load(),
+        and every caller shares the same ModelBundle. The artifact files are re-checked at most
+        every reload_check_interval seconds; when their mtime or size changes the new version is
+        loaded by the request that noticed the change and swapped in atomically. Concurrent
+        requests keep using the previous bundle meanwhile instead of waiting for the reload.
+        The model bundle written by the compiler is preferred over the pickle files when it
+        holds their version; its arrays are memory-mapped and shared by the worker processes.
+        """
+        self.registry_config = config or ModelRegistryConfig()
+        if self.registry_config.runtime not in MODEL_RUNTIMES:
+            raise MushroomException(f"Unknown model runtime {self.registry_config.runtime}, expected one of {MODEL_RUNTIMES}", sys)
+        self._bundle = None
+        self._signature = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _artifact_paths(self):
+        return (
+            self.registry_config.preprocessor_file_path,
+            self.registry_config.model_file_path
+        )
+
+    def _watched_paths(self):
+        if self.registry_config.runtime == "portable":
+            return (self.registry_config.portable_runtime_file_path,)
+        return (
+            *self._artifact_paths(),
+            self.registry_config.lookup_table_file_path,
+            get_current_path(self.registry_config.model_bundle_dir)
+        )
+
+    def _stat_signature(self):
+        signature = []
+        for path in self._watched_paths():
+            if os.path.exists(path):
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            else:
+                signature.append(None)
+
+        return tuple(signature)
+
+    def _read_current_manifest(self):
+        """
+        Manifest of the model bundle when it holds the same version as the pickle files (or
+        those are not deployed), otherwise None.
+        """
+        manifest = read_manifest(self.registry_config.model_bundle_dir)
+        if manifest is None:
+            return None
+
+        from mushroom.utils.main_utils import get_file_checksum
+
+        if all(os.path.exists(path) for path in self._artifact_paths()):
+            version = get_file_checksum(*self._artifact_paths())
+            if manifest["version"] != version:
+                logging.warning(f"Ignoring model bundle version {manifest['version']}, the model artifacts are version {version}")
+                return None
+
+        return manifest
+
+    def _load_lookup_table(self, version):
+        from mushroom.utils.main_utils import load_object
+
+        lookup_table_path = self.registry_config.lookup_table_file_path
+        if not os.path.exists(lookup_table_path):
+            return None
+
+        lookup_table = load_object(lookup_table_path)
+        if lookup_table.source_version != version:
+            logging.warning(f"Ignoring lookup table compiled for model version {lookup_table.source_version}")
+            return None
+
+        return lookup_table
+
+    def load(self):
+        """
+        Loads the artifacts from disk and swaps them in as the current bundle.
+
+        Returns: The newly loaded ModelBundle
+        """
+        try:
+            with self._lock:
+                return self._load_locked()
+        except Exception as e:
+            raise MushroomException(e, sys)
+
+    def _load_full(self):
+        """
+        Preprocessor, model, lookup table, version and bundle manifest, from the model bundle
+        when it is current and from the pickle files otherwise.
+        """
+        # Imported here, main_utils pulls in the training libraries a portable runtime does without
+        from mushroom.utils.main_utils import load_object, get_file_checksum
+
+        manifest = self._read_current_manifest()
+        if manifest is not None:
+            preprocessor, model, lookup_table, manifest = load_model_bundle(
+                self.registry_config.model_bundle_dir,
+                mmap_mode=self.registry_config.mmap_mode,
+                verify_checksums=self.registry_config.verify_checksums,
+                # The version checked above, even if a newer one was saved since
+                manifest=manifest
+            )
+            return preprocessor, model, lookup_table, manifest["version"], manifest
+
+        version = get_file_checksum(*self._artifact_paths())
+        preprocessor = load_object(self.registry_config.preprocessor_file_path)
+        model = load_object(self.registry_config.model_file_path)
+        return preprocessor, model, self._load_lookup_table(version), version, None
+
+    def _load_locked(self):
+        start_time = time.perf_counter()
+        signature = self._stat_signature()
+
+        if self.registry_config.runtime == "portable":
+            # The runtime's encoder and model stand in for the preprocessor and model
+            runtime = load_portable_runtime(self.registry_config.portable_runtime_file_path)
+            preprocessor, model, lookup_table, version, manifest = runtime.encoder, runtime.model, None, runtime.version, None
+            schema = FeatureSchema(runtime.encoder.columns, runtime.encoder.levels)
+            source = f"portable {runtime.kind} runtime"
+        else:
+            preprocessor, model, lookup_table, version, manifest = self._load_full()
+            # The schema saved with the bundle, or compiled from the preprocessor of the pickle files
+            if manifest is not None and "levels" in manifest["feature_schema"]:
+                schema = FeatureSchema.from_dict(manifest["feature_schema"])
+            else:
+                schema = FeatureSchema.from_preprocessor(preprocessor)
+            source = "model bundle" if manifest is not None else "model artifacts"
+
+        bundle = ModelBundle(
+            preprocessor=preprocessor,
+            model=model,
+            version=version,
+            loaded_at=time.time(),
+            lookup_table=lookup_table,
+            manifest=manifest,
+            schema=schema
+        )
+
+        # A single reference assignment, so readers see either the old or the new bundle
+        self._bundle = bundle
+        self._signature = signature
+        self._last_check = time.monotonic()
+        load_seconds = time.perf_counter() - start_time
+        record_model_load(version, load_seconds)
+        logging.info(f"Loaded {source} version {version} in {load_seconds:.3f}s")
+
+        return bundle
+
+    def _reload_if_changed(self):
+        # Only one thread checks for changes; the others carry on with the current bundle
+        if not self._lock.acquire(blocking=False):
+            return self._bundle
+
+        try:
+            if time.monotonic() - self._last_check < self.registry_config.reload_check_interval:
+                return self._bundle
+            self._last_check = time.monotonic()
+
+            if self._stat_signature() == self._signature:
+                return self._bundle
+            return self._load_locked()
+
+        except Exception as e:
+            # The artifacts may be half way through being replaced; keep serving the
+            # current version and try again on the next check
+            logging.warning(f"Model artifacts reload failed, keeping version {self._bundle.version}: {e}")
+            return self._bundle
+
+        finally:
+            self._lock.release()
+
+    def get(self):
+        """
+        Returns the current ModelBundle, loading it on first use and picking up new
+        versions of the artifact files.
+        """
+        bundle = self._bundle
+        if bundle is None:
+            try:
+                with self._lock:
+                    bundle = self._bundle or self._load_locked()
+                return bundle
+            except Exception as e:
+                raise MushroomException(e, sys)
+
+        if time.monotonic() - self._last_check >= self.registry_config.reload_check_interval:
+            bundle = self._reload_if_changed()
+
+        return bundle
+
+    def warm_up(self):
+        """
+        Loads the artifacts ahead of the first request. Missing artifacts are only logged,
+        so a worker can start before the first model has been trained.
+        """
+        try:
+            self.get()
+        except MushroomException as e:
+            logging.warning(f"Model artifacts not loaded at startup: {e}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry(config: ModelRegistryConfig = None):
+    """
+    Returns the process-wide ModelRegistry shared by the web app and PredictionPipeline.
+    config only applies to the call that creates it, the first one.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry(config)
+    return _registry
@@ -0,0 +1,228 @@
+import os
+import json
+
+import numpy as np
+
+# Only numpy is imported here: serving from a portable runtime needs none of the training libraries
+RUNTIME_FORMAT_VERSION = 1
+RUNTIME_KINDS = ("linear", "trees", "table")
+
+
+class PortableEncoder:
+    def __init__(self, columns, levels):
+        """
+        Maps every feature column to the code of its level, the position among the levels
+        the fitted encoder knows. Missing values (None or NaN) get the code of the missing
+        level when the encoder learnt one, unknown levels raise a ValueError like the
+        encoders of the preprocessor do.
+
+        Args:
+            columns (list): Feature column names, in the order of the output columns.
+            levels (list): For every column, its levels with None standing for missing values.
+        """
+        self.columns = list(columns)
+        self.levels = [list(column_levels) for column_levels in levels]
+        self.codes = [{level: code for code, level in enumerate(column_levels) if level is not None} for column_levels in self.levels]
+        self.missing_codes = [next((code for code, level in enumerate(column_levels) if level is None), None) for column_levels in self.levels]
+
+    def transform(self, X):
+        """
+        Returns an int array with one row of level codes per record of X, a DataFrame or a
+        dict of columns.
+        """
+        columns = []
+        for column, column_codes, missing_code in zip(self.columns, self.codes, self.missing_codes):
+            values = np.asarray(X[column], dtype=object)
+            codes = np.empty(len(values), dtype=np.int64)
+            for i, value in enumerate(values):
+                code = column_codes.get(value)
+                if code is None and (value is None or (isinstance(value, float) and value != value)):
+                    code = missing_code
+                if code is None:
+                    raise ValueError(f"Found unknown categories [{value!r}] in column {column} during transform")
+                codes[i] = code
+            columns.append(codes)
+        return np.column_stack(columns) if columns else np.empty((0, 0), dtype=np.int64)
+
+
+class _PortableClassifier:
+    def __init__(self, classes):
+        self.classes_ = np.asarray(classes)
+
+    def predict(self, codes):
+        return self.classes_[np.argmax(self.predict_proba(codes), axis=1)]
+
+
+class PortableLinearModel(_PortableClassifier):
+    def __init__(self, weights, intercept, classes):
+        """
+        Logistic regression over one-hot encoded levels, with the one-hot encoding and the
+        scaling folded into one weight per level: the decision function is the sum of the
+        weights of a record's levels plus the intercept.
+
+        Args:
+            weights (list): For every column, an array of shape (n_levels, n_outputs).
+            intercept (ndarray): Intercepts, of shape (n_outputs,).
+            classes (ndarray): Class labels, as in classes_ of the original model.
+        """
+        super().__init__(classes)
+        self.weights = [np.asarray(column_weights, dtype=np.float64) for column_weights in weights]
+        self.intercept = np.asarray(intercept, dtype=np.float64)
+
+    def predict_proba(self, codes):
+        decision = np.tile(self.intercept, (len(codes), 1))
+        for i, column_weights in enumerate(self.weights):
+            decision += column_weights[codes[:, i]]
+
+        if decision.shape[1] == 1:
+            positive = 1 / (1 + np.exp(-decision[:, 0]))
+            return np.column_stack([1 - positive, positive])
+
+        decision -= decision.max(axis=1, keepdims=True)
+        probabilities = np.exp(decision)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+class PortableTreeEnsemble(_PortableClassifier):
+    def __init__(self, feature, threshold, left, right, value, roots, classes):
+        """
+        Decision trees splitting on level codes, stored as one flat node array for all trees.
+        Leaves have left == -1 and hold class probabilities; the ensemble averages them as
+        sklearn's forests do.
+
+        Args:
+            feature, threshold, left, right (ndarray): Per node split column, threshold and
+                child node indexes (into the flat arrays).
+            value (ndarray): Per node class probabilities, of shape (n_nodes, n_classes).
+            roots (ndarray): Index of the root node of every tree.
+            classes (ndarray): Class labels, as in classes_ of the original model.
+        """
+        super().__init__(classes)
+        self.feature = np.asarray(feature, dtype=np.int64)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int64)
+        self.right = np.asarray(right, dtype=np.int64)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int64)
+
+    def predict_proba(self, codes):
+        rows = np.arange(len(codes))
+        probabilities = np.zeros((len(codes), self.value.shape[1]))
+        for root in self.roots:
+            nodes = np.full(len(codes), root, dtype=np.int64)
+            inner = self.left[nodes] >= 0
+            while inner.any():
+                active = nodes[inner]
+                goes_left = codes[rows[inner], self.feature[active]] <= self.threshold[active]
+                nodes[inner] = np.where(goes_left, self.left[active], self.right[active])
+                inner = self.left[nodes] >= 0
+            probabilities += self.value[nodes]
+        return probabilities / len(self.roots)
+
+
+class PortableTableModel(_PortableClassifier):
+    def __init__(self, strides, labels, probabilities, classes):
+        """
+        Predictions for every combination of levels, indexed by the mixed radix key of the
+        level codes; the compiled lookup table of any model.
+
+        Args:
+            strides (ndarray): Key stride of every column.
+            labels (ndarray): Predicted label per key.
+            probabilities (ndarray): Probabilities per key, of shape (n_keys, n_classes), or
+                None when the model has none (predict_proba is then not available).
+            classes (ndarray): Class labels, as in classes_ of the original model.
+        """
+        super().__init__(classes)
+        self.strides = np.asarray(strides, dtype=np.int64)
+        self.labels = np.asarray(labels)
+        self.probabilities = probabilities
+
+    def predict(self, codes):
+        return self.labels[codes @ self.strides]
+
+    @property
+    def predict_proba(self):
+        # Raising AttributeError makes hasattr(model, "predict_proba") False, as for the original model
+        if self.probabilities is None:
+            raise AttributeError("The model this table was compiled from has no predict_proba")
+        return self._predict_proba
+
+    def _predict_proba(self, codes):
+        return self.probabilities[codes @ self.strides]
+
+
+_MODEL_ARRAYS = {
+    "linear": ("intercept",),
+    "trees": ("feature", "threshold", "left", "right", "value", "roots"),
+    "table": ("strides", "labels")
+}
+
+
+class PortableRuntime:
+    def __init__(self, kind, version, encoder, model):
+        """
+        Standalone predictor exported from a trained preprocessor and model. encoder stands in
+        for the preprocessor and model for the model, so it is served through the same
+        transform / predict / predict_proba calls.
+
+        Args:
+            kind (str): One of RUNTIME_KINDS.
+            version (str): Checksum of the preprocessor and model it was exported from.
+            encoder (PortableEncoder): Maps records to level codes.
+            model: PortableLinearModel, PortableTreeEnsemble or PortableTableModel.
+        """
+        self.kind = kind
+        self.version = version
+        self.encoder = encoder
+        self.model = model
+
+    def save(self, file_path):
+        """
+        Saves the runtime as a single .npz file of plain arrays, loadable without pickle.
+        """
+        spec = {
+            "format_version": RUNTIME_FORMAT_VERSION,
+            "kind": self.kind,
+            "version": self.version,
+            "columns": self.encoder.columns,
+            "levels": self.encoder.levels,
+            "classes": self.model.classes_.tolist()
+        }
+        arrays = {name: getattr(self.model, name) for name in _MODEL_ARRAYS[self.kind]}
+        if self.kind == "linear":
+            for i, column_weights in enumerate(self.model.weights):
+                arrays[f"weights_{i}"] = column_weights
+        if self.kind == "table" and self.model.probabilities is not None:
+            arrays["probabilities"] = self.model.probabilities
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # np.savez appends .npz to names without it, the temporary file keeps the extension
+        tmp_file_path = f"{file_path}.tmp.npz"
+        np.savez(tmp_file_path, spec=np.asarray(json.dumps(spec)), **arrays)
+        os.replace(tmp_file_path, file_path)
+
+
+def load_portable_runtime(file_path):
+    """
+    Loads a runtime saved by PortableRuntime.save.
+    """
+    with np.load(file_path, allow_pickle=False) as data:
+        spec = json.loads(str(data["spec"]))
+        if spec["format_version"] != RUNTIME_FORMAT_VERSION:
+            raise ValueError(f"Unsupported portable runtime format {spec['format_version']}")
+        arrays = {name: data[name] for name in data.files if name != "spec"}
+
+    kind = spec["kind"]
+    classes = np.asarray(spec["classes"])
+    if kind == "linear":
+        weights = [arrays[f"weights_{i}"] for i in range(len(spec["columns"]))]
+        model = PortableLinearModel(weights, arrays["intercept"], classes)
+    elif kind == "trees":
+        model = PortableTreeEnsemble(*(arrays[name] for name in _MODEL_ARRAYS["trees"]), classes)
+    elif kind == "table":
+        model = PortableTableModel(arrays["strides"], arrays["labels"], arrays.get("probabilities"), classes)
+    else:
+        raise ValueError(f"Unknown portable runtime kind {kind}, expected one of {RUNTIME_KINDS}")
+
+    return PortableRuntime(kind, spec["version"], PortableEncoder(spec["columns"], spec["levels"]), model)
@@ -0,0 +1,189 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from mushroom.constants import FEATURE_COLUMNS
+from mushroom.exception import MushroomException
+from mushroom.logger import logging
+from mushroom.pipeline.feature_schema import normalize_value
+from mushroom.pipeline.serving_metrics import record_cache_lookup
+
+CACHE_BACKENDS = ("local", "redis")
+
+
+@dataclass
+class PredictionCacheConfig:
+    # "local" keeps the entries in the worker process, "redis" shares them between workers
+    backend: str = "local"
+    # Maximum number of entries of the local backend, least recently used entries are evicted first
+    max_size: int = 10000
+    # Seconds an entry is served for, None keeps entries until they are evicted
+    ttl_seconds: float = 3600.0
+    redis_url: str = "redis://localhost:6379/0"
+    redis_key_prefix: str = "mushroom:prediction"
+
+
+def normalize_record(record, columns=FEATURE_COLUMNS):
+    """
+    Returns the feature values of a record as a tuple in the order of columns, with strings
+    stripped and lower-cased and every kind of missing value (None, "", NaN) as None. Other
+    fields of the record are ignored.
+    """
+    return tuple(normalize_value(record.get(column)) for column in columns)
+
+
+def denormalize_record(features, columns=FEATURE_COLUMNS):
+    """
+    Record dict for the preprocessor of a normalized feature tuple, missing values become NaN.
+    """
+    return {column: np.nan if value is None else value for column, value in zip(columns, features)}
+
+
+class LocalCacheBackend:
+    def __init__(self, max_size, ttl_seconds):
+        """
+        Thread-safe in-process LRU cache whose entries expire after ttl_seconds.
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    def __init__(self, url, ttl_seconds, key_prefix, client=None):
+        """
+        Cache shared by every worker through Redis. Entries expire after ttl_seconds; bounding
+        the total size is left to the maxmemory policy of the Redis server. Any client with the
+        get/set interface of redis.Redis can be passed in instead of connecting to url.
+        """
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise MushroomException(f"The redis prediction cache backend needs the redis package: {e}", sys)
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+
+    def _redis_key(self, key):
+        version, features = key
+        values = "\x1f".join("" if value is None else str(value) for value in features)
+        return f"{self.key_prefix}:{version}:{values}"
+
+    def get(self, key):
+        value = self.client.get(self._redis_key(key))
+        return None if value is None else int(value)
+
+    def set(self, key, value):
+        ttl = int(self.ttl_seconds) if self.ttl_seconds is not None else None
+        self.client.set(self._redis_key(key), int(value), ex=ttl)
+
+    def clear(self):
+        # Keys carry the model version, entries of earlier versions are never read again and expire
+        pass
+
+
+class PredictionCache:
+    def __init__(self, config: PredictionCacheConfig = None, backend=None):
+        """
+        Predicted labels keyed on the model version and the normalized feature tuple of a record.
+        A new model version never sees entries of the previous one, and the local backend is
+        emptied as soon as it is asked for a new version.
+
+        Args:
+            config (PredictionCacheConfig): Backend choice, size and expiry.
+            backend: Object with get/set/clear used instead of the backend named by the config.
+        """
+        self.cache_config = config or PredictionCacheConfig()
+        if backend is None:
+            backend = self._create_backend()
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        # Serving threads share the counters, see MicroBatcher
+        self._lock = threading.Lock()
+
+    def _create_backend(self):
+        config = self.cache_config
+        if config.backend == "local":
+            return LocalCacheBackend(config.max_size, config.ttl_seconds)
+        if config.backend == "redis":
+            return RedisCacheBackend(config.redis_url, config.ttl_seconds, config.redis_key_prefix)
+        raise MushroomException(f"Unknown prediction cache backend {config.backend}, expected one of {CACHE_BACKENDS}", sys)
+
+    def get(self, version, features):
+        """
+        Cached label of the normalized features for the model version, or None.
+        """
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self.backend.clear()
+                    self._version = version
+                    logging.info(f"Prediction cache serves model version {version}")
+
+        try:
+            label = self.backend.get((version, features))
+        except Exception as e:
+            # A shared backend that is down only costs the model call
+            logging.warning(f"Prediction cache lookup failed: {e}")
+            label = None
+
+        with self._lock:
+            if label is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        record_cache_lookup(label is not None)
+        return label
+
+    def set(self, version, features, label):
+        try:
+            self.backend.set((version, features), label)
+        except Exception as e:
+            logging.warning(f"Prediction cache update failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else None
+        }
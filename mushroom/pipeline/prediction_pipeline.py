@@ -2,62 +2,291 @@ import os
 import sys
 import numpy as np
 import pandas as pd
+from dataclasses import dataclass
 
+from mushroom.constants import CLASS_LABELS, FEATURE_COLUMNS
 from mushroom.exception import MushroomException
 from mushroom.logger import logging
-from mushroom.utils.main_utils import load_object
+from mushroom.pipeline.feature_schema import InvalidInputError, SchemaValidationError
+from mushroom.pipeline.micro_batcher import MicroBatcher
+from mushroom.pipeline.model_registry import get_model_registry
+from mushroom.pipeline.prediction_cache import PredictionCache, normalize_record, denormalize_record
+from mushroom.pipeline.serving_metrics import record_lookup, record_prediction, record_predictions
+
+INVALID_ROW_POLICIES = ("reject", "flag")
+
+@dataclass
+class PredictionPipelineConfig:
+    # Maximum number of rows transformed and predicted in one call, bounds peak memory of a batch
+    batch_chunk_size: int = 10000
+    # Serve from the compiled lookup table when the registry has one for the current model
+    use_lookup_table: bool = True
+    # Concurrent single records that miss the lookup table are coalesced into one model call of
+    # up to micro_batch_max_size rows; a batch waits at most micro_batch_max_wait_ms for more
+    # records, and only while several requests are in flight. A size of 1 disables it.
+    micro_batch_max_size: int = 64
+    micro_batch_max_wait_ms: float = 2.0
+    # Remember the labels of single records that miss the lookup table, per model version
+    use_prediction_cache: bool = True
+    # Check inputs against the feature schema of the model before they are transformed
+    validate_inputs: bool = True
+    # Rows of predict_batch failing validation: "reject" raises a SchemaValidationError for the
+    # whole batch, "flag" predicts the valid rows and returns the others without a label, with
+    # their invalid fields in an "errors" column. predict() and predict_record() always reject
+    invalid_rows: str = "reject"
 
 class PredictionPipeline:
-    def __init__(self):
-        pass
+    def __init__(self, registry=None, config: PredictionPipelineConfig = None, prediction_cache: PredictionCache = None):
+        """
+        The preprocessor and model come from the process-wide model registry, so every
+        PredictionPipeline in a process shares one cached copy of the artifacts.
+        prediction_cache defaults to a local PredictionCache when the config enables one.
+        """
+        self.registry = registry or get_model_registry()
+        self.prediction_config = config or PredictionPipelineConfig()
+        if self.prediction_config.invalid_rows not in INVALID_ROW_POLICIES:
+            raise MushroomException(f"Unknown invalid rows policy {self.prediction_config.invalid_rows}, expected one of {INVALID_ROW_POLICIES}", sys)
+        self.prediction_cache = None
+        if self.prediction_config.use_prediction_cache:
+            self.prediction_cache = prediction_cache or PredictionCache()
+        self.micro_batcher = None
+        if self.prediction_config.micro_batch_max_size > 1:
+            self.micro_batcher = MicroBatcher(
+                self._predict_records,
+                max_batch_size=self.prediction_config.micro_batch_max_size,
+                max_wait=self.prediction_config.micro_batch_max_wait_ms / 1000
+            )
+    
+    def _lookup_table(self, bundle):
+        return bundle.lookup_table if self.prediction_config.use_lookup_table else None
+    
+    @staticmethod
+    def feature_columns(bundle):
+        """
+        Input columns of the model, the only fields of a record that are read.
+        """
+        return bundle.schema.columns if bundle.schema is not None else list(FEATURE_COLUMNS)
+    
+    def _validate(self, bundle, features, invalid_rows="reject"):
+        """
+        SchemaValidation of a DataFrame of features, None when validation is disabled. Raises a
+        SchemaValidationError for invalid rows unless invalid_rows is "flag".
+        """
+        if not self.prediction_config.validate_inputs or bundle.schema is None:
+            return None
+        
+        validation = bundle.schema.validate(features)
+        if invalid_rows == "reject" and not validation.valid.all():
+            raise SchemaValidationError(validation.errors)
+        return validation
+    
+    def _model_predict(self, bundle, features):
+        data_scaled = bundle.preprocessor.transform(features)
+        labels = np.asarray(bundle.model.predict(data_scaled)).astype(int)
+        
+        # Not every estimator can produce probabilities (e.g. SVC without probability=True)
+        probabilities = None
+        if hasattr(bundle.model, "predict_proba"):
+            probabilities = bundle.model.predict_proba(data_scaled)
+        
+        return labels, probabilities
+    
+    def _predict_frame(self, bundle, features=None, validation=None):
+        """
+        Returns the encoded labels and the class probabilities (None when the model has none)
+        for a DataFrame of features, or for the valid rows of a SchemaValidation. The lookup
+        table keys of validated rows are computed from their level codes directly.
+        """
+        table = self._lookup_table(bundle)
+        if table is None:
+            labels, probabilities = self._model_predict(bundle, validation.features if validation is not None else features)
+            record_lookup(0, len(labels))
+            record_predictions(labels)
+            return labels, probabilities
+        
+        keys = table.encode_codes(validation.codes) if validation is not None else table.encode_frame(features)
+        known = keys >= 0
+        # Unknown levels and entries that are not compiled yet go through the model
+        hits = int(np.count_nonzero(table.labels[keys[known]] >= 0))
+        record_lookup(hits, len(keys) - hits)
+        
+        labels = np.empty(len(keys), dtype=int)
+        probabilities = np.empty((len(keys), table.probabilities.shape[1]))
+        labels[known], probabilities[known] = table.lookup(keys[known], bundle.preprocessor, bundle.model)
+        
+        if not known.all():
+            # Levels the encoder has never seen go through the model, which reports them
+            if validation is not None:
+                features = validation.features
+            labels[~known], unknown_probabilities = self._model_predict(bundle, features[~known])
+            if unknown_probabilities is not None:
+                probabilities[~known] = unknown_probabilities
+        
+        if not hasattr(bundle.model, "predict_proba"):
+            probabilities = None
+        
+        record_predictions(labels)
+        return labels, probabilities
     
     def predict(self, features):
         try:
-            model_path = 'artifacts\model.pkl'
-            preprocessor_path = 'artifacts\preprocessor.pkl'
-            
-            model = load_object(model_path)
-            preprocessor = load_object(preprocessor_path)
+            bundle = self.registry.get()
             
-            data_scaled = preprocessor.transform(features)
-            preds = model.predict(data_scaled)
+            validation = self._validate(bundle, features)
+            preds, _ = self._predict_frame(bundle, features, validation)
             
             return preds
             
+        except InvalidInputError:
+            raise
         except Exception as e:
             raise MushroomException(e,sys)
-        
-class CustomData:
-    def __init__(self,
-                 bruises: str,
-                 gill_spacing: str,
-                 gill_size: str,
-                 gill_color: str,
-                 stalk_root: str,
-                 ring_type: str,
-                 spore_print_color: str 
-                 ):
-        self.bruises = bruises
-        self.gill_spacing = gill_spacing
-        self.gill_size = gill_size
-        self.gill_color = gill_color
-        self.stalk_root = stalk_root
-        self.ring_type = ring_type
-        self.spore_print_color = spore_print_color
-        
-    def get_data_as_data_frame(self):
+    
+    def predict_record(self, record):
+        """
+        Predicts a single mushroom given as a dict of feature values and returns the encoded label.
+        With a compiled lookup table this is a handful of dict lookups and one array read;
+        otherwise the label comes from the prediction cache, or concurrent calls share a model
+        call through the micro-batcher. String values are stripped and lower-cased first, and
+        a record the table does not know is checked against the feature schema before it goes
+        any further.
+        """
         try:
-            custom_data_input_dict = {
-                "bruises": [self.bruises],
-                "gill-spacing": [self.gill_spacing],
-                "gill-size": [self.gill_size],
-                "gill-color": [self.gill_color],
-                "stalk-root": [self.stalk_root],
-                "ring-type": [self.ring_type],
-                "spore-print-color": [self.spore_print_color]
-            }
-            
-            return pd.DataFrame(custom_data_input_dict)
+            bundle = self.registry.get()
+            columns = self.feature_columns(bundle)
+            features = normalize_record(record, columns)
+            record = denormalize_record(features, columns)
+            
+            table = self._lookup_table(bundle)
+            if table is not None:
+                key = table.encode_record(record)
+                if key is not None:
+                    record_lookup(int(table.labels[key] >= 0), int(table.labels[key] < 0))
+                    label = table.lookup_one(key, bundle.preprocessor, bundle.model)
+                    record_prediction(label)
+                    return label
+            
+            # A record with a lookup table key is valid, only the others need checking
+            if self.prediction_config.validate_inputs and bundle.schema is not None:
+                errors = bundle.schema.validate_record(features)
+                if errors:
+                    raise SchemaValidationError(errors)
+            
+            if self.prediction_cache is not None:
+                label = self.prediction_cache.get(bundle.version, features)
+                if label is not None:
+                    record_prediction(label)
+                    return label
+            
+            if self.micro_batcher is not None:
+                label = self.micro_batcher.submit(record)
+            else:
+                label = self._predict_records([record])[0]
+            
+            if self.prediction_cache is not None:
+                self.prediction_cache.set(bundle.version, features, label)
+            return label
+            
+        except InvalidInputError:
+            raise
+        except Exception as e:
+            raise MushroomException(e,sys)
+    
+    def _predict_records(self, records):
+        """
+        Predicts a list of records with one preprocessor.transform and model.predict call.
+        """
+        bundle = self.registry.get()
+        preds, _ = self._model_predict(bundle, pd.DataFrame(records, columns=self.feature_columns(bundle), dtype=object))
+        record_lookup(0, len(records))
+        record_predictions(preds)
+        
+        return preds.tolist()
+    
+    def _iter_chunks(self, records, chunk_size, columns):
+        """
+        Yields DataFrames of at most chunk_size rows holding only the given feature columns.
+        records can be a DataFrame, a list of dicts, or a path / file-like object of CSV data.
+        """
+        if isinstance(records, pd.DataFrame):
+            for start in range(0, len(records), chunk_size):
+                yield records.iloc[start:start + chunk_size][columns]
+                
+        elif isinstance(records, (list, tuple)):
+            for start in range(0, len(records), chunk_size):
+                yield pd.DataFrame.from_records(records[start:start + chunk_size], columns=columns)
+                
+        else:
+            # CSV stream: parse only the feature columns, chunk by chunk
+            try:
+                reader = pd.read_csv(records, usecols=columns, chunksize=chunk_size)
+                for chunk in reader:
+                    yield chunk
+            # Unparsable data, or a header without the feature columns
+            except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError, ValueError) as e:
+                raise InvalidInputError(f"Invalid CSV data: {e}")
+    
+    def _predict_chunk(self, bundle, features):
+        validation = self._validate(bundle, features, self.prediction_config.invalid_rows)
+        if validation is None:
+            valid = np.ones(len(features), dtype=bool)
+            preds, probabilities = self._predict_frame(bundle, features)
+        else:
+            valid = validation.valid
+            preds, probabilities = np.empty(0, dtype=int), None
+            if valid.any():
+                preds, probabilities = self._predict_frame(bundle, validation=validation.select(valid))
+        
+        # Flagged invalid rows keep their place, without a label or probabilities
+        labels = np.full(len(features), None, dtype=object)
+        labels[valid] = np.asarray(CLASS_LABELS, dtype=object)[preds]
+        result = pd.DataFrame({"label": labels}, index=features.index)
+        
+        if probabilities is not None:
+            for i, class_label in enumerate(CLASS_LABELS):
+                column = np.full(len(features), np.nan)
+                column[valid] = probabilities[:, i]
+                result[f"probability_{class_label}"] = column
+        
+        if not valid.all():
+            result["errors"] = validation.row_errors()
         
+        return result
+            
+    def predict_batch(self, records, chunk_size=None):
+        """
+        Predicts many mushrooms at once. Each chunk of rows goes through a single
+        preprocessor.transform and model.predict call.
+
+        Args:
+            records: A DataFrame, a list of dicts keyed by feature column name, or a path /
+                file-like object of CSV data with a header row.
+            chunk_size (int): Rows per chunk, defaults to PredictionPipelineConfig.batch_chunk_size.
+
+        Returns:
+            A DataFrame with one row per input record holding the predicted "label" and, when the
+            model supports it, a "probability_<class>" column for every class. Rows flagged as
+            invalid have no label and their invalid fields in an "errors" column. The model
+            version used is stored in its attrs["model_version"].
+        """
+        try:
+            chunk_size = chunk_size or self.prediction_config.batch_chunk_size
+            
+            # Take one bundle for the whole batch so every row is scored by the same model version
+            bundle = self.registry.get()
+            
+            columns = self.feature_columns(bundle)
+            results = [self._predict_chunk(bundle, chunk) for chunk in self._iter_chunks(records, chunk_size, columns)]
+            predictions = pd.concat(results) if results else pd.DataFrame(columns=["label"])
+            if "errors" in predictions:
+                predictions["errors"] = predictions["errors"].fillna("")
+            predictions.attrs["model_version"] = bundle.version
+            
+            logging.info(f"Predicted a batch of {len(predictions)} rows in {len(results)} chunks")
+            
+            return predictions
+            
+        except InvalidInputError:
+            raise
         except Exception as e:
-            raise MushroomException(e,sys)
\ No newline at end of file
+            raise MushroomException(e,sys)
@@ -0,0 +1,118 @@
+import os
+import time
+
+import numpy as np
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+
+from mushroom.constants import CLASS_LABELS
+
+# prometheus_client aggregates across processes when this directory is set before it is imported:
+# every worker writes its values to memory-mapped files there and /metrics sums them up
+# ("shared" mode). Without it every worker only reports its own values ("per_worker" mode).
+MULTIPROCESS_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+# Request latencies of the service range from microseconds (lookup table) to seconds (large batches)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUESTS = Counter(
+    "mushroom_http_requests_total", "HTTP requests handled", ["route", "method", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "mushroom_http_request_duration_seconds", "HTTP request latency", ["route"], buckets=LATENCY_BUCKETS
+)
+PREDICTIONS = Counter(
+    "mushroom_predictions_total", "Predicted rows per label", ["label"]
+)
+LOOKUP_TABLE = Counter(
+    "mushroom_lookup_table_rows_total",
+    "Rows served from the compiled lookup table (hit) or by the model (miss)", ["result"]
+)
+PREDICTION_CACHE = Counter(
+    "mushroom_prediction_cache_lookups_total", "Prediction cache lookups per result", ["result"]
+)
+# Gauges of dead workers are dropped, a version is reported while any live worker serves it
+MODEL_INFO = Gauge(
+    "mushroom_model_info", "Model artifacts version served", ["version"], multiprocess_mode="livemax"
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "mushroom_model_load_seconds", "Time the last model artifacts load took", multiprocess_mode="livemax"
+)
+MODEL_LOADED_AT = Gauge(
+    "mushroom_model_loaded_timestamp_seconds", "Unix time of the last model artifacts load", multiprocess_mode="livemax"
+)
+
+# Label children are created once per label value; later lookups are plain dict reads
+_route_children = {}
+_label_children = [PREDICTIONS.labels(label=label) for label in CLASS_LABELS]
+_lookup_hits = LOOKUP_TABLE.labels(result="hit")
+_lookup_misses = LOOKUP_TABLE.labels(result="miss")
+_cache_hits = PREDICTION_CACHE.labels(result="hit")
+_cache_misses = PREDICTION_CACHE.labels(result="miss")
+_model_version = None
+
+
+def get_metrics_mode():
+    return "shared" if os.environ.get(MULTIPROCESS_DIR_ENV) else "per_worker"
+
+
+def record_request(route, method, status, duration):
+    children = _route_children.get((route, method, status))
+    if children is None:
+        children = (
+            REQUESTS.labels(route=route, method=method, status=status),
+            REQUEST_LATENCY.labels(route=route)
+        )
+        _route_children[(route, method, status)] = children
+    children[0].inc()
+    children[1].observe(duration)
+
+
+def record_predictions(labels):
+    """
+    Counts the predicted rows per label, given the encoded labels.
+    """
+    counts = np.bincount(np.asarray(labels, dtype=np.int64), minlength=len(_label_children))
+    for child, count in zip(_label_children, counts):
+        if count:
+            child.inc(int(count))
+
+
+def record_prediction(label):
+    _label_children[label].inc()
+
+
+def record_lookup(hits, misses):
+    if hits:
+        _lookup_hits.inc(hits)
+    if misses:
+        _lookup_misses.inc(misses)
+
+
+def record_cache_lookup(hit):
+    (_cache_hits if hit else _cache_misses).inc()
+
+
+def record_model_load(version, load_seconds):
+    global _model_version
+    if _model_version is not None and _model_version != version:
+        MODEL_INFO.labels(version=_model_version).set(0)
+    MODEL_INFO.labels(version=version).set(1)
+    MODEL_LOAD_SECONDS.set(load_seconds)
+    MODEL_LOADED_AT.set(time.time())
+    _model_version = version
+
+
+def generate_metrics():
+    """
+    Returns the metrics in the Prometheus text format and its content type.
+    """
+    if get_metrics_mode() == "shared":
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,21 +1,78 @@
 import os
 import sys
+import pandas as pd
+from dataclasses import dataclass
+from mushroom.constants import FEATURE_COLUMNS, TARGET_COLUMN
 from mushroom.components.data_ingestion import DataIngestion
-from mushroom.components.data_transformation import DataTransformation
-from mushroom.components.model_trainer import ModelTrainer
+from mushroom.components.data_transformation import (
+    DataTransformation, load_transformed_shards, get_preprocessing_profile, get_feature_columns,
+    get_new_levels, extend_preprocessor_levels, get_category_drift, encode_target
+)
+from mushroom.components.feature_selection import FeatureSelection, FeatureSelectionConfig, load_selected_columns
+from mushroom.components.model_trainer import ModelTrainer, can_absorb_new_levels
+from mushroom.components.model_compiler import ModelCompiler
 from mushroom.exception import MushroomException
 from mushroom.logger import logging
+from mushroom.utils.artifact_writer import ArtifactWriter
+from mushroom.utils.main_utils import log_memory_report, load_object
+from mushroom.utils.feature_store import read_feature_store
+from mushroom.utils.instrumentation import InstrumentationConfig, configure_instrumentation, reset_timings
+from mushroom.utils.stage_cache import StageCache, StageCacheConfig
+from mushroom.utils.experiment_tracker import ExperimentTrackerConfig
+
+FEATURE_SELECTION_MODES = ("off", "run", "reuse")
+
+@dataclass
+class TrainPipelineConfig:
+    # "disk": stages exchange artifact file paths, "memory": stages hand DataFrames and arrays to each other,
+    # "stream": ingestion and transformation work through the data in chunks and exchange shard files
+    handoff: str = "disk"
+    # How artifacts are persisted with the in-memory handoff: "async" writes them in a background
+    # thread while the next stages run, "skip" writes nothing (ephemeral experiment runs)
+    persist: str = "async"
+    # Skip the stages whose inputs, configuration and code are unchanged since a previous run
+    use_cache: bool = True
+    # Recompute every stage even when it is cached
+    force: bool = False
+    # Input columns of the model: "off" keeps the FEATURE_COLUMNS picked in the EDA notebook,
+    # "run" ranks every column of the source and keeps the smallest set reaching the best
+    # accuracy (see FeatureSelection), "reuse" takes the columns of the last selection and runs
+    # one when there is none. Only the model's columns are parsed and served afterwards
+    feature_selection: str = "off"
+    # Score the columns are ranked by, one of FEATURE_RANKINGS
+    feature_ranking: str = "model_importance"
+    # How training runs are logged to MLflow, one of EXPERIMENT_TRACKING_MODES
+    experiment_tracking: str = "async"
+    # Stage to run under a profiler: "data_ingestion", "feature_selection", "data_transformation",
+    # "model_search", "model_training" or "model_compilation"; None profiles nothing
+    profile_stage: str = None
+    # "cprofile" or "pyinstrument"
+    profiler: str = "cprofile"
+    # Incremental runs fall back to full retraining when the level frequencies of the new rows
+    # differ from the training data by more than this total variation distance in any column.
+    # Small batches differ by chance, a few hundred rows stay well below the default
+    drift_threshold: float = 0.3
 
 class TrainPipeline:
 
-    def __init__(self):
+    def __init__(self, config: TrainPipelineConfig = None):
         """
         Initializes the TrainPipeline class.
         """
         try:
+            self.pipeline_config = config or TrainPipelineConfig()
             self.data_ingestion = DataIngestion()  # Initialize data ingestion component
+            self.feature_selection = FeatureSelection(FeatureSelectionConfig(ranking=self.pipeline_config.feature_ranking))  # Initialize feature selection component
             self.data_transformation = DataTransformation()  # Initialize data transformation component
-            self.model_trainer = ModelTrainer()  # Initialize model trainer component
+            self.model_trainer = ModelTrainer(ExperimentTrackerConfig(mode=self.pipeline_config.experiment_tracking))  # Initialize model trainer component
+            self.model_compiler = ModelCompiler()  # Initialize lookup table compiler component
+            configure_instrumentation(InstrumentationConfig(
+                profile_stage=self.pipeline_config.profile_stage,
+                profiler=self.pipeline_config.profiler
+            ))
+            self.stage_cache = None
+            if self.pipeline_config.use_cache:
+                self.stage_cache = StageCache(StageCacheConfig(force=self.pipeline_config.force))
         except Exception as e:
             raise MushroomException(e, sys)
 
@@ -24,65 +81,275 @@ class TrainPipeline:
         Initiates data ingestion and returns paths of train and test datasets.
         """
         try:
-            train_data_path, test_data_path = self.data_ingestion.initiate_data_ingestion()
+            train_data_path, test_data_path = self.data_ingestion.initiate_data_ingestion(self.stage_cache)
             return train_data_path, test_data_path
         except Exception as e:
             raise MushroomException(e, sys)
 
+    def set_feature_columns(self, feature_columns):
+        """
+        Sets the columns ingestion reads and the preprocessors take, None reads every column.
+        """
+        self.data_ingestion.ingestion_config.feature_columns = None if feature_columns is None else tuple(feature_columns)
+        if feature_columns is not None:
+            self.data_transformation.data_transformation_config.feature_columns = tuple(feature_columns)
+
+    def initiate_feature_selection(self, train_df, test_df):
+        """
+        Selects the input columns of the model and sets them for the next stages.
+        """
+        try:
+            feature_columns = self.feature_selection.initiate_feature_selection(train_df, test_df, self.stage_cache)
+            self.set_feature_columns(feature_columns)
+            return feature_columns
+        except Exception as e:
+            raise MushroomException(e, sys)
+
     def initiate_data_transformation(self, train_data_path, test_data_path):
         """
         Initiates data transformation and returns transformed data.
         """
         try:
-            return self.data_transformation.initiate_data_transformation(train_data_path, test_data_path)
+            return self.data_transformation.initiate_data_transformation(train_data_path, test_data_path, self.stage_cache)
         except Exception as e:
             raise MushroomException(e, sys)
 
-    def initiate_model_trainer(self, train_features, train_target, test_features, test_target):
+    def initiate_model_trainer(self, train_features, train_target, test_features, test_target, artifact_writer=None, preprocessor_paths=None):
         """
         Initiates the model trainer and returns accuracy score and the trained model.
         """
         try:
-            accuracy, best_model = self.model_trainer.initiate_model_trainer(train_features, train_target, test_features, test_target)
+            accuracy, best_model = self.model_trainer.initiate_model_trainer(
+                train_features, train_target, test_features, test_target,
+                artifact_writer, self.stage_cache, preprocessor_paths
+            )
             return accuracy, best_model
         except Exception as e:
             raise MushroomException(e, sys)
 
+    def initiate_model_compilation(self, preprocessor_obj_file_path, train_data_path, test_data_path, train_df=None, test_df=None):
+        """
+        Compiles the trained model into a lookup table and returns its path.
+        """
+        try:
+            return self.model_compiler.initiate_model_compilation(
+                preprocessor_obj_file_path,
+                self.model_trainer.model_trainer_config.trained_model_file_path,
+                train_data_path,
+                test_data_path,
+                train_df,
+                test_df
+            )
+        except Exception as e:
+            raise MushroomException(e, sys)
+
+    def _train_and_compile(self, transformed, train_data_path, test_data_path, train_df, test_df, artifact_writer):
+        """
+        Runs the model training and compilation steps on the output of data transformation.
+        """
+        (
+            input_feature_train_arr,
+            target_train_arr,
+            input_feature_test_arr,
+            target_test_arr,
+            preprocessor_paths
+        ) = transformed
+
+        # Step 4: Model Training
+        accuracy, trained_model = self.initiate_model_trainer(
+            input_feature_train_arr, 
+            target_train_arr, 
+            input_feature_test_arr, 
+            target_test_arr,
+            artifact_writer,
+            preprocessor_paths
+        )
+        # Saved next to the model, from the preprocessing profile the model was trained with
+        preprocessor_obj_file_path = self.model_trainer.model_trainer_config.preprocessor_file_path
+
+        # The lookup table is compiled from the saved preprocessor and model
+        artifact_writer.flush()
+
+        # Step 5: Lookup Table Compilation
+        lookup_table_file_path = None
+        if artifact_writer.mode != "skip":
+            lookup_table_file_path = self.initiate_model_compilation(
+                preprocessor_obj_file_path,
+                train_data_path,
+                test_data_path,
+                train_df,
+                test_df
+            )
+
+        logging.info("Data ingestion, transformation, and model training completed successfully.")
+        return {
+            "train_features": input_feature_train_arr,
+            "train_target": target_train_arr,
+            "test_features": input_feature_test_arr,
+            "test_target": target_test_arr,
+            "preprocessor_file": preprocessor_obj_file_path,
+            "trained_model": trained_model,
+            "lookup_table_file": lookup_table_file_path,
+            "accuracy": accuracy
+        }
+
     def run_pipeline(self):
         """
         Executes the full training pipeline from data ingestion to model training.
         """
+        reset_timings()
+        in_memory = self.pipeline_config.handoff == "memory"
+        streaming = self.pipeline_config.handoff == "stream"
+        artifact_writer = ArtifactWriter(self.pipeline_config.persist if in_memory else "sync")
+        
         try:
+            mode = self.pipeline_config.feature_selection
+            if mode not in FEATURE_SELECTION_MODES:
+                raise ValueError(f"Unknown feature selection mode {mode}, expected one of {FEATURE_SELECTION_MODES}")
+            feature_columns = list(FEATURE_COLUMNS)
+            if mode != "off":
+                feature_columns = None
+                if mode == "reuse":
+                    feature_columns = load_selected_columns(self.feature_selection.feature_selection_config.feature_selection_file_path)
+            # Without columns ingestion reads them all, for the selection
+            self.set_feature_columns(feature_columns)
+            
             # Step 1: Data Ingestion
-            train_data_path, test_data_path = self.initiate_data_ingestion()
+            if in_memory:
+                train_df, test_df, train_data_path, test_data_path = self.data_ingestion.ingest_data(artifact_writer, self.stage_cache)
+            elif streaming:
+                train_df, test_df = None, None
+                train_shards, test_shards = self.data_ingestion.stream_data()
+                # The compiler checks the lookup table against a sample, the first shards
+                train_data_path, test_data_path = train_shards[0], test_shards[0]
+            else:
+                train_df, test_df = None, None
+                train_data_path, test_data_path = self.initiate_data_ingestion()
             
-            # Step 2: Data Transformation
-            (
-                input_feature_train_arr,
-                target_train_arr,
-                input_feature_test_arr,
-                target_test_arr,
-                preprocessor_obj_file_path
-            ) = self.initiate_data_transformation(train_data_path, test_data_path)
-
-            # Step 3: Model Training
-            accuracy, trained_model = self.initiate_model_trainer(
-                input_feature_train_arr, 
-                target_train_arr, 
-                input_feature_test_arr, 
-                target_test_arr
-            )
+            # Step 2: Feature Selection
+            if feature_columns is None:
+                if in_memory:
+                    self.initiate_feature_selection(train_df, test_df)
+                else:
+                    # From the feature store, streamed data is ranked on its first shards like the compiler checks them
+                    self.initiate_feature_selection(read_feature_store(train_data_path), read_feature_store(test_data_path))
+            
+            # Step 3: Data Transformation
+            if in_memory:
+                transformed = self.data_transformation.transform_data(train_df, test_df, artifact_writer, self.stage_cache)
+            elif streaming:
+                train_shards, test_shards, preprocessor_paths = self.data_transformation.transform_shards(train_shards, test_shards)
+                train_features, train_target = load_transformed_shards(train_shards)
+                test_features, test_target = load_transformed_shards(test_shards)
+                log_memory_report(
+                    "Loaded transformed shards",
+                    train_features=train_features,
+                    test_features=test_features
+                )
+                # Streaming only produces the one-hot profile
+                transformed = ({"onehot": train_features}, train_target, {"onehot": test_features}, test_target, preprocessor_paths)
+            else:
+                transformed = self.initiate_data_transformation(train_data_path, test_data_path)
 
-            logging.info("Data ingestion, transformation, and model training completed successfully.")
+            return self._train_and_compile(transformed, train_data_path, test_data_path, train_df, test_df, artifact_writer)
+        
+        except Exception as e:
+            raise MushroomException(e, sys)
+        
+        finally:
+            artifact_writer.close()
+
+    def run_incremental(self, new_data_path):
+        """
+        Updates the trained model with newly labelled rows instead of running the whole pipeline:
+        the rows are appended to the feature store, levels they bring in are added to the
+        preprocessor of the model and the model continues training from its fitted state (see
+        continue_fit), without a hyperparameter search. The data is retrained from scratch,
+        from the feature store, when there is no trained model yet, when the new rows drift
+        further than drift_threshold from the training data or when they bring new levels the
+        model cannot take (see can_absorb_new_levels).
+        """
+        reset_timings()
+        artifact_writer = ArtifactWriter("sync")
+        
+        try:
+            trainer_config = self.model_trainer.model_trainer_config
+            has_model = os.path.exists(trainer_config.trained_model_file_path) and os.path.exists(trainer_config.preprocessor_file_path)
+            
+            # The new rows need the input columns of the current model, the EDA ones without a model
+            feature_columns = list(FEATURE_COLUMNS)
+            if has_model:
+                preprocessor = load_object(trainer_config.preprocessor_file_path)
+                model = load_object(trainer_config.trained_model_file_path)
+                feature_columns = get_feature_columns(preprocessor)
+            self.set_feature_columns(feature_columns)
+            
+            # Step 1: Append the new rows to the feature store
+            new_train_df, new_test_df, train_data_path, test_data_path = self.data_ingestion.append_data(new_data_path)
+            
+            columns = feature_columns + [TARGET_COLUMN]
+            train_df = read_feature_store(train_data_path, columns=columns)
+            test_df = read_feature_store(test_data_path, columns=columns)
+            new_df = pd.concat([new_train_df, new_test_df])[columns]
+            
+            # Step 2: Decide between continuing the current model and retraining
+            fallback_reason = None
+            if not has_model:
+                fallback_reason = "there is no trained model"
+            else:
+                profile = get_preprocessing_profile(preprocessor)
+                new_levels = get_new_levels(preprocessor, new_df)
+                
+                # The new train rows were appended last
+                drift = get_category_drift(train_df.iloc[:len(train_df) - len(new_train_df)], new_df, feature_columns)
+                drift_column = max(drift, key=drift.get)
+                logging.info(f"Largest drift of the new rows: {drift[drift_column]:.3f} in {drift_column}")
+                
+                if drift[drift_column] > self.pipeline_config.drift_threshold:
+                    fallback_reason = f"the drift of {drift_column} exceeds {self.pipeline_config.drift_threshold}"
+                elif new_levels and not can_absorb_new_levels(model, profile):
+                    fallback_reason = f"{type(model).__name__} on the {profile} profile cannot take the new levels {new_levels}"
+            
+            if fallback_reason is not None:
+                logging.warning(f"Retraining from scratch, {fallback_reason}")
+                transformed = self.initiate_data_transformation(train_data_path, test_data_path)
+                return {**self._train_and_compile(transformed, train_data_path, test_data_path, None, None, artifact_writer), "training_mode": "full"}
+            
+            # Step 3: Extend the preprocessor and continue training the model
+            if new_levels:
+                logging.info(f"Adding the new levels {new_levels} to the preprocessor")
+                extend_preprocessor_levels(preprocessor, new_levels)
+            
+            train_features = preprocessor.transform(train_df[feature_columns])
+            test_features = preprocessor.transform(test_df[feature_columns])
+            train_target = encode_target(train_df[TARGET_COLUMN])
+            test_target = encode_target(test_df[TARGET_COLUMN])
+            
+            accuracy, trained_model = self.model_trainer.continue_training(
+                model, preprocessor, profile,
+                train_features, train_target, test_features, test_target,
+                len(new_train_df), artifact_writer
+            )
+            artifact_writer.flush()
+            
+            # Step 4: Lookup Table Compilation
+            lookup_table_file_path = self.initiate_model_compilation(trainer_config.preprocessor_file_path, train_data_path, test_data_path)
+            
+            logging.info("Incremental training completed successfully.")
             return {
-                "train_features": input_feature_train_arr,
-                "train_target": target_train_arr,
-                "test_features": input_feature_test_arr,
-                "test_target": target_test_arr,
-                "preprocessor_file": preprocessor_obj_file_path,
+                "train_features": train_features,
+                "train_target": train_target,
+                "test_features": test_features,
+                "test_target": test_target,
+                "preprocessor_file": trainer_config.preprocessor_file_path,
                 "trained_model": trained_model,
-                "accuracy": accuracy
+                "lookup_table_file": lookup_table_file_path,
+                "accuracy": accuracy,
+                "training_mode": "incremental"
             }
         
         except Exception as e:
             raise MushroomException(e, sys)
+        
+        finally:
+            artifact_writer.close()
@@ -0,0 +1,50 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from mushroom.exception import MushroomException
+
+ARTIFACT_WRITER_MODES = ("sync", "async", "skip")
+
+
+class ArtifactWriter:
+    def __init__(self, mode="sync"):
+        """
+        Decides when pipeline stages persist their artifacts.
+
+        "sync" writes immediately in the calling thread, "async" queues the writes to a single
+        background thread (so they happen in submission order while the next stage runs) and
+        "skip" drops them, for ephemeral runs that only need the in-memory results.
+        """
+        if mode not in ARTIFACT_WRITER_MODES:
+            raise MushroomException(f"Unknown artifact writer mode {mode}, expected one of {ARTIFACT_WRITER_MODES}", sys)
+
+        self.mode = mode
+        self._futures = []
+        self._executor = None
+        if mode == "async":
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact-writer")
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Persists an artifact by calling func(*args, **kwargs) according to the mode.
+        The arguments must not be modified afterwards, an async write may still be reading them.
+        """
+        if self.mode == "sync":
+            func(*args, **kwargs)
+        elif self.mode == "async":
+            self._futures.append(self._executor.submit(func, *args, **kwargs))
+
+    def flush(self):
+        """
+        Waits for the queued writes and re-raises the first failure.
+        """
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils.validation import check_is_fitted
+
+CATEGORY_ENCODER_OUTPUTS = ("codes", "categorical")
+
+
+class CategoryCodeEncoder(TransformerMixin, BaseEstimator):
+    def __init__(self, output="codes"):
+        """
+        Encodes categorical columns as the position of their value among the sorted levels
+        seen in fit, one output column per input column. Missing values are a level of their
+        own (the last one), as for the one-hot encoder, and unknown levels raise a ValueError.
+
+        Args:
+            output (str): "codes" returns an array of the smallest unsigned integer dtype, for
+                tree models splitting on ordinal codes. "categorical" returns a DataFrame of
+                pandas categoricals with the fitted codes as fixed levels, for the native
+                categorical support of CatBoost (cat_features) and XGBoost (enable_categorical).
+        """
+        self.output = output
+
+    def fit(self, X, y=None):
+        if self.output not in CATEGORY_ENCODER_OUTPUTS:
+            raise ValueError(f"Unknown output {self.output}, expected one of {CATEGORY_ENCODER_OUTPUTS}")
+
+        X = pd.DataFrame(X)
+        self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        self.n_features_in_ = X.shape[1]
+        self.categories_ = []
+        for column in X.columns:
+            levels = sorted(X[column].dropna().unique())
+            if X[column].isna().any():
+                levels.append(np.nan)
+            self.categories_.append(np.asarray(levels, dtype=object))
+        return self
+
+    def transform(self, X):
+        check_is_fitted(self, "categories_")
+        X = pd.DataFrame(X, columns=self.feature_names_in_) if not isinstance(X, pd.DataFrame) else X
+
+        codes = {}
+        for column, levels in zip(self.feature_names_in_, self.categories_):
+            # get_indexer matches missing values against the NaN level
+            column_codes = pd.Index(levels).get_indexer(X[column])
+            if (column_codes < 0).any():
+                unknown = X[column][column_codes < 0].unique()
+                raise ValueError(f"Found unknown categories {list(unknown)} in column {column} during transform")
+            codes[column] = column_codes
+
+        if self.output == "categorical":
+            return pd.DataFrame(
+                {
+                    column: pd.Categorical.from_codes(column_codes, categories=range(len(levels)))
+                    for (column, column_codes), levels in zip(codes.items(), self.categories_)
+                },
+                index=X.index
+            )
+
+        dtype = np.min_scalar_type(max(len(levels) for levels in self.categories_))
+        return np.column_stack(list(codes.values())).astype(dtype)
+
+    def get_feature_names_out(self, input_features=None):
+        check_is_fitted(self, "categories_")
+        return self.feature_names_in_.copy()
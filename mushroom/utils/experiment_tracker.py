@@ -0,0 +1,187 @@
+import sys
+import time
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from mushroom.exception import MushroomException
+from mushroom.logger import logging
+from mushroom.utils.instrumentation import get_timings, get_mlflow_key, log_timings_to_mlflow
+
+EXPERIMENT_TRACKING_MODES = ("async", "sync", "off")
+
+
+@dataclass
+class ExperimentTrackerConfig:
+    # "async" logs from a background thread, "sync" in the calling thread, "off" logs nothing
+    mode: str = "async"
+    # None keeps MLflow's default, the local mlruns/ file store unless MLFLOW_TRACKING_URI is set
+    tracking_uri: str = None
+    # None logs to the default experiment
+    experiment_name: str = None
+    # Log a nested run with the parameters, CV score and timings of every search candidate
+    log_candidates: bool = True
+
+
+def _get_family_summaries(model_report, preprocessing_profiles):
+    """
+    Plain copies of what is logged of every model family of a model search, so the report
+    and its fitted models can be released or modified while the run is still queued.
+    """
+    summaries = []
+    for name, evaluation in model_report.items():
+        summaries.append({
+            "name": name,
+            "profile": preprocessing_profiles.get(name),
+            "metrics": {
+                "cv_score": evaluation.cv_score,
+                "test_score": evaluation.test_score,
+                "search_seconds": evaluation.fit_time,
+                "refit_seconds": evaluation.refit_time,
+                "predict_latency_us": evaluation.predict_latency * 1e6,
+                "n_fits": evaluation.n_fits
+            },
+            "best_params": dict(evaluation.best_params or {}),
+            "candidates": [dict(timing, params=dict(timing["params"])) for timing in evaluation.candidate_timings or []]
+        })
+    return summaries
+
+
+class ExperimentTracker:
+    def __init__(self, config: ExperimentTrackerConfig = None):
+        """
+        Logs training runs to MLflow off the critical path of training.
+
+        In "async" mode every run is queued to a single background thread, which imports
+        MLflow on first use and logs the queued runs in submission order, each in a few batched
+        requests, while training carries on. The objects handed over, such as the model, must
+        not be modified afterwards. Queued runs are flushed when the process exits. Tracking
+        failures are logged as warnings and never fail a training run.
+        """
+        self.tracker_config = config or ExperimentTrackerConfig()
+        if self.tracker_config.mode not in EXPERIMENT_TRACKING_MODES:
+            raise MushroomException(f"Unknown experiment tracking mode {self.tracker_config.mode}, expected one of {EXPERIMENT_TRACKING_MODES}", sys)
+
+        self._futures = []
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Runs the tracking call func(*args, **kwargs) according to the mode.
+        """
+        if self.tracker_config.mode == "sync":
+            self._run(func, *args, **kwargs)
+        elif self.tracker_config.mode == "async":
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="experiment-tracker")
+                    atexit.register(self.close)
+                self._futures.append(self._executor.submit(self._run, func, *args, **kwargs))
+
+    @staticmethod
+    def _run(func, *args, **kwargs):
+        try:
+            start_time = time.perf_counter()
+            func(*args, **kwargs)
+            logging.info(f"Experiment tracking call {func.__name__} took {time.perf_counter() - start_time:.3f}s")
+        except Exception as e:
+            logging.warning(f"Experiment tracking call {func.__name__} failed: {e}")
+
+    def flush(self):
+        """
+        Waits until the queued runs are logged.
+        """
+        with self._lock:
+            futures, self._futures = self._futures, []
+        if futures:
+            logging.info(f"Waiting for {len(futures)} queued experiment tracking calls")
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                executor, self._executor = self._executor, None
+            if executor is not None:
+                executor.shutdown()
+                atexit.unregister(self.close)
+
+    def log_training_run(self, model_name, accuracy, profile, model, model_report=None, preprocessing_profiles=None, **params):
+        """
+        Queues an MLflow run of a training run: the winning model's name, accuracy and
+        preprocessing profile and the extra params, the stage timings recorded so far and the
+        model as an artifact. With the model_report of a search, the scores and timings of every
+        model family are logged as metrics of the run and every candidate as a nested run.
+
+        Args:
+            model_name (str): The name of the logged model.
+            accuracy (float): Its accuracy on the test data.
+            profile (str): Its preprocessing profile.
+            model: The fitted model, logged with mlflow.sklearn.
+            model_report (dict): The ModelEvaluation per model family, see evaluate_model.
+            preprocessing_profiles (dict): The profile per model family.
+            **params: More parameters of the run.
+        """
+        if self.tracker_config.mode == "off":
+            return
+
+        # Taken now, later stages keep recording timings while the run waits in the queue
+        run_params = {"best_model": model_name, "accuracy_score": accuracy, "preprocessing_profile": profile, **params}
+        families = _get_family_summaries(model_report, preprocessing_profiles or {}) if model_report else []
+        self.submit(self._log_training_run, run_params, model, families, get_timings())
+
+    def _log_training_run(self, run_params, model, families, timings):
+        import mlflow
+        import mlflow.sklearn
+        from mlflow.entities import Metric, Param, RunTag
+
+        config = self.tracker_config
+        if config.tracking_uri is not None:
+            mlflow.set_tracking_uri(config.tracking_uri)
+        if config.experiment_name is not None:
+            mlflow.set_experiment(config.experiment_name)
+
+        client = mlflow.MlflowClient()
+        timestamp = int(time.time() * 1000)
+
+        with mlflow.start_run() as run:
+            run_id = run.info.run_id
+
+            metrics = [
+                Metric(get_mlflow_key(f"{family['name']}.{name}"), float(value), timestamp, 0)
+                for family in families for name, value in family["metrics"].items() if value is not None
+            ]
+            client.log_batch(run_id, metrics=metrics, params=[Param(name, str(value)) for name, value in run_params.items()])
+            # Ingestion, transformation and model search timings of this pipeline run
+            log_timings_to_mlflow(run_id, timings)
+
+            if config.log_candidates:
+                for family in families:
+                    for index, candidate in enumerate(family["candidates"]):
+                        child_run = client.create_run(
+                            run.info.experiment_id,
+                            run_name=f"{family['name']} {index}",
+                            tags={"mlflow.parentRunId": run_id}
+                        )
+                        client.log_batch(
+                            child_run.info.run_id,
+                            metrics=[
+                                Metric(name, float(candidate[key]), timestamp, 0)
+                                for name, key in (("cv_score", "score"), ("fit_seconds", "fit_time"), ("score_seconds", "score_time"), ("rows", "rows"))
+                                if candidate.get(key) is not None
+                            ],
+                            params=[Param(get_mlflow_key(name), str(value)) for name, value in candidate["params"].items()],
+                            tags=[
+                                RunTag("model_family", family["name"]),
+                                RunTag("preprocessing_profile", str(family["profile"])),
+                                RunTag("best_candidate", str(candidate["params"] == family["best_params"]))
+                            ]
+                        )
+                        client.set_terminated(child_run.info.run_id)
+
+            # Log the best model
+            mlflow.sklearn.log_model(model, "model")
@@ -0,0 +1,113 @@
+import os
+import sys
+import pandas as pd
+
+from mushroom.exception import MushroomException
+
+
+def _as_categorical(df):
+    # Columnar formats store the string columns dictionary encoded as pandas categories
+    object_columns = df.select_dtypes(include="object").columns
+    return df.astype({column: "category" for column in object_columns})
+
+def _write_csv(df, file_path):
+    df.to_csv(file_path, index=False, header=True)
+
+def _read_csv(file_path, columns, memory_map):
+    return pd.read_csv(file_path, usecols=columns, memory_map=memory_map)
+
+def _write_parquet(df, file_path):
+    _as_categorical(df).to_parquet(file_path, index=False)
+
+def _read_parquet(file_path, columns, memory_map):
+    return pd.read_parquet(file_path, columns=columns, memory_map=memory_map)
+
+def _write_feather(df, file_path):
+    # Uncompressed, so the file can be memory-mapped instead of decompressed into memory
+    _as_categorical(df).reset_index(drop=True).to_feather(file_path, compression="uncompressed")
+
+def _read_feather(file_path, columns, memory_map):
+    from pyarrow import feather
+    return feather.read_table(file_path, columns=columns, memory_map=memory_map).to_pandas()
+
+
+# Format name -> (file extension, writer, reader)
+FEATURE_STORE_FORMATS = {
+    "csv": (".csv", _write_csv, _read_csv),
+    "parquet": (".parquet", _write_parquet, _read_parquet),
+    "feather": (".feather", _write_feather, _read_feather)
+}
+
+
+def register_feature_store_format(name, extension, writer, reader):
+    """
+    Description: This function adds a file format to the feature store
+
+    name: The format name used in the configs
+    extension: The file extension identifying the format, including the dot
+    writer: A function(df, file_path) writing a DataFrame
+    reader: A function(file_path, columns, memory_map) returning a DataFrame
+
+    returns: None
+    """
+    FEATURE_STORE_FORMATS[name] = (extension, writer, reader)
+
+def get_feature_store_path(directory, name, file_format):
+    """
+    Description: This function builds the path of a feature store file
+
+    directory: The feature store directory
+    name: The file name without extension, e.g. "train"
+    file_format: One of the FEATURE_STORE_FORMATS names
+
+    returns: The file path
+    """
+    try:
+        extension = FEATURE_STORE_FORMATS[file_format][0]
+        return os.path.join(directory, f"{name}{extension}")
+
+    except KeyError:
+        raise MushroomException(f"Unknown feature store format {file_format}, expected one of {list(FEATURE_STORE_FORMATS)}", sys)
+
+def _get_format(file_path):
+    extension = os.path.splitext(file_path)[1]
+    for file_format, (format_extension, writer, reader) in FEATURE_STORE_FORMATS.items():
+        if extension == format_extension:
+            return writer, reader
+    raise MushroomException(f"No feature store format for files with extension {extension}", sys)
+
+def write_feature_store(df, file_path):
+    """
+    Description: This function saves a DataFrame to the feature store, in the format
+    given by the file extension
+
+    df: The DataFrame to save
+    file_path: The destination path, see get_feature_store_path
+
+    returns: None
+    """
+    try:
+        writer, _ = _get_format(file_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        writer(df, file_path)
+
+    except Exception as e:
+        raise MushroomException(e, sys)
+
+def read_feature_store(file_path, columns=None, memory_map=True):
+    """
+    Description: This function loads a DataFrame from the feature store, in the format
+    given by the file extension
+
+    file_path: The path of the saved DataFrame
+    columns: The columns to load, all of them when None. Columnar formats only read these
+    memory_map: Map the file into memory instead of reading it into a buffer first
+
+    returns: The loaded DataFrame
+    """
+    try:
+        _, reader = _get_format(file_path)
+        return reader(file_path, columns, memory_map)
+
+    except Exception as e:
+        raise MushroomException(e, sys)
@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import logging as std_logging
+import resource
+import functools
+import threading
+from dataclasses import dataclass, field, asdict
+
+from mushroom.exception import MushroomException
+from mushroom.logger import logging, log_dir
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+# Timing records are also written one JSON object per line, for tooling to pick up
+timing_logger = std_logging.getLogger("mushroom.instrumentation")
+_timing_logger_lock = threading.Lock()
+
+
+def _get_timing_logger():
+    # The file handler is installed with the first record, importing the module creates no file
+    with _timing_logger_lock:
+        if not timing_logger.handlers:
+            os.makedirs(log_dir, exist_ok=True)
+            timing_handler = std_logging.FileHandler(os.path.join(log_dir, "timings.jsonl"))
+            timing_handler.setFormatter(std_logging.Formatter("%(message)s"))
+            timing_logger.addHandler(timing_handler)
+            timing_logger.setLevel(std_logging.INFO)
+            timing_logger.propagate = False
+    return timing_logger
+
+
+@dataclass
+class InstrumentationConfig:
+    # Stage to run under a profiler, None profiles nothing
+    profile_stage: str = None
+    # "cprofile" writes a .prof file for pstats/snakeviz, "pyinstrument" an HTML report
+    profiler: str = "cprofile"
+    profile_dir: str = os.path.join(log_dir, 'profiles')
+
+
+@dataclass
+class StageTiming:
+    stage: str
+    wall_seconds: float
+    cpu_seconds: float = None
+    # High-water mark of the process RSS when the stage ended, and how much the stage raised it
+    peak_rss_mb: float = None
+    rss_growth_mb: float = None
+    rows: int = None
+    details: dict = field(default_factory=dict)
+
+    @property
+    def rows_per_second(self):
+        if self.rows is None or self.wall_seconds <= 0:
+            return None
+        return self.rows / self.wall_seconds
+
+
+_config = InstrumentationConfig()
+_timings = []
+
+
+def configure_instrumentation(config: InstrumentationConfig):
+    global _config
+    if config.profiler not in PROFILERS:
+        raise MushroomException(f"Unknown profiler {config.profiler}, expected one of {PROFILERS}", sys)
+    _config = config
+
+
+def reset_timings():
+    _timings.clear()
+
+
+def get_timings():
+    return list(_timings)
+
+
+def record_timing(timing: StageTiming, log_level=std_logging.INFO):
+    """
+    Keeps the timing for log_timings_to_mlflow and emits it as a log line, at log_level,
+    and a JSON record.
+    """
+    _timings.append(timing)
+
+    summary = f"{timing.stage}: {timing.wall_seconds:.3f}s wall"
+    if timing.cpu_seconds is not None:
+        summary += f", {timing.cpu_seconds:.3f}s CPU"
+    if timing.peak_rss_mb is not None:
+        summary += f", peak RSS {timing.peak_rss_mb:.1f} MB (+{timing.rss_growth_mb:.1f} MB)"
+    if timing.rows is not None:
+        summary += f", {timing.rows} rows ({timing.rows_per_second:.0f} rows/s)"
+    logging.log(log_level, f"Stage timing {summary}")
+
+    record = asdict(timing)
+    record.update(rows_per_second=timing.rows_per_second, timestamp=time.time())
+    _get_timing_logger().info(json.dumps(record, default=str))
+
+
+def _peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageTimer:
+    def __init__(self, stage, rows=None):
+        """
+        Measures wall time, CPU time and peak memory of a pipeline stage and records them with
+        record_timing(). Works as a context manager, where rows can be set on the timer before
+        the block ends, and as a decorator, where rows may be a function of the return value.
+        The stage named by InstrumentationConfig.profile_stage also runs under the profiler.
+
+        CPU time and memory are those of the current process; work done in process pool
+        workers only shows up in the wall time.
+
+        Args:
+            stage (str): Name of the stage, used for the records and the profile file.
+            rows: Number of rows the stage processed, or for the decorator a function mapping
+                the return value to it.
+        """
+        self.stage = stage
+        self.rows = rows
+        self._profiler = None
+
+    def __enter__(self):
+        if _config.profile_stage == self.stage:
+            self._start_profiler()
+        self._start_peak_rss = _peak_rss_mb()
+        self._start_cpu = time.process_time()
+        self._start_wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_seconds = time.perf_counter() - self._start_wall
+        cpu_seconds = time.process_time() - self._start_cpu
+        peak_rss_mb = _peak_rss_mb()
+        if self._profiler is not None:
+            self._stop_profiler()
+
+        # Failed stages are not recorded, their partial timings would skew comparisons
+        if exc_type is None:
+            record_timing(StageTiming(
+                stage=self.stage,
+                wall_seconds=wall_seconds,
+                cpu_seconds=cpu_seconds,
+                peak_rss_mb=peak_rss_mb,
+                rss_growth_mb=peak_rss_mb - self._start_peak_rss,
+                rows=self.rows if not callable(self.rows) else None
+            ))
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with StageTimer(self.stage) as timer:
+                result = func(*args, **kwargs)
+                timer.rows = self.rows(result) if callable(self.rows) else self.rows
+            return result
+        return wrapper
+
+    def _start_profiler(self):
+        if _config.profiler == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError as e:
+                raise MushroomException(f"The pyinstrument profiler is not installed: {e}", sys)
+            self._profiler = Profiler()
+            self._profiler.start()
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def _stop_profiler(self):
+        os.makedirs(_config.profile_dir, exist_ok=True)
+        file_name = f"{self.stage}-{time.strftime('%Y%m%d-%H%M%S')}"
+
+        if _config.profiler == "pyinstrument":
+            self._profiler.stop()
+            profile_path = os.path.join(_config.profile_dir, f"{file_name}.html")
+            with open(profile_path, "w") as file_obj:
+                file_obj.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            profile_path = os.path.join(_config.profile_dir, f"{file_name}.prof")
+            self._profiler.dump_stats(profile_path)
+
+        self._profiler = None
+        logging.info(f"Saved the {_config.profiler} profile of stage {self.stage} to {profile_path}")
+
+
+def get_mlflow_key(name):
+    # MLflow metric and param names only allow alphanumerics, underscores, dashes, periods, spaces and slashes
+    return "".join(character if character.isalnum() or character in "_-./ " else "_" for character in name)
+
+
+def log_timings_to_mlflow(run_id=None, timings=None):
+    """
+    Logs timings as metrics of an MLflow run, by default the timings recorded since
+    reset_timings() to the active run. Stages with several records, such as the candidates
+    of a model search, become metric series with one step per record.
+    """
+    import mlflow
+    from mlflow.entities import Metric
+
+    steps = {}
+    metrics = []
+    timestamp = int(time.time() * 1000)
+    for timing in _timings if timings is None else timings:
+        step = steps.get(timing.stage, 0)
+        steps[timing.stage] = step + 1
+
+        values = {
+            "wall_seconds": timing.wall_seconds,
+            "cpu_seconds": timing.cpu_seconds,
+            "peak_rss_mb": timing.peak_rss_mb,
+            "rows": timing.rows,
+            "rows_per_second": timing.rows_per_second
+        }
+        stage = get_mlflow_key(timing.stage)
+        metrics.extend(
+            Metric(f"{stage}.{name}", float(value), timestamp, step)
+            for name, value in values.items() if value is not None
+        )
+
+    # One request for every metric, a file or HTTP round trip per metric adds up with many candidates
+    mlflow.MlflowClient().log_batch(run_id or mlflow.active_run().info.run_id, metrics=metrics)
@@ -1,17 +1,24 @@
 import os
 import sys
+import time
 import numpy as np
 import pandas as pd
 import dill
 import pickle
+import shutil
+import hashlib
+from dataclasses import dataclass
+from scipy import sparse
 
 from mushroom.exception import MushroomException
-from sklearn.model_selection import GridSearchCV
-from sklearn.metrics import accuracy_score
+from mushroom.logger import logging
+from mushroom.utils.instrumentation import StageTimer, StageTiming, record_timing
 
 def save_object(file_path, obj):
     """
     This function saves a given python object to a file using pickle.
+    The object is written to a temporary file first and then moved into place, so a
+    process reading file_path never sees a partially written object.
 
     Parameters
     ----------
@@ -29,57 +36,267 @@ def save_object(file_path, obj):
         dir_path = os.path.dirname(file_path)
         os.makedirs(dir_path, exist_ok=True)
         
-        with open(file_path, "wb") as file_obj:
+        tmp_file_path = f"{file_path}.tmp"
+        with open(tmp_file_path, "wb") as file_obj:
             pickle.dump(obj,file_obj)
+        os.replace(tmp_file_path, file_path)
             
     except Exception as e:
         raise MushroomException(e,sys)
     
-def evaluate_model(TrainFeatures, TrainTarget, TestFeatures, TestTarget, models, params):
+def get_cpu_budget(n_jobs):
+    """
+    Description: This function resolves an n_jobs setting to a number of CPUs, following the
+    joblib convention (-1 is every core, -2 every core but one, ...)
+    
+    n_jobs: The requested number of jobs, None means 1
+    
+    returns: The number of CPUs to use, at least 1
+    """
+    cpu_count = os.cpu_count() or 1
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(1, cpu_count + 1 + n_jobs)
+    return max(1, min(n_jobs, cpu_count))
+
+def limit_estimator_threads(model, n_threads=1):
+    """
+    Description: This function caps the threads an estimator starts on its own, so that
+    running several fits side by side does not oversubscribe the CPUs
+    
+    model: The estimator, modified in place
+    n_threads: The number of threads each fit may use
+    
+    returns: The estimator
+    """
+    params = model.get_params()
+    # scikit-learn reads n_jobs=None as a single job, xgboost as every core
+    sklearn_default = params.get("n_jobs") is None and type(model).__module__.startswith("sklearn")
+    if "n_jobs" in params and not sklearn_default:
+        model.set_params(n_jobs=n_threads)
+    # CatBoost only lists explicitly set parameters in get_params
+    if type(model).__module__.startswith("catboost"):
+        model.set_params(thread_count=n_threads)
+    return model
+
+@dataclass
+class ModelEvaluation:
+    model: object
+    best_params: dict
+    cv_score: float
+    test_score: float
+    # Wall time of the whole search including the final refit, in seconds
+    fit_time: float
+    # Mean prediction time per test row, in seconds
+    predict_latency: float
+    n_fits: int
+    test_predictions: np.ndarray
+    # Per candidate timings of the search and the wall time of the final refit, see SearchResult
+    candidate_timings: list = None
+    refit_time: float = 0.0
+
+def get_matrix_nbytes(matrix):
+    """
+    Description: This function computes the memory held by a feature or target matrix
+
+    matrix: A scipy sparse matrix, a DataFrame or anything convertible to a numpy array
+
+    returns: The number of bytes of the values, plus the index arrays of a sparse matrix
+    """
+    if isinstance(matrix, pd.DataFrame):
+        return int(matrix.memory_usage(index=False, deep=True).sum())
+    if sparse.issparse(matrix):
+        return sum(
+            getattr(matrix, name).nbytes
+            for name in ("data", "indices", "indptr", "row", "col", "offsets")
+            if isinstance(getattr(matrix, name, None), np.ndarray)
+        )
+    return np.asarray(matrix).nbytes
+
+def log_memory_report(stage, **matrices):
+    """
+    Description: This function logs the format, dtype, shape and size of the matrices a stage produces
+
+    stage: The stage name shown in the report
+    matrices: The matrices, keyed by the name shown in the report
+
+    returns: None
+    """
+    lines = []
+    for name, matrix in matrices.items():
+        if isinstance(matrix, pd.DataFrame):
+            matrix_format, dtype = "frame", "/".join(sorted({str(dtype) for dtype in matrix.dtypes}))
+        else:
+            matrix_format, dtype = matrix.format if sparse.issparse(matrix) else "dense", str(matrix.dtype)
+        lines.append(
+            f"{name:<16} {matrix_format:<6} {dtype:<8} {str(matrix.shape):<14} "
+            f"{get_matrix_nbytes(matrix) / 1024:>10.1f} KiB"
+        )
+    logging.info(f"{stage} memory report:\n" + "\n".join(lines))
+
+def _search_model(model_name, model, para, TrainFeatures, TrainTarget, TestFeatures, TestTarget, cv, cv_n_jobs, search_config, cv_folds=None):
+    """
+    Runs the hyperparameter search of one model family on the cached CV folds of its
+    representation and scores its refit best estimator on the test set. Executed in a
+    worker process by evaluate_model.
+    """
+    from threadpoolctl import threadpool_limits
+    from sklearn.metrics import accuracy_score
+    from mushroom.utils.model_search import run_search
+    
+    limit_estimator_threads(model)
+    
+    # BLAS / OpenMP pools inside the worker get one thread per concurrent fit
+    with threadpool_limits(limits=1):
+        search = run_search(model, para, TrainFeatures, TrainTarget, search_config, cv=cv, n_jobs=cv_n_jobs, cv_folds=cv_folds)
+        
+        predict_start = time.perf_counter()
+        y_test_pred = search.best_estimator.predict(TestFeatures)
+        predict_time = time.perf_counter() - predict_start
+    
+    return model_name, ModelEvaluation(
+        model=search.best_estimator,
+        best_params=search.best_params,
+        cv_score=search.best_score,
+        test_score=accuracy_score(TestTarget, y_test_pred),
+        fit_time=search.search_time,
+        predict_latency=predict_time / max(len(TestTarget), 1),
+        n_fits=search.n_fits,
+        test_predictions=y_test_pred,
+        candidate_timings=search.candidate_timings,
+        refit_time=search.refit_time
+    )
+    
+@StageTimer("model_search")
+def evaluate_model(TrainFeatures, TrainTarget, TestFeatures, TestTarget, models, params, n_jobs=1, max_parallel_models=None, cv=3, search_configs=None, stage_cache=None):
     """
     Evaluate the performance of different machine learning models and
     return a report of evaluation metrics.
+    
+    The model families are searched concurrently in a process pool and the CV folds
+    of each family are spread over the CPUs left in the n_jobs budget. Every candidate
+    is fit by its search and predicted on the test set exactly once.
 
     Parameters
     ----------
-    TrainFeatures : array-like of shape (n_samples, n_features)
-        Features of the training set
+    TrainFeatures : array-like of shape (n_samples, n_features) or dictionary
+        Features of the training set, or a dictionary of them keyed by model name when
+        the models are trained on different representations. Sparse features are passed
+        on as they are, every model of the trainer accepts them
     TrainTarget : array-like of shape (n_samples,)
         Target values of the training set
-    TestFeatures : array-like of shape (n_samples, n_features)
-        Features of the test set
+    TestFeatures : array-like of shape (n_samples, n_features) or dictionary
+        Features of the test set, keyed like TrainFeatures
     TestTarget : array-like of shape (n_samples,)
         Target values of the test set
     models : dictionary of models
         Dictionary of machine learning models
     params : dictionary of parameters
-        Dictionary of parameters to be used in GridSearchCV
+        Dictionary of parameter grids to search for each model
+    n_jobs : int
+        Total number of CPUs the search may use, -1 for all of them
+    max_parallel_models : int
+        Maximum number of model families searched at the same time,
+        defaults to as many as the CPU budget allows
+    cv : int or cross-validation generator
+        Cross-validation splitting strategy used by the searches
+    search_configs : dictionary of SearchConfig
+        Search strategy for each model, models without an entry get an exhaustive search
+    stage_cache : StageCache
+        Reuses the evaluation of every model whose data, estimator, grid, search
+        strategy and search code are unchanged, only the other models are searched
 
     Returns
     -------
     report : dictionary
-        A dictionary containing the evaluation metrics for each model
+        A ModelEvaluation for each model, in the order of models, holding the fitted
+        best estimator, its parameters, CV and test scores, timings and test predictions
     """
+    # The search libraries are only imported by training, not by serving code using this module
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import ParameterGrid
+    from mushroom.utils import model_search
+    
     try:
-        report = {}
+        search_configs = search_configs or {}
+        inputs = {
+            name: tuple(features[name] if isinstance(features, dict) else features for features in (TrainFeatures, TestFeatures))
+            for name in models
+        }
         
-        for i in range(len(list(models))):
-            model = list(models.values())[i]
-            para = params[list(models.keys())[i]]
-            
-            gs = GridSearchCV(model, para, cv=3)
-            gs.fit(TrainFeatures, TrainTarget)
+        results = {}
+        fingerprints = {}
+        if stage_cache is not None:
+            # One entry per model family search, a changed grid recomputes all its candidates.
+            # Models sharing a representation share its fingerprint
+            data_fingerprints = {}
+            for name in models:
+                key = tuple(id(features) for features in inputs[name])
+                if key not in data_fingerprints:
+                    data_fingerprints[key] = stage_cache.fingerprint("model_search_data", inputs[name][0], TrainTarget, inputs[name][1], TestTarget)
+                fingerprints[name] = stage_cache.fingerprint(
+                    "model_search", data_fingerprints[key], name, models[name], params[name],
+                    search_configs.get(name), cv, sys.modules[__name__], model_search
+                )
+                evaluation = stage_cache.load("model_search", fingerprints[name])
+                if evaluation is not None:
+                    results[name] = evaluation
+        
+        # Start the largest grids first so they do not end up running alone at the end
+        grid_sizes = {name: len(ParameterGrid(params[name])) for name in models if name not in results}
+        model_names = sorted(grid_sizes, key=lambda name: grid_sizes[name], reverse=True)
+        
+        if model_names:
+            cpu_budget = get_cpu_budget(n_jobs)
+            parallel_models = min(len(model_names), max_parallel_models or cpu_budget, cpu_budget)
+            cv_n_jobs = max(1, cpu_budget // parallel_models)
+            logging.info(f"Searching {len(model_names)} models, {parallel_models} at a time with {cv_n_jobs} CV jobs each")
             
-            model.set_params(**gs.best_params_)            
-            model.fit(TrainFeatures, TrainTarget)
+            # The CV splits are computed once and every representation is cut into its folds
+            # once, all the candidates of all the families searched on it reuse them
+            fold_cache = model_search.FoldCache(cv, TrainTarget)
+            cv_folds = {name: fold_cache.get_folds(inputs[name][0]) for name in model_names}
             
-            y_train_pred = model.predict(TrainFeatures)
-            y_test_pred = model.predict(TestFeatures)
+            searched = dict(Parallel(n_jobs=parallel_models)(
+                delayed(_search_model)(
+                    name, models[name], params[name],
+                    inputs[name][0], TrainTarget, inputs[name][1], TestTarget,
+                    cv, cv_n_jobs, search_configs.get(name), cv_folds[name]
+                )
+                for name in model_names
+            ))
             
-            train_model_score = accuracy_score(TrainTarget, y_train_pred)
-            test_model_score = accuracy_score(TestTarget, y_test_pred)
+            # The searches ran in worker processes, their timings are recorded here
+            for name, evaluation in searched.items():
+                for timing in evaluation.candidate_timings:
+                    record_timing(StageTiming(
+                        stage=f"model_search.{name}.candidate",
+                        wall_seconds=timing["fit_time"] + timing["score_time"],
+                        rows=timing["rows"],
+                        details=timing
+                    ), log_level=logging.DEBUG)
+                record_timing(StageTiming(
+                    stage=f"model_search.{name}.final_fit",
+                    wall_seconds=evaluation.refit_time,
+                    rows=len(TrainTarget),
+                    details={"params": evaluation.best_params}
+                ))
             
-            report[list(models.keys())[i]] = test_model_score
+            if stage_cache is not None:
+                for name, evaluation in searched.items():
+                    stage_cache.store("model_search", fingerprints[name], evaluation)
+            results.update(searched)
+        
+        report = {name: results[name] for name in models}
+        
+        timing_lines = [
+            f"{name:<30} {evaluation.n_fits:>5} fits {evaluation.fit_time:>9.2f}s  "
+            f"predict {evaluation.predict_latency * 1e6:>8.2f}us/row  "
+            f"CV {evaluation.cv_score:.4f}  test {evaluation.test_score:.4f}"
+            for name, evaluation in report.items()
+        ]
+        logging.info("Model search wall-clock report:\n" + "\n".join(timing_lines))
             
         return report
     
@@ -100,4 +317,42 @@ def load_object(file_path):
         
     except Exception as e:
         raise MushroomException(e,sys)
-    
\ No newline at end of file
+
+def copy_object(source_path, file_path):
+    """
+    Description: This function copies a saved object file, replacing the destination
+    atomically as save_object does
+
+    source_path: The path of the saved object
+    file_path: The path the copy is saved to
+
+    returns: None
+    """
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        tmp_file_path = f"{file_path}.tmp"
+        shutil.copyfile(source_path, tmp_file_path)
+        os.replace(tmp_file_path, file_path)
+
+    except Exception as e:
+        raise MushroomException(e,sys)
+
+def get_file_checksum(*file_paths):
+    """
+    Description: This function computes a short md5 checksum over the contents of one or more files
+    
+    file_paths: Paths of the files, hashed in the given order
+    
+    returns: The first 12 hex digits of the md5 digest
+    """
+    try:
+        digest = hashlib.md5()
+        for file_path in file_paths:
+            with open(file_path, "rb") as file_obj:
+                for block in iter(lambda: file_obj.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()[:12]
+    
+    except Exception as e:
+        raise MushroomException(e,sys)
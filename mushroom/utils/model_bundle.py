@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import platform
+
+from mushroom.constants import FEATURE_COLUMNS
+from mushroom.exception import MushroomException
+from mushroom.logger import logging
+
+BUNDLE_FORMAT_VERSION = 2
+MANIFEST_FILE_NAME = "manifest.json"
+# Pointer to the current version directory, replaced last when a bundle is saved
+CURRENT_FILE_NAME = "CURRENT"
+VERSIONS_DIR_NAME = "versions"
+# Version directories kept, the previous one may still be loading in another process
+KEPT_BUNDLE_VERSIONS = 2
+# Libraries whose pickled objects may be in a bundle; a different version may unpickle differently
+BUNDLE_LIBRARIES = ("numpy", "pandas", "sklearn", "joblib", "xgboost", "catboost")
+
+
+def get_current_path(bundle_dir):
+    return os.path.join(bundle_dir, CURRENT_FILE_NAME)
+
+
+def _write_atomic(file_path, text):
+    with open(f"{file_path}.tmp", "w") as file_obj:
+        file_obj.write(text)
+    os.replace(f"{file_path}.tmp", file_path)
+
+
+def _remove_old_versions(bundle_dir):
+    versions_dir = os.path.join(bundle_dir, VERSIONS_DIR_NAME)
+    # Directory names start with a fixed width timestamp, so they sort by age
+    for name in sorted(os.listdir(versions_dir))[:-KEPT_BUNDLE_VERSIONS]:
+        # Memory-mapped files of a removed version stay readable where the OS allows it
+        shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+
+def _sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file_obj:
+        for block in iter(lambda: file_obj.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _library_versions():
+    versions = {"python": platform.python_version()}
+    for name in BUNDLE_LIBRARIES:
+        module = sys.modules.get(name)
+        if module is not None:
+            versions[name] = getattr(module, "__version__", None)
+    return versions
+
+
+def save_model_bundle(bundle_dir, version, preprocessor, model, lookup_table=None, feature_schema=None):
+    """
+    Description: This function saves the serving artifacts as a model bundle: one joblib file
+    per object, with numpy arrays stored raw so they can be memory-mapped on load, and a
+    manifest.json holding the version, file checksums, library versions and feature schema.
+    Every save goes to a new directory under versions/ and the CURRENT pointer to it is
+    replaced last, so a reader that resolved the previous pointer keeps loading the files of
+    the previous version. The two latest version directories are kept.
+
+    bundle_dir: The directory the bundle is saved to
+    version: The model version, the checksum of the preprocessor and model artifacts
+    preprocessor: The fitted preprocessor
+    model: The trained model
+    lookup_table: The compiled LookupTableModel, or None
+    feature_schema: Dict with the input "columns" and the category "levels" per column
+
+    returns: The manifest dict
+    """
+    import joblib
+
+    try:
+        version_dir_name = f"{time.time_ns():020d}-{version}"
+        version_dir = os.path.join(bundle_dir, VERSIONS_DIR_NAME, version_dir_name)
+        os.makedirs(version_dir)
+
+        objects = {"preprocessor": preprocessor, "model": model, "lookup_table": lookup_table}
+        files = {}
+        for name, obj in objects.items():
+            if obj is None:
+                continue
+
+            file_path = os.path.join(version_dir, f"{name}.joblib")
+            joblib.dump(obj, file_path)
+            files[name] = {
+                # Relative to bundle_dir
+                "path": os.path.relpath(file_path, bundle_dir),
+                "sha256": _sha256(file_path),
+                "size": os.path.getsize(file_path)
+            }
+
+        manifest = {
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "version": version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "model_class": f"{type(model).__module__}.{type(model).__name__}",
+            "files": files,
+            "libraries": _library_versions(),
+            "feature_schema": feature_schema or {"columns": list(FEATURE_COLUMNS)}
+        }
+        _write_atomic(os.path.join(version_dir, MANIFEST_FILE_NAME), json.dumps(manifest, indent=2))
+
+        # The switch to the new version
+        _write_atomic(get_current_path(bundle_dir), version_dir_name)
+        _remove_old_versions(bundle_dir)
+
+        return manifest
+
+    except Exception as e:
+        raise MushroomException(e, sys)
+
+
+def read_manifest(bundle_dir):
+    """
+    Description: This function reads the manifest of the current version of a model bundle
+
+    bundle_dir: The directory of the bundle
+
+    returns: The manifest dict, None when no bundle was saved to bundle_dir
+    """
+    try:
+        current_path = get_current_path(bundle_dir)
+        if not os.path.exists(current_path):
+            return None
+        with open(current_path) as file_obj:
+            version_dir_name = file_obj.read().strip()
+
+        manifest_path = os.path.join(bundle_dir, VERSIONS_DIR_NAME, version_dir_name, MANIFEST_FILE_NAME)
+        with open(manifest_path) as file_obj:
+            return json.load(file_obj)
+
+    except Exception as e:
+        raise MushroomException(e, sys)
+
+
+def validate_manifest(bundle_dir, manifest, verify_checksums=True):
+    """
+    Description: This function checks a bundle against its manifest: the format version, the
+    feature columns and, unless verify_checksums is False, the checksum of every file
+
+    bundle_dir: The directory of the bundle
+    manifest: The manifest dict
+    verify_checksums: Whether to hash the files
+
+    returns: None, raises a ValueError when the bundle does not match the manifest
+    """
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported model bundle format {manifest.get('format_version')}")
+
+    # Serving sends the columns of the manifest, whichever feature selection picked
+    if not manifest["feature_schema"].get("columns"):
+        raise ValueError("Model bundle has no feature columns")
+
+    if verify_checksums:
+        for name, file_info in manifest["files"].items():
+            if _sha256(os.path.join(bundle_dir, file_info["path"])) != file_info["sha256"]:
+                raise ValueError(f"Checksum mismatch of the {name} file of the model bundle")
+
+
+def _log_library_mismatches(manifest):
+    # Only the libraries imported so far are compared, call it once the objects are loaded
+    current_versions = _library_versions()
+    for name, saved_version in manifest["libraries"].items():
+        if name in current_versions and current_versions[name] != saved_version:
+            logging.warning(f"Model bundle was saved with {name} {saved_version}, running {current_versions[name]}")
+
+
+def load_model_bundle(bundle_dir, mmap_mode="c", verify_checksums=True, manifest=None):
+    """
+    Description: This function loads a model bundle saved by save_model_bundle. With an mmap_mode
+    the numpy arrays of the objects are memory-mapped instead of read into memory, so the
+    processes serving one bundle share its pages. "c" (copy-on-write) keeps the arrays writable,
+    the lookup table memoizes entries into them; the file itself is never modified.
+
+    bundle_dir: The directory of the bundle
+    mmap_mode: Passed to joblib.load, None reads the arrays into memory
+    verify_checksums: Whether to hash the files before loading them
+    manifest: The manifest of the version to load, as read by read_manifest; None reads the current one
+
+    returns: A (preprocessor, model, lookup_table, manifest) tuple, lookup_table is None when the
+    bundle has none
+    """
+    # Imported here, so that a process serving a portable runtime never imports joblib
+    import joblib
+
+    try:
+        if manifest is None:
+            manifest = read_manifest(bundle_dir)
+        if manifest is None:
+            raise FileNotFoundError(f"No model bundle saved to {bundle_dir}")
+        # Checked before unpickling, so a corrupt or foreign file is never loaded
+        validate_manifest(bundle_dir, manifest, verify_checksums)
+
+        objects = {}
+        for name in ("preprocessor", "model", "lookup_table"):
+            file_info = manifest["files"].get(name)
+            if file_info is not None:
+                objects[name] = joblib.load(os.path.join(bundle_dir, file_info["path"]), mmap_mode=mmap_mode)
+
+        _log_library_mismatches(manifest)
+
+        return objects["preprocessor"], objects["model"], objects.get("lookup_table"), manifest
+
+    except Exception as e:
+        raise MushroomException(e, sys)
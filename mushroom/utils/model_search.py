@@ -0,0 +1,297 @@
+import sys
+import time
+import numpy as np
+from dataclasses import dataclass
+
+from mushroom.exception import MushroomException
+from mushroom.logger import logging
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.utils import _safe_indexing
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401, enables the Halving*SearchCV imports
+from sklearn.model_selection import (
+    HalvingGridSearchCV, HalvingRandomSearchCV,
+    ParameterGrid, ParameterSampler, check_cv
+)
+
+SEARCH_STRATEGIES = ("exhaustive", "halving", "randomized")
+
+
+@dataclass
+class SearchConfig:
+    # One of SEARCH_STRATEGIES
+    strategy: str = "exhaustive"
+    # Number of sampled candidates for the randomized strategy (and halving over a large grid)
+    n_iter: int = 20
+    # Halving keeps 1/factor of the candidates per round and gives them factor times the resource
+    factor: int = 3
+    # Budget grown by halving: "n_samples" or an estimator parameter such as "n_estimators"
+    resource: str = "n_samples"
+    # Exhaustive and randomized searches stop once a candidate reaches this CV score
+    stop_score: float = 1.0
+    # Candidates cross-validated between two checks of stop_score
+    batch_size: int = 8
+    random_state: int = 42
+
+
+@dataclass
+class SearchResult:
+    best_estimator: object
+    best_params: dict
+    best_score: float
+    n_candidates: int
+    n_fits: int
+    search_time: float
+    stopped_early: bool = False
+    # Per candidate: parameters, CV score, fit and score time summed over the folds and the
+    # number of rows it was cross-validated on; the refit of the best candidate is timed separately
+    candidate_timings: list = None
+    refit_time: float = 0.0
+
+
+@dataclass
+class CVFolds:
+    # (train indices, test indices) of every split
+    splits: list
+    # (train features, train target, test features, test target) of every split
+    folds: list
+
+
+class FoldCache:
+    def __init__(self, cv, TrainTarget):
+        """
+        Computes the cross-validation splits of a training run once and slices every feature
+        matrix into its folds once, however many model families and candidates are
+        cross-validated on it. The fold slices are shared read-only: estimators never modify
+        their input, and worker processes get them through joblib, which memory-maps large
+        arrays instead of copying them.
+
+        Args:
+            cv: Cross-validation splitting strategy, as for GridSearchCV.
+            TrainTarget (array-like): Target values of the training set.
+        """
+        cv = check_cv(cv, TrainTarget, classifier=True)
+        self.splits = list(cv.split(np.zeros((len(TrainTarget), 1)), TrainTarget))
+        self.target_folds = [(_safe_indexing(TrainTarget, train), _safe_indexing(TrainTarget, test)) for train, test in self.splits]
+        # Keyed by id(), the matrix is kept alongside so its id cannot be reused
+        self._folds = {}
+
+    def get_folds(self, TrainFeatures):
+        """
+        Returns the CVFolds of a feature matrix, slicing it on the first call only.
+        """
+        key = id(TrainFeatures)
+        if key not in self._folds:
+            folds = [
+                (_safe_indexing(TrainFeatures, train), y_train, _safe_indexing(TrainFeatures, test), y_test)
+                for (train, test), (y_train, y_test) in zip(self.splits, self.target_folds)
+            ]
+            self._folds[key] = (TrainFeatures, CVFolds(splits=self.splits, folds=folds))
+        return self._folds[key][1]
+
+
+def _fit_and_score_fold(model, params, fold):
+    X_train, y_train, X_test, y_test = fold
+    estimator = clone(model).set_params(**params)
+    try:
+        fit_start = time.perf_counter()
+        estimator.fit(X_train, y_train)
+        fit_time = time.perf_counter() - fit_start
+
+        score_start = time.perf_counter()
+        score = estimator.score(X_test, y_test)
+        score_time = time.perf_counter() - score_start
+    except Exception as e:
+        # Scored as NaN like GridSearchCV's default error_score, the other candidates go on
+        logging.warning(f"{type(model).__name__} fit failed for {params}: {e}")
+        return np.nan, 0.0, 0.0
+    return score, fit_time, score_time
+
+
+def _cross_validate(model, candidates, cv_folds, n_jobs):
+    """
+    Cross-validates every candidate on the cached folds and returns their timings, in the
+    format of _candidate_timings, with the mean test score of each.
+    """
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_and_score_fold)(model, candidate, fold)
+        for candidate in candidates for fold in cv_folds.folds
+    )
+
+    n_splits = len(cv_folds.folds)
+    n_samples = sum(len(fold[1]) + len(fold[3]) for fold in cv_folds.folds) // n_splits
+    timings = []
+    for index, candidate in enumerate(candidates):
+        scores, fit_times, score_times = zip(*results[index * n_splits:(index + 1) * n_splits])
+        timings.append({
+            "params": candidate,
+            "score": float(np.mean(scores)),
+            "fit_time": float(np.sum(fit_times)),
+            "score_time": float(np.sum(score_times)),
+            "rows": n_samples
+        })
+    return timings
+
+
+def _candidate_timings(cv_results, n_samples):
+    """
+    Reads the per candidate timings of a fitted search from its cv_results_.
+    """
+    n_splits = sum(1 for key in cv_results if key.startswith("split") and key.endswith("_test_score"))
+    timings = []
+    for index, params in enumerate(cv_results["params"]):
+        timings.append({
+            "params": params,
+            "score": float(cv_results["mean_test_score"][index]),
+            "fit_time": float(cv_results["mean_fit_time"][index]) * n_splits,
+            "score_time": float(cv_results["mean_score_time"][index]) * n_splits,
+            # Halving over n_samples fits the early rounds on a subsample
+            "rows": int(cv_results["n_resources"][index]) if "n_resources" in cv_results and n_samples is None else n_samples
+        })
+    return timings
+
+
+def _search_in_batches(model, candidates, TrainFeatures, TrainTarget, search_config, cv_folds, n_jobs):
+    """
+    Cross-validates the candidates a batch at a time and stops as soon as one of them
+    reaches search_config.stop_score. The best candidate is then refit on the full train set.
+    """
+    best_score, best_params = -np.inf, None
+    n_evaluated = 0
+    stopped_early = False
+    timings = []
+
+    for start in range(0, len(candidates), search_config.batch_size):
+        batch = candidates[start:start + search_config.batch_size]
+        batch_timings = _cross_validate(model, batch, cv_folds, n_jobs)
+        n_evaluated += len(batch)
+        timings.extend(batch_timings)
+
+        # Ties keep the earliest candidate, as GridSearchCV does
+        for timing in batch_timings:
+            if timing["score"] > best_score:
+                best_score, best_params = timing["score"], timing["params"]
+
+        if best_score >= search_config.stop_score:
+            stopped_early = n_evaluated < len(candidates)
+            break
+
+    if best_params is None:
+        raise ValueError(f"All {n_evaluated} candidates of {type(model).__name__} failed to fit")
+
+    refit_start = time.perf_counter()
+    best_estimator = clone(model).set_params(**best_params).fit(TrainFeatures, TrainTarget)
+    refit_time = time.perf_counter() - refit_start
+
+    return best_estimator, best_params, best_score, n_evaluated, stopped_early, timings, refit_time
+
+
+def _halving_search(model, param_grid, TrainFeatures, TrainTarget, search_config, cv, n_jobs):
+    """
+    Successive halving: every candidate starts with a small budget and only the best
+    1/factor of them move on to the next, larger, budget.
+    """
+    param_grid = dict(param_grid)
+    search_kwargs = dict(
+        factor=search_config.factor,
+        resource=search_config.resource,
+        cv=cv, n_jobs=n_jobs,
+        random_state=search_config.random_state
+    )
+
+    if search_config.resource != "n_samples":
+        # The resource is grown by the search itself, so it leaves the grid and its
+        # smallest and largest grid values become the budget bounds
+        values = param_grid.pop(search_config.resource, None) or [model.get_params()[search_config.resource]]
+        search_kwargs.update(min_resources=min(values), max_resources=max(values))
+        # CatBoost only lists explicitly set parameters, which the halving search requires
+        model = clone(model).set_params(**{search_config.resource: max(values)})
+
+    if len(ParameterGrid(param_grid)) > search_config.n_iter:
+        gs = HalvingRandomSearchCV(model, param_grid, n_candidates=search_config.n_iter, **search_kwargs)
+    else:
+        gs = HalvingGridSearchCV(model, param_grid, **search_kwargs)
+
+    gs.fit(TrainFeatures, TrainTarget)
+    n_evaluated = int(np.sum(gs.n_candidates_))
+    timings = _candidate_timings(gs.cv_results_, None if search_config.resource == "n_samples" else len(TrainTarget))
+
+    return gs.best_estimator_, gs.best_params_, gs.best_score_, n_evaluated, False, timings, gs.refit_time_
+
+
+def run_search(model, param_grid, TrainFeatures, TrainTarget, search_config=None, cv=3, n_jobs=None, cv_folds=None):
+    """
+    Runs a hyperparameter search for one model family.
+
+    Parameters
+    ----------
+    model : estimator
+        The estimator to tune, left unfitted
+    param_grid : dict
+        Parameter names mapped to the lists of values to try
+    TrainFeatures : array-like of shape (n_samples, n_features)
+        Features of the training set
+    TrainTarget : array-like of shape (n_samples,)
+        Target values of the training set
+    search_config : SearchConfig
+        The search strategy and its budget, exhaustive when None
+    cv : int or cross-validation generator
+        Cross-validation splitting strategy
+    n_jobs : int
+        Number of jobs used to fit the CV folds
+    cv_folds : CVFolds
+        Folds of TrainFeatures cached by a FoldCache, cut from cv when None
+
+    Returns
+    -------
+    result : SearchResult
+        The refit best estimator with its parameters, CV score and search cost
+    """
+    try:
+        search_config = search_config or SearchConfig()
+        start_time = time.perf_counter()
+        if cv_folds is None:
+            cv_folds = FoldCache(cv, TrainTarget).get_folds(TrainFeatures)
+
+        if search_config.strategy == "exhaustive":
+            candidates = list(ParameterGrid(param_grid))
+            outcome = _search_in_batches(model, candidates, TrainFeatures, TrainTarget, search_config, cv_folds, n_jobs)
+
+        elif search_config.strategy == "randomized":
+            candidates = list(ParameterSampler(param_grid, n_iter=min(search_config.n_iter, len(ParameterGrid(param_grid))),
+                                               random_state=search_config.random_state))
+            outcome = _search_in_batches(model, candidates, TrainFeatures, TrainTarget, search_config, cv_folds, n_jobs)
+
+        elif search_config.strategy == "halving":
+            # Halving resamples its rounds, it is only given the cached split indices
+            outcome = _halving_search(model, param_grid, TrainFeatures, TrainTarget, search_config, cv_folds.splits, n_jobs)
+
+        else:
+            raise ValueError(f"Unknown search strategy {search_config.strategy}, expected one of {SEARCH_STRATEGIES}")
+
+        best_estimator, best_params, best_score, n_candidates, stopped_early, candidate_timings, refit_time = outcome
+        n_splits = len(cv_folds.splits)
+
+        result = SearchResult(
+            best_estimator=best_estimator,
+            best_params=best_params,
+            best_score=float(best_score),
+            n_candidates=n_candidates,
+            # Every candidate is fit once per fold, plus the final refit
+            n_fits=n_candidates * n_splits + 1,
+            search_time=time.perf_counter() - start_time,
+            stopped_early=stopped_early,
+            candidate_timings=candidate_timings,
+            refit_time=refit_time
+        )
+
+        logging.info(
+            f"{type(model).__name__} {search_config.strategy} search: {result.n_fits} fits in "
+            f"{result.search_time:.2f}s, CV score {result.best_score:.4f}"
+            + (" (stopped early)" if stopped_early else "")
+        )
+
+        return result
+
+    except Exception as e:
+        raise MushroomException(e, sys)
@@ -0,0 +1,141 @@
+import os
+import sys
+import types
+import hashlib
+import dataclasses
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from mushroom.exception import MushroomException
+from mushroom.logger import logging
+from mushroom.utils.main_utils import save_object, load_object
+
+
+@dataclass
+class StageCacheConfig:
+    cache_dir: str = os.path.join('.cache', 'stages')
+    # Least recently used entries are evicted once the cache grows beyond this size
+    max_size_bytes: int = 2 * 1024 ** 3
+    # Recompute every stage and overwrite its cache entry
+    force: bool = False
+
+
+def _update_digest(digest, value):
+    """
+    Feeds a stage input into the digest: data by content, estimators by their parameters,
+    modules by their source code and everything else by its repr.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr(value.columns if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif sparse.issparse(value):
+        value = value.tocsr()
+        digest.update(repr((value.shape, value.dtype.str)).encode())
+        for array in (value.data, value.indices, value.indptr):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        digest.update(repr((value.shape, value.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, types.ModuleType):
+        with open(value.__file__, "rb") as file_obj:
+            digest.update(file_obj.read())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            digest.update(repr(key).encode())
+            _update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _update_digest(digest, item)
+    elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+        digest.update(type(value).__qualname__.encode())
+        _update_digest(digest, dataclasses.asdict(value))
+    elif hasattr(value, "get_params"):
+        digest.update(type(value).__qualname__.encode())
+        _update_digest(digest, value.get_params(deep=False))
+    else:
+        digest.update(repr(value).encode())
+    # Separator, so that consecutive inputs cannot run into each other
+    digest.update(b"\0")
+
+
+class StageCache:
+    def __init__(self, config: StageCacheConfig = None):
+        """
+        Content-addressed cache of pipeline stage results.
+
+        A stage computes a fingerprint from everything its result depends on (input data, code,
+        configuration) and looks it up before doing any work. Entries are pickles named after
+        the fingerprint, so an unchanged stage is skipped and its cached result reused.
+        """
+        self.cache_config = config or StageCacheConfig()
+        os.makedirs(self.cache_config.cache_dir, exist_ok=True)
+
+    def fingerprint(self, stage_name, *inputs):
+        """
+        Returns the fingerprint of a stage run, the sha256 over the stage name and its inputs.
+        File paths are not resolved, pass file contents through file_fingerprint().
+        """
+        digest = hashlib.sha256(stage_name.encode())
+        for value in inputs:
+            _update_digest(digest, value)
+        return digest.hexdigest()
+
+    @staticmethod
+    def file_fingerprint(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file_obj:
+            for block in iter(lambda: file_obj.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _entry_path(self, stage_name, fingerprint):
+        return os.path.join(self.cache_config.cache_dir, f"{stage_name}-{fingerprint[:32]}.pkl")
+
+    def load(self, stage_name, fingerprint):
+        """
+        Returns the cached result of the stage run, or None on a miss or when forced.
+        """
+        entry_path = self._entry_path(stage_name, fingerprint)
+        if self.cache_config.force or not os.path.exists(entry_path):
+            return None
+
+        try:
+            result = load_object(entry_path)
+        except MushroomException as e:
+            logging.warning(f"Ignoring unreadable cache entry {entry_path}: {e}")
+            return None
+
+        # The modification time orders the entries for LRU eviction
+        os.utime(entry_path)
+        logging.info(f"Stage {stage_name} unchanged, reusing cached result {fingerprint[:12]}")
+        return result
+
+    def store(self, stage_name, fingerprint, result):
+        """
+        Saves the result of the stage run, then evicts least recently used entries.
+        """
+        try:
+            save_object(self._entry_path(stage_name, fingerprint), result)
+            self.evict()
+
+        except Exception as e:
+            raise MushroomException(e, sys)
+
+    def evict(self):
+        cache_dir = self.cache_config.cache_dir
+        entries = []
+        for file_name in os.listdir(cache_dir):
+            if file_name.endswith(".pkl"):
+                stat = os.stat(os.path.join(cache_dir, file_name))
+                entries.append((stat.st_mtime, stat.st_size, file_name))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, file_name in sorted(entries):
+            if total_size <= self.cache_config.max_size_bytes:
+                break
+            os.remove(os.path.join(cache_dir, file_name))
+            total_size -= size
+            logging.info(f"Evicted stage cache entry {file_name}")
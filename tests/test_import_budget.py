@@ -0,0 +1,40 @@
+"""
+Import-time budgets of the package entry points, the checks of benchmarks/import_budget.py as
+tests. Every entry point is imported in a fresh interpreter under `python -X importtime` from
+an empty directory. IMPORT_BUDGET_SCALE multiplies the budgets on slower machines.
+"""
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.import_budget import ENTRY_POINTS, measure_import
+
+BUDGET_SCALE = float(os.environ.get("IMPORT_BUDGET_SCALE", 1.0))
+# Imports per entry point, the fastest one counts
+REPEAT = 3
+
+
+@pytest.mark.parametrize("entry_point, module, env, budget_ms, forbidden", ENTRY_POINTS, ids=[entry_point[0] for entry_point in ENTRY_POINTS])
+def test_import_budget(tmp_path, entry_point, module, env, budget_ms, forbidden):
+    runs = [measure_import(module, env, forbidden, str(tmp_path)) for _ in range(REPEAT)]
+    import_ms = min(import_ms for import_ms, _ in runs)
+    loaded = sorted(set().union(*(loaded for _, loaded in runs)))
+
+    assert not loaded, f"{module} imports {loaded} on import"
+    assert import_ms <= budget_ms * BUDGET_SCALE, f"{module} took {import_ms:.1f}ms to import, budget {budget_ms * BUDGET_SCALE:.0f}ms"
+
+
+def test_logger_import_has_no_side_effects(tmp_path):
+    # Only the entry points set up logging, a library import must not create the logs directory
+    subprocess.run(
+        [sys.executable, "-c", "import mushroom.logger, mushroom.utils.instrumentation"],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": ROOT_DIR},
+        check=True
+    )
+    assert not os.path.exists(tmp_path / "logs")
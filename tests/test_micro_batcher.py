@@ -0,0 +1,64 @@
+"""
+Batching behaviour of MicroBatcher: bursts are not held back for max_wait when no other caller
+is on its way, and a failing item only fails its own caller.
+"""
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mushroom.pipeline.micro_batcher import MicroBatcher
+
+WORK_SECONDS = 0.05
+MAX_WAIT = 0.5
+
+
+def test_burst_is_not_held_for_max_wait():
+    started = threading.Event()
+
+    def predict_batch(items):
+        started.set()
+        time.sleep(WORK_SECONDS)
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(predict_batch, max_wait=MAX_WAIT)
+    # The first call keeps the worker busy while the burst of two is queued behind it
+    with ThreadPoolExecutor(3) as executor:
+        first = executor.submit(batcher.submit, 0)
+        started.wait()
+        start_time = time.monotonic()
+        burst = [executor.submit(batcher.submit, item) for item in (1, 2)]
+        results = [future.result() for future in burst]
+        elapsed = time.monotonic() - start_time
+        first.result()
+
+    assert results == [2, 4]
+    # The burst waits for the running batch and its own, never for max_wait
+    assert elapsed < MAX_WAIT / 2
+
+
+def test_failing_item_only_fails_its_caller():
+    def predict_batch(items):
+        if 13 in items:
+            raise ValueError("bad item")
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(predict_batch)
+
+    def call(item):
+        try:
+            return batcher.submit(item)
+        except ValueError as e:
+            return e
+
+    with ThreadPoolExecutor(16) as executor:
+        results = list(executor.map(call, range(32)))
+
+    assert isinstance(results[13], ValueError)
+    assert [result for i, result in enumerate(results) if i != 13] == [i * 2 for i in range(32) if i != 13]
@@ -0,0 +1,75 @@
+"""
+Equivalence of the portable runtime with the model it was exported from: for every kind of
+runtime a preprocessor and model are fit on the mushroom dataset, exported, saved, loaded
+back and compared with the original on the held-out rows.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.tree import DecisionTreeClassifier
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mushroom.constants import FEATURE_COLUMNS, TARGET_COLUMN
+from mushroom.components.data_transformation import DataTransformation, encode_target
+from mushroom.components.model_compiler import ModelCompiler
+from mushroom.pipeline.portable_runtime import load_portable_runtime
+
+DATA_PATH = os.path.join(ROOT_DIR, "notebooks", "mushroom_data.csv")
+
+
+def _xgboost_classifier():
+    xgboost = pytest.importorskip("xgboost")
+    return xgboost.XGBClassifier(n_estimators=20, enable_categorical=True)
+
+
+# (runtime kind, preprocessing profile, model factory)
+CASES = {
+    "logistic_regression": ("linear", "onehot", lambda: LogisticRegression(max_iter=1000)),
+    "decision_tree": ("trees", "ordinal", lambda: DecisionTreeClassifier(random_state=0)),
+    "random_forest": ("trees", "ordinal", lambda: RandomForestClassifier(n_estimators=10, random_state=0)),
+    "gradient_boosting": ("table", "ordinal", lambda: GradientBoostingClassifier(n_estimators=20, random_state=0)),
+    "xgboost": ("table", "native", _xgboost_classifier),
+}
+
+
+@pytest.fixture(scope="module")
+def split():
+    df = pd.read_csv(DATA_PATH, dtype="category", usecols=list(FEATURE_COLUMNS) + [TARGET_COLUMN])
+    return train_test_split(df, test_size=0.25, random_state=42)
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_portable_runtime_matches_model(tmp_path, monkeypatch, split, case):
+    # The components create their artifacts directories in the working directory
+    monkeypatch.chdir(tmp_path)
+    kind, profile, make_model = CASES[case]
+    train_df, test_df = split
+
+    preprocessor = DataTransformation().get_data_transformer_object(profile)
+    train_features = preprocessor.fit_transform(train_df[FEATURE_COLUMNS])
+    model = make_model().fit(train_features, encode_target(train_df[TARGET_COLUMN]))
+
+    compiler = ModelCompiler()
+    table = compiler.compile_lookup_table(preprocessor, model, "test")
+    runtime = compiler.export_portable_runtime(preprocessor, model, table, "test")
+    assert runtime is not None and runtime.kind == kind
+
+    runtime_path = str(tmp_path / "portable_runtime.npz")
+    runtime.save(runtime_path)
+    loaded = load_portable_runtime(runtime_path)
+    assert loaded.kind == kind
+
+    test_features = test_df[FEATURE_COLUMNS]
+    data_scaled = preprocessor.transform(test_features)
+    codes = loaded.encoder.transform(test_features)
+
+    np.testing.assert_array_equal(loaded.model.predict(codes), model.predict(data_scaled))
+    np.testing.assert_allclose(loaded.model.predict_proba(codes), model.predict_proba(data_scaled), atol=1e-5)